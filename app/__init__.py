@@ -3,7 +3,6 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from flask_migrate import Migrate
 from config import Config
-import logging
 import os
 from sqlalchemy.engine import Engine
 from sqlalchemy import event
@@ -19,17 +18,15 @@ login_manager = LoginManager()
 login_manager.login_view = "auth.login"
 migrate = Migrate()
 
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.StreamHandler()
-    ],
-)
-
-def create_app():
+def create_app(config=None):
     app = Flask(__name__, static_folder="../static", template_folder="../templates")
     app.config.from_object(Config)
+    if config:
+        app.config.update(config)
+
+    from .logs import init_logging
+
+    init_logging(app)
 
     # File upload configurations
     app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB
@@ -53,6 +50,55 @@ def create_app():
     app.register_blueprint(main)
     app.register_blueprint(auth)
 
+    from .archival import ARCHIVE_WORKER, archive_expired
+    from .booking import init_booking_executor
+    from .cache import init_cache
+    from .consistency import CONSISTENCY_WORKER, consistency_command, run_consistency_scan
+    from .deletion import FILE_PURGE_WORKER, purge_pending_files
+    from .favorites import init_favorites
+    from .importer import import_command
+    from .ratelimit import init_ratelimit
+    from .recommendations import RECOMMENDATION_WORKER, refresh_recommendations
+    from .trending import TRENDING_FLUSH_WORKER, flush_counters
+    from .sessions import init_sessions
+    from .warmup import WARMUP_WORKER, init_warmup, warm_up
+    from .workers import register_worker, start_background_workers
+
+    init_cache(app)
+    init_sessions(app)
+    init_booking_executor(app)
+    init_favorites(app)
+    init_ratelimit(app)
+    app.cli.add_command(import_command)
+    app.cli.add_command(consistency_command)
+    register_worker(app, FILE_PURGE_WORKER, app.config["FILE_PURGE_INTERVAL"], purge_pending_files)
+    register_worker(
+        app, RECOMMENDATION_WORKER, app.config["RECOMMENDATION_INTERVAL"], refresh_recommendations
+    )
+    # 熱門計數存在各 process 的記憶體中，每個 process 都要自己寫入
+    register_worker(
+        app,
+        TRENDING_FLUSH_WORKER,
+        app.config["TRENDING_FLUSH_INTERVAL"],
+        flush_counters,
+        per_process=True,
+    )
+    register_worker(app, ARCHIVE_WORKER, app.config["ARCHIVE_INTERVAL"], archive_expired)
+    register_worker(
+        app, CONSISTENCY_WORKER, app.config["CONSISTENCY_INTERVAL"], run_consistency_scan
+    )
+    if app.config["CACHE_WARMUP"]:
+        # 第一輪在啟動後 CACHE_WARMUP_DELAY 秒執行，之後定期更新快照
+        register_worker(
+            app,
+            WARMUP_WORKER,
+            app.config["CACHE_SNAPSHOT_INTERVAL"],
+            warm_up,
+            initial_delay=app.config["CACHE_WARMUP_DELAY"],
+        )
+    init_warmup(app)
+    start_background_workers(app)
+
     with app.app_context():
         # Log some debug information about the app
         app.logger.debug(f"Static folder: {app.static_folder}")
@@ -0,0 +1,145 @@
+# archival.py
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from app import db
+from app.models import (
+    ArchivedBooking,
+    ArchivedFriendRequest,
+    ArchivedOrder,
+    ArchivedScreening,
+    Booking,
+    Cinema,
+    FriendRequest,
+    Hall,
+    Movie,
+    Order,
+    ScreeningTime,
+)
+from app.scheduling import invalidate_cinema_day
+
+ARCHIVE_WORKER = "archival"
+ARCHIVE_RETENTION_DAYS = 30
+ARCHIVE_BATCH_SIZE = 200
+
+
+def _copy(source, target, condition):
+    """把 source 中符合條件的列以 INSERT ... SELECT 複製到封存表，欄位名稱相同"""
+    columns = [column.name for column in source.__table__.columns]
+    db.session.execute(
+        db.insert(target).from_select(
+            columns, db.select(*[getattr(source, name) for name in columns]).where(condition)
+        )
+    )
+
+
+def archive_screenings(before, batch_size=ARCHIVE_BATCH_SIZE):
+    """
+    把 before 之前的場次連同訂單、訂位搬到封存表，每批 batch_size 個場次一個交易
+    座位狀態（Seat）不封存，刪除場次時由 ON DELETE CASCADE 一併清除
+    回傳封存的場次數
+    """
+    archived = 0
+    while True:
+        rows = (
+            db.session.query(ScreeningTime.id, ScreeningTime.cinema_id, ScreeningTime.date)
+            .filter(ScreeningTime.date < before)
+            .order_by(ScreeningTime.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            return archived
+        ids = [screening_id for screening_id, _, _ in rows]
+        _copy(ScreeningTime, ArchivedScreening, ScreeningTime.id.in_(ids))
+        _copy(Order, ArchivedOrder, Order.screening_id.in_(ids))
+        _copy(Booking, ArchivedBooking, Booking.screening_id.in_(ids))
+        db.session.execute(db.delete(ScreeningTime).where(ScreeningTime.id.in_(ids)))
+        db.session.commit()
+        # 批次刪除不經過 ORM 事件，自行清除排程快取
+        for cinema_id, day in {(cinema_id, date.date()) for _, cinema_id, date in rows}:
+            invalidate_cinema_day(cinema_id, day)
+        archived += len(ids)
+
+
+def archive_friend_requests(batch_size=ARCHIVE_BATCH_SIZE):
+    """把已接受或拒絕的好友邀請搬到封存表，每批一個交易，回傳封存筆數"""
+    archived = 0
+    while True:
+        ids = [
+            request_id
+            for request_id, in db.session.query(FriendRequest.id)
+            .filter(FriendRequest.status != "pending")
+            .order_by(FriendRequest.id)
+            .limit(batch_size)
+        ]
+        if not ids:
+            return archived
+        _copy(FriendRequest, ArchivedFriendRequest, FriendRequest.id.in_(ids))
+        db.session.execute(db.delete(FriendRequest).where(FriendRequest.id.in_(ids)))
+        db.session.commit()
+        archived += len(ids)
+
+
+def archive_expired(now=None):
+    """背景工作：封存超過 ARCHIVE_RETENTION_DAYS 的場次與已處理的好友邀請"""
+    now = now or datetime.now()
+    retention = current_app.config.get("ARCHIVE_RETENTION_DAYS", ARCHIVE_RETENTION_DAYS)
+    batch_size = current_app.config.get("ARCHIVE_BATCH_SIZE", ARCHIVE_BATCH_SIZE)
+    screenings = archive_screenings(now - timedelta(days=retention), batch_size)
+    friend_requests = archive_friend_requests(batch_size)
+    if screenings or friend_requests:
+        current_app.logger.info(
+            f"Archived {screenings} screening(s) and {friend_requests} friend request(s)"
+        )
+    return screenings, friend_requests
+
+
+# ---- 查詢：目前資料與封存資料合併 ----
+
+def _booking_rows(booking, order, screening, archived):
+    return (
+        db.select(
+            booking.id,
+            booking.order_id,
+            booking.seat_number,
+            screening.date.label("screening_date"),
+            Movie.title.label("movie_title"),
+            Cinema.name.label("cinema_name"),
+            Hall.name.label("hall_name"),
+            db.func.coalesce(order.unit_price, screening.price).label("price"),
+            db.literal(archived).label("archived"),
+        )
+        .join(screening, booking.screening_id == screening.id)
+        .join(Movie, screening.movie_id == Movie.id)
+        .join(Cinema, screening.cinema_id == Cinema.id)
+        .join(Hall, screening.hall_id == Hall.id)
+        .outerjoin(order, booking.order_id == order.id)
+    )
+
+
+def booking_history(user_id=None):
+    """
+    訂位紀錄的 UNION ALL 子查詢：目前的訂位與已封存的訂位，archived 欄位區分來源
+    指定 user_id 時在兩邊各自過濾，封存表也能走 user_id 索引
+    """
+    hot = _booking_rows(Booking, Order, ScreeningTime, False)
+    cold = _booking_rows(ArchivedBooking, ArchivedOrder, ArchivedScreening, True)
+    if user_id is not None:
+        hot = hot.where(Booking.user_id == user_id)
+        cold = cold.where(ArchivedBooking.user_id == user_id)
+    return db.union_all(hot, cold).subquery("booking_history")
+
+
+def user_booking_history(user_id):
+    """回傳使用者所有訂位（場次時間新的在前）"""
+    history = booking_history(user_id)
+    return db.session.execute(
+        db.select(history).order_by(history.c.screening_date.desc(), history.c.id)
+    ).all()
+
+
+def get_order(order_id):
+    """依 id 讀取訂單，已封存的訂單從封存表讀取"""
+    return db.session.get(Order, order_id) or db.session.get(ArchivedOrder, order_id)
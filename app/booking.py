@@ -0,0 +1,430 @@
+# booking.py
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from app import db
+from app.cache import cached
+from app.models import Booking, Order, ScreeningTime, SeatHold
+from app.rollups import apply_booking_deltas
+from app.seating import hall_layout
+from app.trending import record_after_commit
+
+# ok=False 時 error 為 "already_booked" / "not_found" / "forbidden" / "invalid_seat"（不在影廳配置內或超過座位數）
+# "busy" 為資料庫重試後仍被鎖住，由 _run 轉為 BookingBusy
+BookingResult = namedtuple("BookingResult", ["ok", "order_id", "error"])
+# ok=False 時 error 為 "not_found" / "no_block"（沒有足夠的相鄰空位）/ "conflict"；沒有保留時 expires_at 為 None
+AllocationResult = namedtuple("AllocationResult", ["ok", "seats", "expires_at", "error"])
+
+Reserve = namedtuple("Reserve", ["user_id", "screening_id", "seats"])
+Cancel = namedtuple("Cancel", ["user_id", "screening_id", "booking_id"])
+Allocate = namedtuple("Allocate", ["user_id", "screening_id", "party_size", "hold_seconds"])
+
+
+BOOKED_SEATS_TIMEOUT = 30
+
+
+@cached(timeout=BOOKED_SEATS_TIMEOUT, key_prefix="booked_seats", stale_ttl=0)
+def booked_seats(screening_id):
+    """場次已訂座位（frozenset）；寫入佇列提交後清除，其他 process 最多舊 BOOKED_SEATS_TIMEOUT 秒"""
+    return frozenset(
+        seat_number
+        for seat_number, in db.session.query(Booking.seat_number).filter(
+            Booking.screening_id == screening_id
+        )
+    )
+
+
+def booked_seats_for(screening_ids):
+    """多個場次的已訂座位，一次查詢：{screening_id: frozenset}（暖機用）"""
+    result = {screening_id: set() for screening_id in screening_ids}
+    if not result:
+        return {}
+    for screening_id, seat_number in db.session.query(
+        Booking.screening_id, Booking.seat_number
+    ).filter(Booking.screening_id.in_(result)):
+        result[screening_id].add(seat_number)
+    return {screening_id: frozenset(seats) for screening_id, seats in result.items()}
+
+
+class BookingQueueFull(Exception):
+    """該場次的佇列已滿，直接拒絕（不排隊等待）"""
+
+
+class BookingTimeout(Exception):
+    """在時限內沒有輪到處理，請求已撤回，沒有寫入任何資料"""
+
+
+class BookingBusy(Exception):
+    """資料庫被其他 process 鎖住，重試後仍無法提交，沒有寫入任何資料"""
+
+
+def _is_locked(error):
+    return "locked" in str(error.orig)
+
+
+def _commit_with_retry(intents):
+    """
+    套用並提交；prefork 時每個 process 各有寫入佇列，可能遇到 database is locked，
+    rollback 後稍等重試，超過 BOOKING_LOCK_RETRIES 次則拋出 BookingBusy
+    """
+    retries = current_app.config.get("BOOKING_LOCK_RETRIES", 3)
+    for attempt in range(retries + 1):
+        try:
+            results = _apply_batch(intents)
+            db.session.commit()
+            return results
+        except OperationalError as e:
+            db.session.rollback()
+            if not _is_locked(e):
+                raise
+            if attempt == retries:
+                raise BookingBusy(intents[0].screening_id) from e
+            time.sleep(0.05 * 2 ** attempt)
+
+
+def _add_delta(deltas, screening_id, seats, revenue):
+    old_seats, old_revenue = deltas.get(screening_id, (0, 0))
+    deltas[screening_id] = (old_seats + seats, old_revenue + revenue)
+
+
+def _apply_reserve(intent, screening, taken, held, deltas):
+    """
+    在目前的交易中建立訂單；taken 為該場次已被佔用的座位（含同批次先處理的請求）
+    held 為該場次保留中的座位 {座位: 使用者}，別人保留的座位不能訂，自己保留的座位訂位後釋出
+    """
+    if screening is None:
+        return BookingResult(False, None, "not_found")
+    if taken.intersection(intent.seats) or any(
+        held.get(seat, intent.user_id) != intent.user_id for seat in intent.seats
+    ):
+        return BookingResult(False, None, "already_booked")
+    # 在寫入端擋下超賣：座位要在影廳配置內，且訂位總數不超過影廳座位數
+    if not hall_layout(screening.hall).seat_numbers.issuperset(intent.seats) or (
+        len(taken) + len(intent.seats) > screening.hall.size
+    ):
+        return BookingResult(False, None, "invalid_seat")
+    taken.update(intent.seats)
+    own_holds = [seat for seat in intent.seats if seat in held]
+    if own_holds:
+        _release_holds(screening.id, own_holds, held)
+    order = Order(
+        user_id=intent.user_id,
+        screening_id=intent.screening_id,
+        unit_price=screening.price,
+        seat_count=len(intent.seats),
+        total=screening.price * len(intent.seats),
+    )
+    db.session.add(order)
+    for seat in intent.seats:
+        db.session.add(
+            Booking(
+                user_id=intent.user_id,
+                screening_id=intent.screening_id,
+                seat_number=seat,
+                order=order,
+            )
+        )
+    _add_delta(deltas, screening.id, len(intent.seats), screening.price * len(intent.seats))
+    record_after_commit(db.session, screening.movie_id, "booking", len(intent.seats))
+    return order
+
+
+def _release_holds(screening_id, seats, held):
+    db.session.execute(
+        db.delete(SeatHold).where(
+            SeatHold.screening_id == screening_id, SeatHold.seat_number.in_(seats)
+        )
+    )
+    for seat in seats:
+        del held[seat]
+
+
+def _apply_allocate(intent, screening, taken, held, now):
+    """
+    依影廳配置選出最佳的相鄰空位；hold_seconds 大於 0 時在同一個交易中保留這些座位
+    同一使用者重新選位時，先釋出他在該場次原本保留的座位
+    """
+    if screening is None:
+        return AllocationResult(False, None, None, "not_found")
+    if intent.hold_seconds:
+        own_holds = [seat for seat, user_id in held.items() if user_id == intent.user_id]
+        if own_holds:
+            _release_holds(screening.id, own_holds, held)
+    seats = hall_layout(screening.hall).best_block(taken.union(held), intent.party_size)
+    if seats is None:
+        return AllocationResult(False, None, None, "no_block")
+    if not intent.hold_seconds:
+        return AllocationResult(True, seats, None, None)
+    expires_at = now + timedelta(seconds=intent.hold_seconds)
+    db.session.execute(
+        db.insert(SeatHold),
+        [
+            {
+                "screening_id": screening.id,
+                "seat_number": seat,
+                "user_id": intent.user_id,
+                "expires_at": expires_at,
+            }
+            for seat in seats
+        ],
+    )
+    held.update((seat, intent.user_id) for seat in seats)
+    return AllocationResult(True, seats, expires_at, None)
+
+
+def _apply_cancel(intent, bookings, taken, deltas):
+    booking = bookings.get(intent.booking_id)
+    if booking is None:
+        return BookingResult(False, None, "not_found")
+    if booking.user_id != intent.user_id:
+        return BookingResult(False, None, "forbidden")
+    if booking.order is not None:
+        # 訂單總價以訂位時的單價扣除
+        booking.order.seat_count -= 1
+        booking.order.total -= booking.order.unit_price
+        _add_delta(deltas, booking.screening_id, -1, -booking.order.unit_price)
+    else:
+        _add_delta(deltas, booking.screening_id, -1, -booking.screening.price)
+    taken.discard(booking.seat_number)
+    db.session.delete(booking)
+    del bookings[intent.booking_id]
+    return BookingResult(True, booking.order_id, None)
+
+
+def _apply_batch(intents):
+    """
+    在目前的交易中套用一批請求，依序處理，回傳與 intents 對應的結果
+    已佔用座位、保留中的座位與要取消的訂位各以一次查詢載入，過期的保留先刪除
+    """
+    now = datetime.now()
+    screening_ids = {intent.screening_id for intent in intents}
+    screenings = {
+        screening.id: screening
+        for screening in ScreeningTime.query.options(db.joinedload(ScreeningTime.hall)).filter(
+            ScreeningTime.id.in_(screening_ids)
+        )
+    }
+    taken = {screening_id: set() for screening_id in screening_ids}
+    for screening_id, seat_number in db.session.query(
+        Booking.screening_id, Booking.seat_number
+    ).filter(Booking.screening_id.in_(screening_ids)):
+        taken[screening_id].add(seat_number)
+
+    db.session.execute(
+        db.delete(SeatHold).where(
+            SeatHold.screening_id.in_(screening_ids), SeatHold.expires_at <= now
+        )
+    )
+    held = {screening_id: {} for screening_id in screening_ids}
+    for screening_id, seat_number, user_id in db.session.query(
+        SeatHold.screening_id, SeatHold.seat_number, SeatHold.user_id
+    ).filter(SeatHold.screening_id.in_(screening_ids)):
+        held[screening_id][seat_number] = user_id
+
+    cancel_ids = [intent.booking_id for intent in intents if isinstance(intent, Cancel)]
+    bookings = (
+        {booking.id: booking for booking in Booking.query.filter(Booking.id.in_(cancel_ids))}
+        if cancel_ids
+        else {}
+    )
+
+    results = []
+    deltas = {}
+    for intent in intents:
+        screening = screenings.get(intent.screening_id)
+        if isinstance(intent, Reserve):
+            results.append(
+                _apply_reserve(
+                    intent, screening, taken[intent.screening_id], held[intent.screening_id], deltas
+                )
+            )
+        elif isinstance(intent, Allocate):
+            results.append(
+                _apply_allocate(
+                    intent, screening, taken[intent.screening_id], held[intent.screening_id], now
+                )
+            )
+        else:
+            results.append(_apply_cancel(intent, bookings, taken[intent.screening_id], deltas))
+    db.session.flush()
+    # 營運彙總在同一個交易中更新
+    apply_booking_deltas(deltas)
+    # 訂單 id 要在 flush 之後才有
+    return [
+        BookingResult(True, result.id, None) if isinstance(result, Order) else result
+        for result in results
+    ]
+
+
+def process_batch(intents):
+    """
+    一個交易提交整批請求（group commit）
+    其他 process 同時寫入造成唯一鍵衝突時，改為逐筆提交，只讓衝突的那筆失敗
+    資料庫被鎖住時整批重試；仍失敗則拋出 BookingBusy（逐筆提交時只讓該筆回傳 "busy"）
+    """
+    try:
+        results = _commit_with_retry(intents)
+        _invalidate_booked_seats(intents)
+        return results
+    except IntegrityError:
+        db.session.rollback()
+
+    results = []
+    for intent in intents:
+        try:
+            results.extend(_commit_with_retry([intent]))
+        except IntegrityError:
+            db.session.rollback()
+            if isinstance(intent, Allocate):
+                results.append(AllocationResult(False, None, None, "conflict"))
+            else:
+                results.append(BookingResult(False, None, "already_booked"))
+        except BookingBusy:
+            # 前面的請求可能已經提交，不能整批失敗
+            if isinstance(intent, Allocate):
+                results.append(AllocationResult(False, None, None, "busy"))
+            else:
+                results.append(BookingResult(False, None, "busy"))
+    _invalidate_booked_seats(intents)
+    return results
+
+
+def _invalidate_booked_seats(intents):
+    for screening_id in {intent.screening_id for intent in intents if not isinstance(intent, Allocate)}:
+        booked_seats.invalidate(screening_id)
+
+
+class BookingShard(threading.Thread):
+    """單一寫入者：依序取出佇列中的請求，湊成一批後一次提交"""
+
+    def __init__(self, app, index, queue_size, batch_size, batch_wait):
+        super().__init__(name=f"booking-shard-{index}", daemon=True)
+        self.app = app
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+
+    def _next_batch(self):
+        batch = [self.queue.get()]
+        while len(batch) < self.batch_size:
+            try:
+                # 短暫等待，讓同時湧入的請求併入同一批
+                batch.append(self.queue.get(timeout=self.batch_wait))
+            except queue.Empty:
+                break
+        # 已被呼叫端撤回（逾時）的請求不處理
+        return [(intent, future) for intent, future in batch if future.set_running_or_notify_cancel()]
+
+    def run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                continue
+            with self.app.app_context():
+                try:
+                    results = process_batch([intent for intent, _ in batch])
+                except Exception as e:
+                    db.session.rollback()
+                    self.app.logger.exception(f"Booking batch failed on {self.name}")
+                    for _, future in batch:
+                        future.set_exception(e)
+                    continue
+                finally:
+                    db.session.remove()
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+
+class BookingExecutor:
+    """
+    依場次分片的訂位寫入佇列
+    同一場次的請求一定進同一個分片，由該分片的執行緒依序處理
+    執行緒在第一次送出請求時才啟動（prefork 的 worker 在 fork 後各自建立）
+    """
+
+    def __init__(self, app, shards=4, queue_size=100, batch_size=50, batch_wait=0.005, timeout=5):
+        self.app = app
+        self.shard_count = shards
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.timeout = timeout
+        self._shards = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _get_shards(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._shards = [
+                        BookingShard(self.app, i, self.queue_size, self.batch_size, self.batch_wait)
+                        for i in range(self.shard_count)
+                    ]
+                    for shard in self._shards:
+                        shard.start()
+                    self._pid = os.getpid()
+        return self._shards
+
+    def submit(self, intent):
+        shards = self._get_shards()
+        future = Future()
+        try:
+            shards[intent.screening_id % len(shards)].queue.put_nowait((intent, future))
+        except queue.Full:
+            raise BookingQueueFull(intent.screening_id)
+        try:
+            return future.result(self.timeout)
+        except FutureTimeout:
+            # 還沒開始處理就撤回；已在處理中則等它完成，結果才不會遺失
+            if future.cancel():
+                raise BookingTimeout(intent.screening_id)
+            return future.result()
+
+
+def _run(intent):
+    executor = current_app.extensions.get("booking_executor")
+    if executor is None:
+        # 關閉佇列時（例如測試）直接在 request 中處理
+        result = process_batch([intent])[0]
+    else:
+        result = executor.submit(intent)
+    if not result.ok and result.error == "busy":
+        raise BookingBusy(intent.screening_id)
+    return result
+
+
+def reserve_seats(user_id, screening_id, seats):
+    return _run(Reserve(user_id, screening_id, tuple(seats)))
+
+
+def cancel_booking(user_id, booking):
+    return _run(Cancel(user_id, booking.screening_id, booking.id))
+
+
+def allocate_seats(user_id, screening_id, party_size, hold_seconds=0):
+    """選出 party_size 個最佳相鄰空位；hold_seconds > 0 時一併保留，回傳 AllocationResult"""
+    return _run(Allocate(user_id, screening_id, party_size, hold_seconds))
+
+
+def init_booking_executor(app):
+    if not app.config.get("BOOKING_EXECUTOR", True):
+        return None
+    executor = BookingExecutor(
+        app,
+        shards=app.config.get("BOOKING_SHARDS", 4),
+        queue_size=app.config.get("BOOKING_QUEUE_SIZE", 100),
+        batch_size=app.config.get("BOOKING_BATCH_SIZE", 50),
+        batch_wait=app.config.get("BOOKING_BATCH_WAIT", 0.005),
+        timeout=app.config.get("BOOKING_TIMEOUT", 5),
+    )
+    app.extensions["booking_executor"] = executor
+    return executor
@@ -0,0 +1,348 @@
+# cache.py
+import functools
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, has_app_context
+
+CACHE_SWEEP_WORKER = "cache-sweep"
+
+
+class MemoryBackend:
+    """單一 process 的 LRU；每筆資料帶 fresh_until / stale_until"""
+
+    def __init__(self, max_entries=5000):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if entry[2] is not None and entry[2] <= time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return entry
+
+    def set(self, key, value, fresh_until, stale_until):
+        with self._lock:
+            self._data[key] = (value, fresh_until, stale_until)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def acquire(self, key, ttl):
+        # 同一 process 內的互斥由 Cache 的 thread lock 處理
+        return True
+
+    def release(self, key):
+        pass
+
+
+class SqliteBackend:
+    """
+    多個 worker process 共用的本機快取（instance/ 下的 SQLite 檔案）
+    acquire / release 以 cache_lock 資料表做跨 process 的 single-flight
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        # fork 之後子 process 不能沿用父 process 的連線
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset_connections)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, "
+                "fresh_until REAL NOT NULL, stale_until REAL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache_lock (key TEXT PRIMARY KEY, expires_at REAL NOT NULL)"
+            )
+
+    def _reset_connections(self):
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._connect().execute(
+            "SELECT value, fresh_until, stale_until FROM cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        value, fresh_until, stale_until = row
+        if stale_until is not None and stale_until <= time.time():
+            return None
+        return pickle.loads(value), fresh_until, stale_until
+
+    def set(self, key, value, fresh_until, stale_until):
+        self._connect().execute(
+            "INSERT OR REPLACE INTO cache (key, value, fresh_until, stale_until) VALUES (?, ?, ?, ?)",
+            (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), fresh_until, stale_until),
+        )
+
+    def delete(self, key):
+        self._connect().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def clear(self):
+        self._connect().execute("DELETE FROM cache")
+
+    def acquire(self, key, ttl):
+        now = time.time()
+        conn = self._connect()
+        # 過期的鎖（持有者當掉）直接覆蓋
+        conn.execute("DELETE FROM cache_lock WHERE key = ? AND expires_at <= ?", (key, now))
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO cache_lock (key, expires_at) VALUES (?, ?)", (key, now + ttl)
+        )
+        return cursor.rowcount == 1
+
+    def release(self, key):
+        self._connect().execute("DELETE FROM cache_lock WHERE key = ?", (key,))
+
+    def sweep(self, batch_size=500):
+        """刪除已超過 stale 期限的資料，分批進行"""
+        conn = self._connect()
+        removed = 0
+        while True:
+            count = conn.execute(
+                "DELETE FROM cache WHERE key IN ("
+                "SELECT key FROM cache WHERE stale_until IS NOT NULL AND stale_until <= ? LIMIT ?)",
+                (time.time(), batch_size),
+            ).rowcount
+            removed += count
+            if count < batch_size:
+                return removed
+
+
+class Cache:
+    """
+    快取介面
+    - get_or_compute：single-flight，同一個 key 同時只有一個呼叫者重新計算
+    - 過期但仍在 stale 期間的資料直接回傳，並在背景重新計算（stale-while-revalidate）
+    """
+
+    def __init__(self, backend=None, default_timeout=60, stale_ttl=30, lock_timeout=10):
+        self.backend = backend or MemoryBackend()
+        self.default_timeout = default_timeout
+        self.stale_ttl = stale_ttl
+        self.lock_timeout = lock_timeout
+        self._locks_guard = threading.Lock()
+        self._locks = {}
+        self._events = {}
+
+    def configure(self, backend, default_timeout, stale_ttl, lock_timeout):
+        self.backend = backend
+        self.default_timeout = default_timeout
+        self.stale_ttl = stale_ttl
+        self.lock_timeout = lock_timeout
+
+    # ---- 基本操作 ----
+
+    def get(self, key, default=None):
+        entry = self.backend.get(key)
+        return entry[0] if entry is not None else default
+
+    def set(self, key, value, timeout=None, stale_ttl=None):
+        """timeout 為 0 時永不過期"""
+        timeout = self.default_timeout if timeout is None else timeout
+        stale_ttl = self.stale_ttl if stale_ttl is None else stale_ttl
+        if timeout:
+            fresh_until = time.time() + timeout
+            stale_until = fresh_until + stale_ttl
+        else:
+            fresh_until = float("inf")
+            stale_until = None
+        self.backend.set(key, value, fresh_until, stale_until)
+
+    def delete(self, key):
+        self.backend.delete(key)
+
+    def clear(self):
+        self.backend.clear()
+
+    def version(self, name):
+        """命名空間版本號；bump_version 後舊版本的 key 自然失效"""
+        key = f"version:{name}"
+        version = self.get(key)
+        if version is None:
+            version = time.time_ns()
+            self.set(key, version, timeout=0)
+        return version
+
+    def bump_version(self, name):
+        self.set(f"version:{name}", time.time_ns(), timeout=0)
+
+    # ---- single-flight ----
+
+    def _try_lock(self, key):
+        with self._locks_guard:
+            if key in self._locks:
+                return False
+            self._locks[key] = True
+            self._events[key] = threading.Event()
+        if self.backend.acquire(key, self.lock_timeout):
+            return True
+        self._unlock(key, release_backend=False)
+        return False
+
+    def _unlock(self, key, release_backend=True):
+        if release_backend:
+            self.backend.release(key)
+        with self._locks_guard:
+            self._locks.pop(key, None)
+            event = self._events.pop(key, None)
+        if event is not None:
+            event.set()
+
+    def _wait(self, key, timeout):
+        with self._locks_guard:
+            event = self._events.get(key)
+        if event is not None:
+            event.wait(timeout)
+        else:
+            # 鎖在其他 process 手上，短暫輪詢
+            time.sleep(min(0.05, timeout))
+
+    def _compute_and_store(self, key, func, timeout, stale_ttl):
+        value = func()
+        self.set(key, value, timeout, stale_ttl)
+        return value
+
+    def _refresh_in_background(self, key, func, timeout, stale_ttl):
+        app = current_app._get_current_object() if has_app_context() else None
+
+        def run():
+            try:
+                if app is not None:
+                    with app.app_context():
+                        self._compute_and_store(key, func, timeout, stale_ttl)
+                else:
+                    self._compute_and_store(key, func, timeout, stale_ttl)
+            except Exception:
+                if app is not None:
+                    app.logger.exception(f"Cache refresh failed for {key}")
+            finally:
+                self._unlock(key)
+
+        threading.Thread(target=run, name=f"cache-refresh:{key}", daemon=True).start()
+
+    def get_or_compute(self, key, func, timeout=None, stale_ttl=None):
+        entry = self.backend.get(key)
+        now = time.time()
+        if entry is not None:
+            value, fresh_until, _ = entry
+            if now < fresh_until:
+                return value
+            # stale：先回傳舊資料，搶到鎖的人在背景更新
+            if self._try_lock(key):
+                self._refresh_in_background(key, func, timeout, stale_ttl)
+            return value
+
+        deadline = now + self.lock_timeout
+        while True:
+            if self._try_lock(key):
+                try:
+                    entry = self.backend.get(key)
+                    if entry is not None and time.time() < entry[1]:
+                        return entry[0]
+                    return self._compute_and_store(key, func, timeout, stale_ttl)
+                finally:
+                    self._unlock(key)
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                # 等太久（持有者可能當掉），自己計算
+                return self._compute_and_store(key, func, timeout, stale_ttl)
+            self._wait(key, remaining)
+            entry = self.backend.get(key)
+            if entry is not None:
+                return entry[0]
+
+
+cache = Cache()
+
+
+def cached(timeout=None, key_prefix=None, stale_ttl=None, key=None):
+    """
+    快取函式結果的 decorator
+    key 可以是 callable(*args, **kwargs) -> str；預設以函式名稱與參數組成
+    """
+
+    def decorator(func):
+        prefix = key_prefix or f"{func.__module__}.{func.__qualname__}"
+
+        def cache_key(*args, **kwargs):
+            if key is not None:
+                return f"{prefix}:{key(*args, **kwargs)}"
+            parts = [repr(arg) for arg in args]
+            parts += [f"{name}={value!r}" for name, value in sorted(kwargs.items())]
+            return f"{prefix}:{','.join(parts)}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return cache.get_or_compute(
+                cache_key(*args, **kwargs), lambda: func(*args, **kwargs), timeout, stale_ttl
+            )
+
+        def prime(value, *args, **kwargs):
+            """直接寫入已算好的結果（暖機、從快照載入時用）"""
+            cache.set(cache_key(*args, **kwargs), value, timeout, stale_ttl)
+
+        def invalidate(*args, **kwargs):
+            cache.delete(cache_key(*args, **kwargs))
+
+        wrapper.uncached = func
+        wrapper.prime = prime
+        wrapper.invalidate = invalidate
+        return wrapper
+
+    return decorator
+
+
+def init_cache(app):
+    """依 CACHE_BACKEND 設定快取：memory（單一 process）/ sqlite（多 worker 共用）"""
+    backend_name = app.config.get("CACHE_BACKEND", "memory")
+    if backend_name == "memory":
+        backend = MemoryBackend(app.config.get("CACHE_MEMORY_MAX_ENTRIES", 5000))
+    elif backend_name == "sqlite":
+        path = app.config.get("CACHE_SQLITE_PATH") or os.path.join(app.instance_path, "cache.db")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        backend = SqliteBackend(path)
+    else:
+        raise ValueError(f"Unknown CACHE_BACKEND: {backend_name}")
+    cache.configure(
+        backend,
+        default_timeout=app.config.get("CACHE_DEFAULT_TIMEOUT", 60),
+        stale_ttl=app.config.get("CACHE_STALE_TTL", 30),
+        lock_timeout=app.config.get("CACHE_LOCK_TIMEOUT", 10),
+    )
+
+    if backend_name == "sqlite":
+        from .workers import register_worker
+
+        register_worker(app, CACHE_SWEEP_WORKER, app.config.get("CACHE_SWEEP_INTERVAL", 300), backend.sweep)
+    return cache
@@ -0,0 +1,326 @@
+# consistency.py
+import time
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from app import db
+from app.models import (
+    ArchivedScreening,
+    Booking,
+    Friend,
+    Movie,
+    MovieRatingHistogram,
+    Order,
+    Review,
+    ScreeningStats,
+    ScreeningTime,
+    user_favorites,
+)
+from app.rollups import expected_screening_stats, refresh_screening_stats
+
+CONSISTENCY_WORKER = "consistency-scan"
+CHUNK_SIZE = 500
+EPSILON = 1e-6
+
+# 反正規化欄位與衍生資料的一致性檢查
+# 每項檢查依主鍵分段掃描，每段一個短交易：先讀取比對，有偏差才寫入修復
+# 修復一律以 SQL 子查詢在寫入當下重算，不會用讀取時的舊值覆蓋同時間的使用者寫入
+
+
+def _chunks(id_column, chunk_size):
+    """依主鍵遞增分段，回傳每段的 (第一個 id, 最後一個 id)"""
+    last_id = None
+    while True:
+        query = db.select(id_column).order_by(id_column).limit(chunk_size)
+        if last_id is not None:
+            query = query.where(id_column > last_id)
+        ids = db.session.scalars(query).all()
+        if not ids:
+            return
+        yield ids[0], ids[-1]
+        last_id = ids[-1]
+
+
+def _differs(a, b):
+    return abs((a or 0) - (b or 0)) > EPSILON
+
+
+def _check_movies(first_id, last_id, now):
+    """評分、評論數、收藏數與是否上映中；回傳 (掃描數, 評論統計有偏差的電影 id, 其他欄位有偏差的電影 id)"""
+    in_chunk = Movie.id.between(first_id, last_id)
+    reviews = {
+        movie_id: (count, average)
+        for movie_id, count, average in db.session.execute(
+            db.select(
+                Review.movie_id,
+                db.func.count(),
+                # 與評分分布相同：以 0.5 分為一級計算平均
+                db.func.avg(db.func.round(Review.rate * 2)) / 2.0,
+            )
+            .where(Review.movie_id.between(first_id, last_id))
+            .group_by(Review.movie_id)
+        )
+    }
+    favorites = dict(
+        db.session.execute(
+            db.select(user_favorites.c.movie_id, db.func.count())
+            .where(user_favorites.c.movie_id.between(first_id, last_id))
+            .group_by(user_favorites.c.movie_id)
+        ).all()
+    )
+    showing = set(
+        db.session.scalars(
+            db.select(ScreeningTime.movie_id)
+            .where(ScreeningTime.movie_id.between(first_id, last_id), ScreeningTime.date >= now)
+            .distinct()
+        )
+    )
+    review_drift, other_drift = [], []
+    scanned = 0
+    for movie_id, rating, comments_count, favorites_count, is_current in db.session.execute(
+        db.select(
+            Movie.id, Movie.rating, Movie.comments_count, Movie.favorites_count, Movie.is_current
+        ).where(in_chunk)
+    ):
+        scanned += 1
+        count, average = reviews.get(movie_id, (0, 0.0))
+        if comments_count != count or _differs(rating, average):
+            review_drift.append(movie_id)
+        elif favorites_count != favorites.get(movie_id, 0) or is_current != (movie_id in showing):
+            other_drift.append(movie_id)
+    return scanned, review_drift, other_drift
+
+
+def _repair_movies(review_drift, other_drift, now):
+    for movie_id in review_drift:
+        MovieRatingHistogram.rebuild(movie_id)
+    if review_drift:
+        average = (
+            db.select(
+                db.func.sum(MovieRatingHistogram.bucket * MovieRatingHistogram.count)
+                / (2.0 * db.func.sum(MovieRatingHistogram.count))
+            )
+            .where(MovieRatingHistogram.movie_id == Movie.id, MovieRatingHistogram.count > 0)
+            .scalar_subquery()
+        )
+        db.session.execute(
+            db.update(Movie)
+            .where(Movie.id.in_(review_drift))
+            .values(
+                rating=db.func.coalesce(average, 0.0),
+                comments_count=db.select(db.func.count())
+                .where(Review.movie_id == Movie.id)
+                .scalar_subquery(),
+            )
+        )
+    movie_ids = review_drift + other_drift
+    db.session.execute(
+        db.update(Movie)
+        .where(Movie.id.in_(movie_ids))
+        .values(
+            favorites_count=db.select(db.func.count())
+            .where(user_favorites.c.movie_id == Movie.id)
+            .scalar_subquery(),
+            is_current=db.exists().where(
+                ScreeningTime.movie_id == Movie.id, ScreeningTime.date >= now
+            ),
+        )
+    )
+    return len(movie_ids)
+
+
+def check_movies(first_id, last_id, now):
+    scanned, review_drift, other_drift = _check_movies(first_id, last_id, now)
+    repaired = _repair_movies(review_drift, other_drift, now) if review_drift or other_drift else 0
+    return scanned, repaired, []
+
+
+def check_friends(first_id, last_id, now):
+    """好友關係要雙向各一列：重複的列刪除，只有單向的補上反向"""
+    reverse = db.aliased(Friend)
+    earlier = db.aliased(Friend)
+    rows = db.session.execute(
+        db.select(
+            Friend.id,
+            db.exists().where(
+                reverse.user_id == Friend.friend_id, reverse.friend_id == Friend.user_id
+            ),
+            db.exists().where(
+                earlier.user_id == Friend.user_id,
+                earlier.friend_id == Friend.friend_id,
+                earlier.id < Friend.id,
+            ),
+        ).where(Friend.id.between(first_id, last_id))
+    ).all()
+    duplicates = [friend_id for friend_id, _, duplicate in rows if duplicate]
+    one_sided = [
+        friend_id for friend_id, has_reverse, duplicate in rows if not has_reverse and not duplicate
+    ]
+    if duplicates:
+        db.session.execute(db.delete(Friend).where(Friend.id.in_(duplicates)))
+    if one_sided:
+        # 寫入當下再確認一次反向不存在，避免和同時接受邀請的請求重複新增
+        db.session.execute(
+            db.insert(Friend).from_select(
+                ["user_id", "friend_id"],
+                db.select(Friend.friend_id, Friend.user_id).where(
+                    Friend.id.in_(one_sided),
+                    ~db.exists().where(
+                        reverse.user_id == Friend.friend_id, reverse.friend_id == Friend.user_id
+                    ),
+                ),
+            )
+        )
+    return len(rows), len(duplicates) + len(one_sided), []
+
+
+def check_screening_stats(first_id, last_id, now):
+    """營運彙總與訂位一致；售出座位超過影廳座位數的場次只回報，不自動取消訂位"""
+    expected = expected_screening_stats(first_id, last_id)
+    actual = {
+        row[0]: tuple(row[1:])
+        for row in db.session.execute(
+            db.select(
+                ScreeningStats.screening_id,
+                ScreeningStats.movie_id,
+                ScreeningStats.cinema_id,
+                ScreeningStats.day,
+                ScreeningStats.capacity,
+                ScreeningStats.seats_sold,
+                ScreeningStats.revenue,
+            ).where(ScreeningStats.screening_id.between(first_id, last_id))
+        )
+    }
+    stale = []
+    overbooked = []
+    for screening_id, (movie_id, cinema_id, day, capacity, seats_sold, revenue) in expected.items():
+        if seats_sold > capacity:
+            overbooked.append(screening_id)
+        row = actual.get(screening_id)
+        if (
+            row is None
+            or row[:2] != (movie_id, cinema_id)
+            or str(row[2]) != str(day)
+            or row[3:5] != (capacity, seats_sold)
+            or _differs(row[5], revenue)
+        ):
+            stale.append(screening_id)
+    if stale:
+        refresh_screening_stats(stale)
+    return len(expected), len(stale), overbooked
+
+
+def check_orphan_screening_stats(first_id, last_id, now):
+    """
+    刪除場次已不存在的彙總列（依彙總表本身的主鍵分段，涵蓋場次 id 範圍以外的列）
+    已封存場次的彙總列保留給報表使用
+    """
+    in_chunk = ScreeningStats.screening_id.between(first_id, last_id)
+    orphaned = db.and_(
+        in_chunk,
+        ~db.exists().where(ScreeningTime.id == ScreeningStats.screening_id),
+        ~db.exists().where(ArchivedScreening.id == ScreeningStats.screening_id),
+    )
+    scanned = db.session.scalar(db.select(db.func.count()).where(in_chunk))
+    removed = db.session.execute(db.delete(ScreeningStats).where(orphaned)).rowcount
+    return scanned, removed, []
+
+
+def check_orders(first_id, last_id, now):
+    """訂單的座位數與總價要和目前的訂位相符（取消訂位時會扣除）"""
+    rows = db.session.execute(
+        db.select(Order.id, Order.seat_count, Order.total, Order.unit_price, db.func.count(Booking.id))
+        .outerjoin(Booking, Booking.order_id == Order.id)
+        .where(Order.id.between(first_id, last_id))
+        .group_by(Order.id)
+    ).all()
+    stale = [
+        order_id
+        for order_id, seat_count, total, unit_price, booked in rows
+        if seat_count != booked or _differs(total, unit_price * booked)
+    ]
+    if stale:
+        booked = (
+            db.select(db.func.count()).where(Booking.order_id == Order.id).scalar_subquery()
+        )
+        db.session.execute(
+            db.update(Order)
+            .where(Order.id.in_(stale))
+            .values(seat_count=booked, total=Order.unit_price * booked)
+        )
+    return len(rows), len(stale), []
+
+
+# 檢查名稱 -> (分段依據的主鍵, 檢查函式)；函式回傳 (掃描數, 修復數, 需要人工處理的 id)
+CHECKS = {
+    "movies": (Movie.id, check_movies),
+    "friends": (Friend.id, check_friends),
+    "screening_stats": (ScreeningTime.id, check_screening_stats),
+    "orphan_screening_stats": (ScreeningStats.screening_id, check_orphan_screening_stats),
+    "orders": (Order.id, check_orders),
+}
+
+
+def run_consistency_scan(checks=None, chunk_size=None, pause=None, now=None):
+    """
+    依序執行檢查，回傳各項的指標 {名稱: {"scanned", "repaired", "flagged", "chunks", "seconds"}}
+    每段結束就 commit（沒有修復時只是結束讀取交易），段與段之間可暫停讓出寫入鎖
+    """
+    config = current_app.config
+    chunk_size = chunk_size or config.get("CONSISTENCY_CHUNK_SIZE", CHUNK_SIZE)
+    pause = config.get("CONSISTENCY_CHUNK_PAUSE", 0) if pause is None else pause
+    now = now or datetime.now()
+    report = {}
+    for name in checks or CHECKS:
+        id_column, check = CHECKS[name]
+        started = time.perf_counter()
+        metrics = {"scanned": 0, "repaired": 0, "flagged": [], "chunks": 0}
+        for first_id, last_id in _chunks(id_column, chunk_size):
+            try:
+                scanned, repaired, flagged = check(first_id, last_id, now)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            metrics["scanned"] += scanned
+            metrics["repaired"] += repaired
+            metrics["flagged"].extend(flagged)
+            metrics["chunks"] += 1
+            if pause:
+                time.sleep(pause)
+        metrics["seconds"] = round(time.perf_counter() - started, 3)
+        report[name] = metrics
+        if metrics["repaired"] or metrics["flagged"]:
+            current_app.logger.warning(
+                "Consistency drift repaired",
+                extra={"check": name, **metrics, "flagged": metrics["flagged"][:100]},
+            )
+    current_app.logger.info(
+        "Consistency scan finished",
+        extra={
+            "checks": {
+                name: {key: len(value) if key == "flagged" else value for key, value in metrics.items()}
+                for name, metrics in report.items()
+            }
+        },
+    )
+    return report
+
+
+@click.command("check-consistency")
+@click.option("--check", "checks", multiple=True, type=click.Choice(list(CHECKS)))
+@click.option("--chunk-size", type=int, default=CHUNK_SIZE, show_default=True)
+@with_appcontext
+def consistency_command(checks, chunk_size):
+    """檢查並修復反正規化資料：flask --app run check-consistency --check movies"""
+    report = run_consistency_scan(checks or None, chunk_size, pause=0)
+    for name, metrics in report.items():
+        click.echo(
+            f"{name}: scanned {metrics['scanned']}, repaired {metrics['repaired']}, "
+            f"flagged {len(metrics['flagged'])} ({metrics['seconds']}s)"
+        )
+        if metrics["flagged"]:
+            click.echo(f"  flagged ids: {metrics['flagged'][:20]}", err=True)
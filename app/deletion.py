@@ -0,0 +1,104 @@
+# deletion.py
+import os
+import re
+
+from flask import current_app
+
+from app import db
+from app.models import Movie, PendingFilePurge, ScreeningTime
+from app.pagination import invalidate_totals
+from app.scheduling import invalidate_all_cinema_days, invalidate_cinema_day
+from app.workers import wake_worker
+
+FILE_PURGE_WORKER = "file-purge"
+FILE_PURGE_BATCH = 100
+
+# insert_movie() 上傳的海報檔名格式：YYYYmmdd_HHMMSS_原檔名
+# 種子資料的海報是 repo 內的檔案，不列入清除
+UPLOADED_POSTER = re.compile(r"^\d{8}_\d{6}_")
+
+
+def _poster_path(poster_url):
+    """將 /static/images/xxx 轉為上傳目錄中的實際路徑，不是上傳檔案時回傳 None"""
+    if not poster_url:
+        return None
+    filename = os.path.basename(poster_url)
+    if not UPLOADED_POSTER.match(filename):
+        return None
+    return os.path.join(current_app.config["UPLOAD_FOLDER"], filename)
+
+
+def delete_movie(movie, cinema=None):
+    """
+    單一交易刪除電影
+    - 指定 cinema 時只刪除該影城的場次，沒有其他場次時才刪除電影本身
+    - 場次、訂位、座位、評論、收藏由資料庫 ON DELETE CASCADE 清除
+    - 海報檔案在交易中排入 PendingFilePurge，提交後由背景 worker 刪除
+    回傳 True 表示電影本身已被刪除
+    """
+    try:
+        if cinema is not None:
+            db.session.execute(
+                db.delete(ScreeningTime).where(
+                    ScreeningTime.movie_id == movie.id,
+                    ScreeningTime.cinema_id == cinema.id,
+                )
+            )
+            remaining = db.session.query(
+                db.exists().where(ScreeningTime.movie_id == movie.id)
+            ).scalar()
+        else:
+            remaining = False
+
+        if not remaining:
+            poster_path = _poster_path(movie.poster_url)
+            shared = poster_path and db.session.query(
+                db.exists().where(
+                    Movie.poster_url == movie.poster_url, Movie.id != movie.id
+                )
+            ).scalar()
+            if poster_path and not shared:
+                db.session.add(PendingFilePurge(path=poster_path))
+            db.session.delete(movie)
+
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    # 資料庫層級的 cascade 不會觸發 mapper 事件，手動清除快取
+    if remaining:
+        invalidate_cinema_day(cinema.id)
+    else:
+        invalidate_all_cinema_days()
+        invalidate_totals()
+        wake_worker(FILE_PURGE_WORKER)
+    return not remaining
+
+
+def purge_pending_files(batch_size=FILE_PURGE_BATCH):
+    """背景 worker：刪除已提交的待清除檔案，每批一個短交易"""
+    while True:
+        pending = (
+            PendingFilePurge.query.order_by(PendingFilePurge.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not pending:
+            return
+        upload_folder = os.path.realpath(current_app.config["UPLOAD_FOLDER"])
+        for item in pending:
+            path = os.path.realpath(item.path)
+            # 只刪除上傳目錄內的檔案
+            if os.path.dirname(path) == upload_folder:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    current_app.logger.error(f"刪除檔案失敗 {path}: {e}")
+                    continue
+            db.session.delete(item)
+        db.session.commit()
+        if len(pending) < batch_size:
+            return
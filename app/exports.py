@@ -0,0 +1,128 @@
+# exports.py
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+
+from app import db
+from app.models import Booking, Cinema, Hall, Movie, Order, Review, ScreeningTime, User
+
+EXPORT_CHUNK_SIZE = 1000
+FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+def _bookings():
+    return (
+        db.select(
+            Booking.id,
+            Booking.order_id,
+            Booking.user_id,
+            User.username,
+            Booking.screening_id,
+            ScreeningTime.movie_id,
+            ScreeningTime.cinema_id,
+            ScreeningTime.date.label("screening_date"),
+            Booking.seat_number,
+            db.func.coalesce(Order.unit_price, ScreeningTime.price).label("price"),
+            Booking.created_at,
+        )
+        .join(User, Booking.user_id == User.id)
+        .join(ScreeningTime, Booking.screening_id == ScreeningTime.id)
+        .outerjoin(Order, Booking.order_id == Order.id)
+        .order_by(Booking.id)
+    ), Booking.created_at
+
+
+def _reviews():
+    return (
+        db.select(
+            Review.id,
+            Review.movie_id,
+            Movie.title,
+            Review.user_id,
+            User.username,
+            Review.rate,
+            Review.content,
+            Review.created_at,
+        )
+        .join(Movie, Review.movie_id == Movie.id)
+        .join(User, Review.user_id == User.id)
+        .order_by(Review.id)
+    ), Review.created_at
+
+
+def _screenings():
+    return (
+        db.select(
+            ScreeningTime.id,
+            ScreeningTime.movie_id,
+            Movie.title,
+            ScreeningTime.cinema_id,
+            Cinema.name.label("cinema_name"),
+            ScreeningTime.hall_id,
+            Hall.name.label("hall_name"),
+            ScreeningTime.date,
+            ScreeningTime.price,
+        )
+        .join(Movie, ScreeningTime.movie_id == Movie.id)
+        .join(Cinema, ScreeningTime.cinema_id == Cinema.id)
+        .join(Hall, ScreeningTime.hall_id == Hall.id)
+        .order_by(ScreeningTime.id)
+    ), ScreeningTime.date
+
+
+def _users():
+    # 不匯出密碼雜湊；使用者沒有建立時間，不支援日期篩選
+    return db.select(User.id, User.username, User.email).order_by(User.id), None
+
+
+DATASETS = {
+    "bookings": _bookings,
+    "reviews": _reviews,
+    "screenings": _screenings,
+    "users": _users,
+}
+
+
+def build_export_query(dataset, start=None, end=None):
+    """回傳 (select, 欄位名稱)；start / end 為日期，包含 end 當天"""
+    query, date_column = DATASETS[dataset]()
+    if date_column is not None:
+        if start is not None:
+            query = query.where(date_column >= datetime.combine(start, datetime.min.time()))
+        if end is not None:
+            query = query.where(date_column < datetime.combine(end + timedelta(days=1), datetime.min.time()))
+    return query, [column.name for column in query.selected_columns]
+
+
+def _csv_chunks(columns, partitions):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    # 標頭先送出，讓下載立即開始
+    yield buffer.getvalue()
+    for rows in partitions:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(rows)
+        yield buffer.getvalue()
+
+
+def _ndjson_chunks(columns, partitions):
+    for rows in partitions:
+        yield "".join(
+            json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=str) + "\n"
+            for row in rows
+        )
+
+
+def stream_export(engine, query, columns, fmt, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    以獨立連線的 stream_results 游標逐批讀取，每批 chunk_size 列編碼後送出
+    記憶體用量只和 chunk_size 有關，與總列數無關
+    """
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=chunk_size).execute(query)
+        partitions = result.partitions(chunk_size)
+        encode = _csv_chunks if fmt == "csv" else _ndjson_chunks
+        yield from encode(columns, partitions)
@@ -0,0 +1,162 @@
+# favorites.py
+from flask import g
+from flask_login import current_user
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app import db
+from app.cache import cache
+from app.models import Movie, RecommendationDirty, user_favorites
+from app.trending import record_after_commit
+
+FAVORITES_CACHE_TIMEOUT = 300
+
+
+def _cache_key(user_id):
+    return f"favorites:{user_id}"
+
+
+def favorite_ids(user_id):
+    """使用者收藏的電影 id（frozenset）；快取，收藏異動時清除"""
+
+    def load():
+        return frozenset(
+            movie_id
+            for movie_id, in db.session.execute(
+                db.select(user_favorites.c.movie_id).where(user_favorites.c.user_id == user_id)
+            )
+        )
+
+    # 不回傳過期資料：收藏後立刻要看到按鈕狀態改變
+    return cache.get_or_compute(_cache_key(user_id), load, FAVORITES_CACHE_TIMEOUT, stale_ttl=0)
+
+
+def is_favorite(user_id, movie_id):
+    """以主鍵 (user_id, movie_id) 做一次 EXISTS 查詢"""
+    return db.session.query(
+        db.exists().where(
+            user_favorites.c.user_id == user_id, user_favorites.c.movie_id == movie_id
+        )
+    ).scalar()
+
+
+def _changed(user_id, movie_ids, delta):
+    """在目前交易中更新收藏數、標記推薦需要重算；新增收藏另計入熱門"""
+    db.session.execute(
+        db.update(Movie)
+        .where(Movie.id.in_(movie_ids))
+        .values(favorites_count=Movie.favorites_count + delta)
+    )
+    RecommendationDirty.mark(db.session.connection(), sorted(movie_ids))
+    if delta > 0:
+        for movie_id in movie_ids:
+            record_after_commit(db.session, movie_id, "favorite")
+
+
+def _commit(user_id):
+    db.session.commit()
+    cache.delete(_cache_key(user_id))
+
+
+def _insert(user_id, movie_ids):
+    """INSERT ... ON CONFLICT DO NOTHING，回傳實際新增的電影 id"""
+    stmt = (
+        sqlite_insert(user_favorites)
+        .values([{"user_id": user_id, "movie_id": movie_id} for movie_id in movie_ids])
+        .on_conflict_do_nothing()
+        .returning(user_favorites.c.movie_id)
+    )
+    return [movie_id for movie_id, in db.session.execute(stmt)]
+
+
+def _delete(user_id, movie_ids):
+    """回傳實際刪除的電影 id"""
+    stmt = (
+        db.delete(user_favorites)
+        .where(user_favorites.c.user_id == user_id, user_favorites.c.movie_id.in_(movie_ids))
+        .returning(user_favorites.c.movie_id)
+    )
+    return [movie_id for movie_id, in db.session.execute(stmt)]
+
+
+def add_favorites(user_id, movie_ids):
+    """批次加入收藏，不存在的電影略過，回傳新加入的電影 id"""
+    movie_ids = set(movie_ids)
+    if not movie_ids:
+        return []
+    existing = [
+        movie_id
+        for movie_id, in db.session.execute(db.select(Movie.id).where(Movie.id.in_(movie_ids)))
+    ]
+    added = _insert(user_id, existing) if existing else []
+    if added:
+        _changed(user_id, added, 1)
+    _commit(user_id)
+    return added
+
+
+def remove_favorites(user_id, movie_ids):
+    """批次移除收藏，回傳實際移除的電影 id"""
+    movie_ids = set(movie_ids)
+    if not movie_ids:
+        return []
+    removed = _delete(user_id, movie_ids)
+    if removed:
+        _changed(user_id, removed, -1)
+    _commit(user_id)
+    return removed
+
+
+def toggle_favorite(user_id, movie_id):
+    """
+    先嘗試新增（ON CONFLICT DO NOTHING），沒有新增代表原本已收藏，改為刪除
+    回傳切換後是否為收藏
+    """
+    if _insert(user_id, [movie_id]):
+        _changed(user_id, [movie_id], 1)
+        favorited = True
+    else:
+        # 同時有另一個請求移除時這裡刪不到資料，不能再扣一次收藏數
+        removed = _delete(user_id, [movie_id])
+        if removed:
+            _changed(user_id, removed, -1)
+        favorited = False
+    _commit(user_id)
+    return favorited
+
+
+def favorite_movies(user_id):
+    return (
+        Movie.query.join(user_favorites, user_favorites.c.movie_id == Movie.id)
+        .filter(user_favorites.c.user_id == user_id)
+        .order_by(Movie.title)
+        .all()
+    )
+
+
+def favorites_by_user(user_ids):
+    """多位使用者的收藏，一次查詢：{user_id: [Movie, ...]}"""
+    result = {user_id: [] for user_id in user_ids}
+    if not result:
+        return result
+    rows = (
+        db.session.query(user_favorites.c.user_id, Movie)
+        .join(Movie, user_favorites.c.movie_id == Movie.id)
+        .filter(user_favorites.c.user_id.in_(result))
+        .order_by(Movie.title)
+    )
+    for user_id, movie in rows:
+        result[user_id].append(movie)
+    return result
+
+
+def _template_is_favorite(movie_id):
+    """模板用：同一個請求只讀一次目前使用者的收藏集合"""
+    if not current_user.is_authenticated:
+        return False
+    if "favorite_ids" not in g:
+        g.favorite_ids = favorite_ids(current_user.id)
+    return movie_id in g.favorite_ids
+
+
+def init_favorites(app):
+    app.context_processor(lambda: {"is_favorite": _template_is_favorite})
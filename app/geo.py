@@ -0,0 +1,159 @@
+# geo.py
+import math
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import event
+
+from app import db
+from app.models import Cinema, Hall, ScreeningTime
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 111.32
+
+# 格網索引：以 GRID_DEGREES 度為一格，geo_cell = 緯度格號 * LNG_CELLS + 經度格號
+# 0.1 度約 11 公里，一般搜尋半徑只會涵蓋幾排格子
+GRID_DEGREES = 0.1
+LAT_CELLS = int(round(180 / GRID_DEGREES))
+LNG_CELLS = int(round(360 / GRID_DEGREES))
+
+NEARBY_START_RADIUS_KM = 5
+
+NearbyCinema = namedtuple("NearbyCinema", ["cinema", "distance_km"])
+
+
+def _lat_index(latitude):
+    return min(int(math.floor((latitude + 90) / GRID_DEGREES)), LAT_CELLS - 1)
+
+
+def _lng_index(longitude):
+    return min(int(math.floor((longitude + 180) / GRID_DEGREES)), LNG_CELLS - 1)
+
+
+def grid_cell(latitude, longitude):
+    if latitude is None or longitude is None:
+        return None
+    return _lat_index(latitude) * LNG_CELLS + _lng_index(longitude)
+
+
+def parse_coordinates(latitude, longitude):
+    """把字串轉成 (緯度, 經度)，格式或範圍不對時回傳 None"""
+    try:
+        latitude, longitude = float(latitude), float(longitude)
+    except (TypeError, ValueError):
+        return None
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return None
+    return latitude, longitude
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """回傳 (南, 北, 西, 東)；不處理跨越 ±180 度經線的情況"""
+    dlat = radius_km / KM_PER_DEGREE
+    dlng = radius_km / (KM_PER_DEGREE * max(math.cos(math.radians(latitude)), 0.01))
+    return (
+        max(latitude - dlat, -90.0),
+        min(latitude + dlat, 90.0),
+        max(longitude - dlng, -180.0),
+        min(longitude + dlng, 180.0),
+    )
+
+
+def _cell_ranges(south, north, west, east):
+    """bounding box 涵蓋的格子：每一排緯度是一段連續的 geo_cell 區間"""
+    first, last = _lng_index(west), _lng_index(east)
+    return [
+        (row * LNG_CELLS + first, row * LNG_CELLS + last)
+        for row in range(_lat_index(south), _lat_index(north) + 1)
+    ]
+
+
+def _candidates(latitude, longitude, radius_km, movie_id=None, now=None):
+    """以格網索引取出 bounding box 內的影城，再用精確距離過濾，依距離排序"""
+    south, north, west, east = bounding_box(latitude, longitude, radius_km)
+    query = Cinema.query.filter(
+        db.or_(*[Cinema.geo_cell.between(low, high) for low, high in _cell_ranges(south, north, west, east)]),
+        Cinema.latitude.between(south, north),
+        Cinema.longitude.between(west, east),
+    )
+    if movie_id is not None:
+        query = query.filter(
+            Cinema.id.in_(
+                db.select(ScreeningTime.cinema_id).where(
+                    ScreeningTime.movie_id == movie_id, ScreeningTime.date >= now
+                )
+            )
+        )
+    nearby = []
+    for cinema in query:
+        distance = haversine_km(latitude, longitude, cinema.latitude, cinema.longitude)
+        if distance <= radius_km:
+            nearby.append(NearbyCinema(cinema, distance))
+    nearby.sort(key=lambda item: item.distance_km)
+    return nearby
+
+
+def nearby_cinemas(latitude, longitude, limit, max_radius_km, radius_km=None, movie_id=None, now=None):
+    """
+    最近的 limit 間影城（有經緯度的），回傳 [NearbyCinema, ...]
+    指定 radius_km 時只在該半徑內找；否則從小半徑開始，找不到足夠的影城就加倍，直到 max_radius_km
+    指定 movie_id 時只列出之後還有該電影場次的影城
+    """
+    now = now or datetime.now()
+    radius = min(radius_km or NEARBY_START_RADIUS_KM, max_radius_km)
+    while True:
+        nearby = _candidates(latitude, longitude, radius, movie_id, now)
+        # 半徑內已有 limit 間時，前 limit 間就是全域最近的
+        if len(nearby) >= limit or radius_km or radius >= max_radius_km:
+            return nearby[:limit]
+        radius = min(radius * 2, max_radius_km)
+
+
+def next_screenings(cinema_ids, movie_id, per_cinema, now=None):
+    """各影城接下來 per_cinema 場該電影的場次，一次查詢：{cinema_id: [dict, ...]}"""
+    now = now or datetime.now()
+    result = {cinema_id: [] for cinema_id in cinema_ids}
+    if not result:
+        return result
+    ranked = (
+        db.select(
+            ScreeningTime.id,
+            ScreeningTime.cinema_id,
+            ScreeningTime.date,
+            ScreeningTime.price,
+            Hall.name.label("hall_name"),
+            db.func.row_number()
+            .over(partition_by=ScreeningTime.cinema_id, order_by=(ScreeningTime.date, ScreeningTime.id))
+            .label("position"),
+        )
+        .join(Hall, ScreeningTime.hall_id == Hall.id)
+        .where(
+            ScreeningTime.cinema_id.in_(result),
+            ScreeningTime.movie_id == movie_id,
+            ScreeningTime.date >= now,
+        )
+        .subquery()
+    )
+    rows = db.session.execute(
+        db.select(ranked).where(ranked.c.position <= per_cinema).order_by(ranked.c.cinema_id, ranked.c.position)
+    )
+    for row in rows:
+        result[row.cinema_id].append(
+            {"id": row.id, "date": row.date, "price": row.price, "hall_name": row.hall_name}
+        )
+    return result
+
+
+@event.listens_for(Cinema, "before_insert")
+@event.listens_for(Cinema, "before_update")
+def _update_grid_cell(mapper, connection, target):
+    target.geo_cell = grid_cell(target.latitude, target.longitude)
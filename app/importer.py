@@ -0,0 +1,358 @@
+# importer.py
+import csv
+import io
+import json
+from collections import namedtuple
+from datetime import datetime, timedelta
+from itertools import islice
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app import db
+from app.models import Cinema, Hall, Movie
+from app.pagination import invalidate_totals
+from app.scheduling import (
+    DEFAULT_DURATION,
+    bulk_insert_screenings,
+    load_existing_screenings,
+    split_conflicting,
+)
+from app.showtimes import invalidate_showtime_facets
+
+IMPORT_BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+KINDS = ("movies", "screenings")
+JSON_READ_SIZE = 64 * 1024
+
+ImportReport = namedtuple("ImportReport", ["processed", "imported", "failed", "errors"])
+
+
+class RowError(ValueError):
+    pass
+
+
+# ---- 逐筆讀取 ----
+
+def iter_csv(stream):
+    for row in csv.DictReader(stream):
+        yield {
+            key.strip(): value.strip() if isinstance(value, str) else value
+            for key, value in row.items()
+            if key
+        }
+
+
+def iter_json(stream):
+    """
+    逐一解析 JSON 陣列或 NDJSON 中的物件，每次只讀 JSON_READ_SIZE 個字元
+    陣列的括號與物件之間的逗號、空白直接略過
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    eof = False
+    while True:
+        stripped = buffer.lstrip(" \t\r\n,[]")
+        if not stripped or (not eof and len(stripped) < JSON_READ_SIZE):
+            chunk = "" if eof else stream.read(JSON_READ_SIZE)
+            if chunk:
+                buffer = stripped + chunk
+                continue
+            eof = True
+            if not stripped:
+                return
+        try:
+            item, end = decoder.raw_decode(stripped)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            # 物件被切在兩次讀取之間，再多讀一些
+            buffer = stripped + stream.read(JSON_READ_SIZE)
+            eof = not buffer[len(stripped):]
+            continue
+        buffer = stripped[end:]
+        yield item
+
+
+def _batches(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+# ---- 驗證 ----
+
+def _text(row, key, required=False, limit=None):
+    value = row.get(key)
+    value = str(value).strip() if value is not None else ""
+    if required and not value:
+        raise RowError(f"missing {key}")
+    if limit and len(value) > limit:
+        raise RowError(f"{key} is too long")
+    return value or None
+
+
+def _number(row, key, cast, default=None):
+    value = row.get(key)
+    if value in (None, ""):
+        if default is None:
+            raise RowError(f"missing {key}")
+        return default
+    try:
+        value = cast(value)
+    except (TypeError, ValueError):
+        raise RowError(f"invalid {key}: {value!r}")
+    if value <= 0:
+        raise RowError(f"{key} must be positive")
+    return value
+
+
+def _release_date(row):
+    value = _text(row, "release_date", required=True)
+    try:
+        return Movie.normalize_release_date(value)
+    except ValueError:
+        raise RowError(f"invalid release_date: {value!r}")
+
+
+def _normalize_existing_dates(titles):
+    """
+    把同片名、上映日期沒補零的既有電影（例如 2024-5-18）改成 YYYY-MM-DD，
+    讓 upsert 與場次對應能以正規化後的 (title, release_date) 比對到；已有補零的同名電影時略過
+    """
+    rows = db.session.query(Movie.id, Movie.title, Movie.release_date).filter(
+        Movie.title.in_(titles),
+        Movie.release_date.isnot(None),
+        ~Movie.release_date.op("GLOB")("[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]"),
+    )
+    for movie_id, title, release_date in rows.all():
+        try:
+            normalized = Movie.normalize_release_date(release_date)
+        except ValueError:
+            continue
+        taken = db.session.query(
+            db.exists().where(Movie.title == title, Movie.release_date == normalized)
+        ).scalar()
+        if not taken:
+            db.session.execute(
+                db.update(Movie)
+                .where(Movie.id == movie_id)
+                .values(release_date=normalized, release_sort=normalized)
+            )
+
+
+def _movie_values(row):
+    return {
+        "title": _text(row, "title", required=True, limit=200),
+        "release_date": _release_date(row),
+        "genre": _text(row, "genre", limit=100),
+        "description": _text(row, "description"),
+        "poster_url": _text(row, "poster_url", limit=300),
+        "duration": _number(row, "duration", int, DEFAULT_DURATION),
+    }
+
+
+def _screening_values(row):
+    value = _text(row, "date", required=True)
+    for fmt in ("%Y-%m-%d %H:%M", "%Y-%m-%dT%H:%M", "%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S"):
+        try:
+            date = datetime.strptime(value, fmt)
+            break
+        except ValueError:
+            continue
+    else:
+        raise RowError(f"invalid date: {value!r}")
+    return {
+        "movie_key": (_text(row, "title", required=True), _release_date(row)),
+        "hall_key": (_text(row, "cinema", required=True), _text(row, "hall", required=True)),
+        "date": date,
+        "price": _number(row, "price", float),
+    }
+
+
+# ---- 寫入 ----
+
+class _Importer:
+    def __init__(self):
+        self.processed = 0
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+
+    def error(self, line, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"row": line, "error": message})
+
+    def validate(self, batch, to_values):
+        valid = []
+        for line, row in batch:
+            self.processed += 1
+            try:
+                if not isinstance(row, dict):
+                    raise RowError("not an object")
+                valid.append((line, to_values(row)))
+            except RowError as e:
+                self.error(line, str(e))
+        return valid
+
+    def report(self):
+        return ImportReport(self.processed, self.imported, self.failed, self.errors)
+
+
+def _import_movies(importer, batches):
+    """以 (title, release_date) 為自然鍵 upsert，每批一個交易；Core insert 不經過 ORM 事件，release_sort 在此寫入"""
+    stmt = sqlite_insert(Movie)
+    upsert = stmt.on_conflict_do_update(
+        index_elements=[Movie.title, Movie.release_date],
+        set_={
+            "genre": db.func.coalesce(stmt.excluded.genre, Movie.genre),
+            "description": db.func.coalesce(stmt.excluded.description, Movie.description),
+            "poster_url": db.func.coalesce(stmt.excluded.poster_url, Movie.poster_url),
+            "duration": stmt.excluded.duration,
+            "release_sort": stmt.excluded.release_sort,
+        },
+    )
+    for batch in batches:
+        valid = importer.validate(batch, _movie_values)
+        if valid:
+            _normalize_existing_dates({values["title"] for _, values in valid})
+            db.session.execute(
+                upsert,
+                [
+                    dict(
+                        values,
+                        release_sort=Movie.release_sort_key(values["release_date"]),
+                        is_current=False,
+                        rating=0.0,
+                        comments_count=0,
+                    )
+                    for _, values in valid
+                ],
+            )
+            db.session.commit()
+            importer.imported += len(valid)
+    invalidate_totals()
+    # upsert 可能改了既有電影的類型
+    invalidate_showtime_facets()
+
+
+def _import_screenings(importer, batches):
+    """
+    以名稱對應電影、影城、影廳；每批檢查影廳時段重疊後以 executemany 寫入，每批一個交易
+    與既有場次或同批其他列重疊的列記為錯誤，不寫入
+    """
+    halls = {
+        (cinema_name, hall_name): (cinema_id, hall_id)
+        for hall_id, hall_name, cinema_id, cinema_name in db.session.query(
+            Hall.id, Hall.name, Cinema.id, Cinema.name
+        ).join(Cinema, Hall.cinema_id == Cinema.id)
+    }
+    for batch in batches:
+        valid = importer.validate(batch, _screening_values)
+        movie_keys = {values["movie_key"] for _, values in valid}
+        if movie_keys:
+            _normalize_existing_dates({title for title, _ in movie_keys})
+        movies = {
+            (title, release_date): (movie_id, duration)
+            for movie_id, title, release_date, duration in db.session.query(
+                Movie.id, Movie.title, Movie.release_date, Movie.duration
+            ).filter(db.tuple_(Movie.title, Movie.release_date).in_(movie_keys))
+        } if movie_keys else {}
+
+        rows = []
+        for line, values in valid:
+            movie = movies.get(values["movie_key"])
+            hall = halls.get(values["hall_key"])
+            if movie is None:
+                importer.error(line, "unknown movie {} ({})".format(*values["movie_key"]))
+            elif hall is None:
+                importer.error(line, "unknown hall {} / {}".format(*values["hall_key"]))
+            else:
+                rows.append({
+                    "line": line,
+                    "movie_id": movie[0],
+                    "cinema_id": hall[0],
+                    "hall_id": hall[1],
+                    "date": values["date"],
+                    "price": values["price"],
+                })
+        if not rows:
+            continue
+
+        durations = {movie_id: duration or DEFAULT_DURATION for movie_id, duration in movies.values()}
+        existing = load_existing_screenings(
+            {row["hall_id"] for row in rows},
+            min(row["date"] for row in rows),
+            max(row["date"] for row in rows) + timedelta(days=1),
+        )
+        missing = {screening["movie_id"] for screening in existing} - set(durations)
+        if missing:
+            durations.update(db.session.query(Movie.id, Movie.duration).filter(Movie.id.in_(missing)))
+        accepted, rejected = split_conflicting(existing, rows, durations)
+        for row, blocking in rejected:
+            label = f"row {blocking['line']}" if "line" in blocking else f"screening {blocking['id']}"
+            importer.error(row["line"], f"overlaps {label} in the same hall")
+
+        accepted = [
+            {key: row[key] for key in ("movie_id", "cinema_id", "hall_id", "date", "price")}
+            for row in accepted
+        ]
+        bulk_insert_screenings(accepted)
+        db.session.commit()
+        importer.imported += len(accepted)
+
+
+def import_catalog(kind, stream, fmt, batch_size=IMPORT_BATCH_SIZE):
+    """
+    匯入電影或場次；stream 為文字串流，fmt 為 "csv" 或 "json"（陣列或 NDJSON）
+    逐批讀取、驗證、寫入，記憶體用量只和 batch_size 有關
+    回傳 ImportReport，errors 為 [{"row": 第幾列, "error": 原因}]
+    """
+    if kind not in KINDS:
+        raise ValueError(f"Unknown import kind: {kind}")
+    rows = iter_csv(stream) if fmt == "csv" else iter_json(stream)
+    # CSV 第 1 行是標頭，資料從第 2 行開始；JSON 以第幾個物件計
+    numbered = enumerate(rows, start=2 if fmt == "csv" else 1)
+    batches = _batches(numbered, batch_size)
+    importer = _Importer()
+    try:
+        if kind == "movies":
+            _import_movies(importer, batches)
+        else:
+            _import_screenings(importer, batches)
+    except Exception:
+        db.session.rollback()
+        raise
+    return importer.report()
+
+
+def import_file(kind, file, fmt=None, batch_size=IMPORT_BATCH_SIZE):
+    """包裝上傳檔或二進位檔案；未指定 fmt 時依副檔名判斷"""
+    if fmt is None:
+        name = (getattr(file, "filename", None) or getattr(file, "name", "") or "").lower()
+        fmt = "csv" if name.endswith(".csv") else "json"
+    stream = io.TextIOWrapper(getattr(file, "stream", file), encoding="utf-8-sig", newline="")
+    try:
+        return import_catalog(kind, stream, fmt, batch_size)
+    finally:
+        stream.detach()
+
+
+@click.command("import-catalog")
+@click.argument("kind", type=click.Choice(KINDS))
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(["csv", "json"]), default=None)
+@click.option("--batch-size", type=int, default=IMPORT_BATCH_SIZE, show_default=True)
+@with_appcontext
+def import_command(kind, path, fmt, batch_size):
+    """匯入電影或場次：flask --app run import-catalog movies feed.csv"""
+    with open(path, "rb") as file:
+        report = import_file(kind, file, fmt, batch_size)
+    click.echo(f"processed {report.processed}, imported {report.imported}, failed {report.failed}")
+    for error in report.errors:
+        click.echo(f"  row {error['row']}: {error['error']}", err=True)
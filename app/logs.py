@@ -0,0 +1,161 @@
+# logs.py
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# LogRecord 本身的屬性；其餘屬性視為 extra={...} 帶入的結構化欄位
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {
+    "message",
+    "asctime",
+}
+
+_pipeline = None
+
+
+class JsonFormatter(logging.Formatter):
+    """每筆紀錄輸出成一行 JSON，extra 欄位原樣保留"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "pid": record.process,
+            "thread": record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    依 logger 名稱對 DEBUG 紀錄抽樣，高流量的除錯訊息只保留一部分
+    rates 例如 {"app.routes": 0.1}，以最長的前綴比對；被保留的紀錄帶上 sample_rate
+    """
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = sorted(rates.items(), key=lambda item: len(item[0]), reverse=True)
+
+    def _rate_for(self, name):
+        for prefix, rate in self.rates:
+            if name == prefix or name.startswith(prefix + "."):
+                return rate
+        return None
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        rate = self._rate_for(record.name)
+        if rate is None:
+            return True
+        if random.random() >= rate:
+            return False
+        record.sample_rate = rate
+        return True
+
+
+class StructuredQueueHandler(QueueHandler):
+    """
+    只在呼叫端把訊息參數合併、例外轉成文字，其餘欄位保留給 listener 端的 JSON formatter
+    （預設的 prepare() 會把整筆紀錄格式化成一個字串）
+    """
+
+    def prepare(self, record):
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class LogPipeline:
+    """request 執行緒只把紀錄放進 queue，實際的 I/O 由 QueueListener 的執行緒處理"""
+
+    def __init__(self, handlers):
+        self.handlers = handlers
+        self.queue_handler = StructuredQueueHandler(queue.SimpleQueue())
+        self.listener = None
+        # fork 之後 listener 執行緒不存在，子 process 重新建立 queue 與 listener
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._restart_in_child)
+
+    def start(self):
+        self.listener = QueueListener(
+            self.queue_handler.queue, *self.handlers, respect_handler_level=True
+        )
+        self.listener.start()
+
+    def stop(self):
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def _restart_in_child(self):
+        if self.listener is None:
+            return
+        self.queue_handler.queue = queue.SimpleQueue()
+        self.start()
+
+
+def _output_handlers(app):
+    formatter = JsonFormatter() if app.config.get("LOG_FORMAT", "json") == "json" else (
+        logging.Formatter("%(asctime)s - %(levelname)s - %(name)s - %(message)s")
+    )
+    handlers = [logging.StreamHandler(sys.stderr)]
+    log_file = app.config.get("LOG_FILE")
+    if log_file:
+        handlers.append(logging.FileHandler(log_file, encoding="utf-8"))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    return handlers
+
+
+def init_logging(app):
+    """
+    設定 root logger：QueueHandler -> QueueListener -> stderr（與 LOG_FILE）
+    LOG_LEVEL 為預設層級，LOG_LEVELS 可針對個別模組調整，LOG_SAMPLE_RATES 設定 DEBUG 抽樣比例
+    """
+    global _pipeline
+    from flask.logging import default_handler
+
+    root = logging.getLogger()
+    if _pipeline is not None:
+        # 同一個 process 重複建立 app（例如測試），換掉舊的 pipeline
+        root.removeHandler(_pipeline.queue_handler)
+        _pipeline.stop()
+
+    _pipeline = LogPipeline(_output_handlers(app))
+    if app.config.get("LOG_SAMPLE_RATES"):
+        _pipeline.queue_handler.addFilter(SamplingFilter(app.config["LOG_SAMPLE_RATES"]))
+    root.addHandler(_pipeline.queue_handler)
+    root.setLevel(app.config.get("LOG_LEVEL", "INFO"))
+    for name, level in app.config.get("LOG_LEVELS", {}).items():
+        logging.getLogger(name).setLevel(level)
+
+    # 交給 root 的 QueueHandler 處理，不使用 Flask 內建的同步 handler
+    app.logger.removeHandler(default_handler)
+    _pipeline.start()
+    return _pipeline
+
+
+@atexit.register
+def shutdown_logging():
+    """送出 queue 中剩餘的紀錄；以 os._exit 結束的 process 需自行呼叫"""
+    if _pipeline is not None:
+        _pipeline.stop()
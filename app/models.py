@@ -3,6 +3,9 @@ from app import db, login_manager
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from sqlalchemy import event
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+import math
 from datetime import datetime
 from flask import flash
 
@@ -15,8 +18,9 @@ user_friends = db.Table(
 # 定義 user_favorites 中介表
 user_favorites = db.Table(
     "user_favorites",
-    db.Column("user_id", db.Integer, db.ForeignKey("user.id"), primary_key=True),
-    db.Column("movie_id", db.Integer, db.ForeignKey("movie.id"), primary_key=True),
+    db.Column("user_id", db.Integer, db.ForeignKey("user.id", ondelete="CASCADE"), primary_key=True),
+    db.Column("movie_id", db.Integer, db.ForeignKey("movie.id", ondelete="CASCADE"), primary_key=True),
+    db.Index("ix_user_favorites_movie_id", "movie_id"),  # 依電影統計收藏數（一致性檢查）
 )
 
 class User(UserMixin, db.Model):
@@ -27,7 +31,7 @@ class User(UserMixin, db.Model):
     favorite_movies = db.relationship(
         "Movie",
         secondary=user_favorites,  # 引用 user_favorites 表
-        backref=db.backref("favorited_by", lazy="dynamic"),
+        backref=db.backref("favorited_by", lazy="dynamic", passive_deletes=True),
         lazy="dynamic",
     )
 
@@ -72,23 +76,64 @@ class User(UserMixin, db.Model):
             return False
 
 class Movie(db.Model):
+    # keyset 分頁用的複合索引 (排序鍵, id)
+    __table_args__ = (
+        db.Index("ix_movie_rating_id", "rating", "id"),
+        db.Index("ix_movie_comments_count_id", "comments_count", "id"),
+        # 匯入時以 (片名, 上映日期) 辨識同一部電影
+        db.Index("uq_movie_title_release", "title", "release_date", unique=True),
+        # /movies/showing 的 keyset 分頁
+        db.Index("ix_movie_current_release_sort_id", "is_current", "release_sort", "id"),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text)
     genre = db.Column(db.String(100))
-    screening_times = db.relationship("ScreeningTime", backref="movie",cascade="all, delete-orphan", lazy=True)
-    release_date = db.Column(db.String(50), nullable=True)
+    # 刪除電影時由資料庫 ON DELETE CASCADE 清除場次、訂位、座位、評論與收藏，不逐筆載入
+    screening_times = db.relationship("ScreeningTime", backref="movie",cascade="all, delete-orphan", lazy=True, passive_deletes=True)
+    release_date = db.Column(db.String(50), nullable=True)  # YYYY-MM-DD，字串排序即為日期順序
+    # 分頁排序鍵：正規化後的 release_date，NULL 存成空字串排在最後（NULL 無法做 (排序鍵, id) 的 tuple 比較）
+    # 由 before_insert / before_update 維護；匯入的 Core upsert 會另外寫入
+    release_sort = db.Column(db.String(50), default="", server_default="", nullable=False)
     poster_url = db.Column(db.String(300), nullable=True)
-    reviews = db.relationship("Review", backref="movie", lazy=True)
+    reviews = db.relationship("Review", backref="movie", lazy=True, passive_deletes=True)
     is_current = db.Column(db.Boolean, default=True, nullable=False)
     rating = db.Column(db.Float, default=0.0, nullable=False)
     comments_count = db.Column(db.Integer, default=0, nullable=False)   
+    favorites_count = db.Column(db.Integer, default=0, nullable=False)  # 由 favorites.py 與收藏的 ORM 事件維護
+    duration = db.Column(db.Integer, default=120, nullable=False)  # 片長（分鐘），排程時用來檢查影廳重疊
+
+    @staticmethod
+    def normalize_release_date(value):
+        """接受 2024-5-18 這類沒補零的寫法，統一為 YYYY-MM-DD；格式錯誤時拋出 ValueError"""
+        return datetime.strptime(value.strip(), "%Y-%m-%d").strftime("%Y-%m-%d")
+
+    @staticmethod
+    def release_sort_key(value):
+        """release_sort 的值：可解析的日期補零，無法解析的保留原字串，沒有日期時為空字串"""
+        if not value:
+            return ""
+        try:
+            return Movie.normalize_release_date(value)
+        except ValueError:
+            return value
+
+
+@event.listens_for(Movie, "before_insert")
+@event.listens_for(Movie, "before_update")
+def _update_release_sort(mapper, connection, target):
+    target.release_sort = Movie.release_sort_key(target.release_date)
 
 
 class Cinema(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
     location = db.Column(db.String(300))
+    # 經緯度與格網索引（見 geo.py），geo_cell 由經緯度自動計算
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
+    geo_cell = db.Column(db.Integer, nullable=True, index=True)
     halls = db.relationship("Hall", backref="cinema",cascade="all, delete-orphan",lazy=True)
     screening_times = db.relationship("ScreeningTime", backref="cinema",cascade="all, delete-orphan", lazy=True)
 
@@ -98,74 +143,311 @@ class Hall(db.Model):
     cinema_id = db.Column(db.Integer, db.ForeignKey("cinema.id"), nullable=False)
     name = db.Column(db.String(50), nullable=False)  # e.g., A1, A2
     size = db.Column(db.Integer, nullable=False)  # Number of seats
+    # 座位配置編碼（見 seating.py），未設定時依 size 每排 10 個座位
+    layout = db.Column(db.Text, nullable=True)
     screening_times = db.relationship("ScreeningTime", backref="hall", lazy=True)
 
 
 class ScreeningTime(db.Model):
+    # AUTOINCREMENT：封存後的 id 不會被新場次重用
+    __table_args__ = (
+        db.Index("ix_screening_time_cinema_date", "cinema_id", "date"),
+        # 場次搜尋：依時間區間（可加價格）掃描、依電影找後續場次
+        db.Index("ix_screening_time_date_price", "date", "price"),
+        db.Index("ix_screening_time_movie_date", "movie_id", "date"),
+        {"sqlite_autoincrement": True},
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    movie_id = db.Column(db.Integer, db.ForeignKey("movie.id"), nullable=False)
-    cinema_id = db.Column(db.Integer, db.ForeignKey("cinema.id"), nullable=False)
-    hall_id = db.Column(db.Integer, db.ForeignKey("hall.id"), nullable=False)
+    movie_id = db.Column(db.Integer, db.ForeignKey("movie.id", ondelete="CASCADE"), nullable=False)
+    cinema_id = db.Column(db.Integer, db.ForeignKey("cinema.id", ondelete="CASCADE"), nullable=False)
+    hall_id = db.Column(db.Integer, db.ForeignKey("hall.id", ondelete="CASCADE"), nullable=False, index=True)
     date = db.Column(db.DateTime, nullable=False)
     price = db.Column(db.Float, nullable=False)
-    bookings = db.relationship("Booking", backref="screening", lazy=True)
-    seats = db.relationship("Seat", backref="screening", lazy=True)
+    bookings = db.relationship("Booking", backref="screening", lazy=True, passive_deletes=True)
+    seats = db.relationship("Seat", backref="screening", lazy=True, passive_deletes=True)
+
+
+class Order(db.Model):
+    """一次訂票交易，單價與總價在訂位當下寫入，之後票價異動不影響帳單"""
+    __tablename__ = "orders"
+    __table_args__ = {"sqlite_autoincrement": True}
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False, index=True)
+    screening_id = db.Column(
+        db.Integer, db.ForeignKey("screening_time.id", ondelete="CASCADE"), nullable=False, index=True
+    )
+    unit_price = db.Column(db.Float, nullable=False)
+    seat_count = db.Column(db.Integer, nullable=False)
+    total = db.Column(db.Float, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.now, nullable=False)
+    bookings = db.relationship("Booking", backref="order", lazy=True, passive_deletes=True)
+    user = db.relationship("User", backref=db.backref("orders", lazy="dynamic"))
+    screening = db.relationship("ScreeningTime", backref=db.backref("orders", lazy=True, passive_deletes=True))
 
 
 class Booking(db.Model):
+    # 同一場次的座位只能被訂一次
+    __table_args__ = (
+        db.UniqueConstraint("screening_id", "seat_number", name="uq_booking_screening_seat"),
+        {"sqlite_autoincrement": True},
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
     screening_id = db.Column(
-        db.Integer, db.ForeignKey("screening_time.id"), nullable=False
+        db.Integer, db.ForeignKey("screening_time.id", ondelete="CASCADE"), nullable=False
+    )
+    order_id = db.Column(db.Integer, db.ForeignKey("orders.id", ondelete="CASCADE"), nullable=True, index=True)
+    seat_number = db.Column(db.String(10), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.now, nullable=False)
+
+
+class SeatHold(db.Model):
+    """自動選位時暫時保留的座位，到期前其他使用者不能訂；同一座位只能有一筆保留"""
+    __table_args__ = (
+        db.UniqueConstraint("screening_id", "seat_number", name="uq_seat_hold_screening_seat"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    screening_id = db.Column(
+        db.Integer, db.ForeignKey("screening_time.id", ondelete="CASCADE"), nullable=False
     )
     seat_number = db.Column(db.String(10), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id", ondelete="CASCADE"), nullable=False, index=True)
+    expires_at = db.Column(db.DateTime, nullable=False)
 
 
 class Review(db.Model):
+    # 評論串以 keyset 分頁：依時間 (id) 或評分 (rate, id) 排序
+    __table_args__ = (
+        db.Index("ix_review_movie_id_id", "movie_id", "id"),
+        db.Index("ix_review_movie_rate_id", "movie_id", "rate", "id"),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey("user.id", ondelete="CASCADE"), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id", ondelete="CASCADE"), nullable=False, index=True)
     movie_id = db.Column(db.Integer, db.ForeignKey("movie.id", ondelete="CASCADE"), nullable=False)
     content = db.Column(db.Text, nullable=False)
     rate = db.Column(db.Float, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.now, nullable=False)
 
     @staticmethod
     def after_insert(mapper, connection, target):
-        # 更新評論數和平均評分
-        Movie.query.filter_by(id=target.movie_id).update(
-            {
-                "comments_count": Movie.comments_count + 1,
-                "rating": db.session.query(db.func.avg(Review.rate))
-                .filter(Review.movie_id == target.movie_id)
-                .scalar() or 0.0
-            }
+        # 更新評分分布、評論數和平均評分
+        MovieRatingHistogram.apply(connection, target.movie_id, None, target.rate)
+        RecommendationDirty.mark(connection, [target.movie_id])
+        connection.execute(
+            db.update(Movie)
+            .where(Movie.id == target.movie_id)
+            .values(comments_count=Movie.comments_count + 1)
         )
 
+    @staticmethod
+    def after_update(mapper, connection, target):
+        # 修改評分時，把舊分數從分布中移到新分數
+        history = db.inspect(target).attrs.rate.history
+        if not history.has_changes():
+            return
+        old_rate = history.deleted[0] if history.deleted else None
+        if old_rate is not None and float(old_rate) == float(target.rate):
+            return
+        MovieRatingHistogram.apply(connection, target.movie_id, old_rate, target.rate)
+        RecommendationDirty.mark(connection, [target.movie_id])
+
     @staticmethod
     def after_delete(mapper, connection, target):
-        # 更新評論數和平均評分
-        Movie.query.filter_by(id=target.movie_id).update(
-            {
-                "comments_count": Movie.comments_count - 1,
-                "rating": db.session.query(db.func.avg(Review.rate))
-                .filter(Review.movie_id == target.movie_id)
-                .scalar() or 0.0
-            }
+        # 更新評分分布、評論數和平均評分
+        MovieRatingHistogram.apply(connection, target.movie_id, target.rate, None)
+        RecommendationDirty.mark(connection, [target.movie_id])
+        connection.execute(
+            db.update(Movie)
+            .where(Movie.id == target.movie_id)
+            .values(comments_count=Movie.comments_count - 1)
         )
 
 # 在Review類定義後添加事件監聽器
 event.listen(Review, 'after_insert', Review.after_insert)
+event.listen(Review, 'after_update', Review.after_update)
 event.listen(Review, 'after_delete', Review.after_delete)
 
+
+class MovieRatingHistogram(db.Model):
+    """每部電影各分數（0.5 一級）的評論數，bucket = rate * 2，範圍 1~10"""
+    movie_id = db.Column(db.Integer, db.ForeignKey("movie.id", ondelete="CASCADE"), primary_key=True)
+    bucket = db.Column(db.Integer, primary_key=True)
+    count = db.Column(db.Integer, default=0, nullable=False)
+
+    @staticmethod
+    def bucket_for(rate):
+        # 與 SQLite 的 round()（rebuild、一致性檢查）相同：0.5 進位，而不是 Python round() 的四捨六入五成雙
+        return math.floor(float(rate) * 2 + 0.5)
+
+    @classmethod
+    def apply(cls, connection, movie_id, old_rate, new_rate):
+        """在目前的 flush 連線上增減分布，再用最多 10 列的分布重算 Movie.rating"""
+        if old_rate is not None:
+            connection.execute(
+                db.update(cls)
+                .where(cls.movie_id == movie_id, cls.bucket == cls.bucket_for(old_rate))
+                .values(count=cls.count - 1)
+            )
+        if new_rate is not None:
+            stmt = sqlite_insert(cls).values(
+                movie_id=movie_id, bucket=cls.bucket_for(new_rate), count=1
+            )
+            connection.execute(
+                stmt.on_conflict_do_update(
+                    index_elements=[cls.movie_id, cls.bucket],
+                    set_={"count": cls.count + 1},
+                )
+            )
+        average = (
+            db.select(
+                db.func.sum(cls.bucket * cls.count) / (2.0 * db.func.sum(cls.count))
+            )
+            .where(cls.movie_id == movie_id, cls.count > 0)
+            .scalar_subquery()
+        )
+        connection.execute(
+            db.update(Movie)
+            .where(Movie.id == movie_id)
+            .values(rating=db.func.coalesce(average, 0.0))
+        )
+
+    @classmethod
+    def for_movie(cls, movie_id):
+        """回傳 [(rate, count), ...]，從 0.5 到 5.0，沒有評論的分數補 0"""
+        counts = dict(
+            db.session.query(cls.bucket, cls.count).filter(cls.movie_id == movie_id).all()
+        )
+        return [(bucket / 2, counts.get(bucket, 0)) for bucket in range(1, 11)]
+
+    @classmethod
+    def rebuild(cls, movie_id=None):
+        """從 Review 重新統計分布（資料修復或既有資料庫補建用）"""
+        delete = db.delete(cls)
+        source = db.select(
+            Review.movie_id,
+            db.cast(db.func.round(Review.rate * 2), db.Integer).label("bucket"),
+            db.func.count().label("count"),
+        ).group_by(Review.movie_id, "bucket")
+        if movie_id is not None:
+            delete = delete.where(cls.movie_id == movie_id)
+            source = source.where(Review.movie_id == movie_id)
+        db.session.execute(delete)
+        db.session.execute(
+            db.insert(cls).from_select(["movie_id", "bucket", "count"], source)
+        )
+
+
+class MovieSimilarity(db.Model):
+    """每部電影的前 k 名相似電影，由背景工作計算；顯示時依主鍵 (movie_id, rank) 查詢"""
+    movie_id = db.Column(db.Integer, db.ForeignKey("movie.id", ondelete="CASCADE"), primary_key=True)
+    rank = db.Column(db.Integer, primary_key=True)
+    similar_movie_id = db.Column(
+        db.Integer, db.ForeignKey("movie.id", ondelete="CASCADE"), nullable=False, index=True
+    )
+    score = db.Column(db.Float, nullable=False)
+
+
+class RecommendationDirty(db.Model):
+    """收藏或評論有變動、相似度需要重算的電影"""
+    movie_id = db.Column(db.Integer, db.ForeignKey("movie.id", ondelete="CASCADE"), primary_key=True)
+    marked_at = db.Column(db.DateTime, default=datetime.now, nullable=False)
+
+    @classmethod
+    def mark(cls, connection, movie_ids):
+        rows = [{"movie_id": movie_id, "marked_at": datetime.now()} for movie_id in movie_ids]
+        if not rows:
+            return
+        stmt = sqlite_insert(cls)
+        connection.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[cls.movie_id], set_={"marked_at": stmt.excluded.marked_at}
+            ),
+            rows,
+        )
+
+
+# 經由 ORM 關聯變動收藏時記下各電影的增減，flush 時更新收藏數並寫入 RecommendationDirty
+# （favorites.py 的批次操作直接以 SQL 處理，不經過這裡）
+def _favorite_changed(target, value, delta):
+    session = db.object_session(target)
+    if session is not None and value.id is not None:
+        deltas = session.info.setdefault("favorite_deltas", {})
+        deltas[value.id] = deltas.get(value.id, 0) + delta
+
+
+@event.listens_for(User.favorite_movies, "append")
+def _favorite_appended(target, value, initiator):
+    _favorite_changed(target, value, 1)
+
+
+@event.listens_for(User.favorite_movies, "remove")
+def _favorite_removed(target, value, initiator):
+    _favorite_changed(target, value, -1)
+
+
+@event.listens_for(Session, "after_flush")
+def _flush_favorite_changes(session, flush_context):
+    deltas = session.info.pop("favorite_deltas", None)
+    if not deltas:
+        return
+    connection = session.connection()
+    RecommendationDirty.mark(connection, sorted(deltas))
+    for movie_id, delta in deltas.items():
+        if delta:
+            connection.execute(
+                db.update(Movie)
+                .where(Movie.id == movie_id)
+                .values(favorites_count=Movie.favorites_count + delta)
+            )
+
+
+class ScreeningStats(db.Model):
+    """
+    每個場次的售出座位數與營收（依場次、電影、影城、日期彙總）
+    訂位與取消時在同一個交易中增減，偏差由一致性檢查（consistency.py）分段校正
+    場次封存後彙總列保留（screening_id 不設外鍵），報表仍涵蓋歷史資料
+    """
+    __table_args__ = (
+        db.Index("ix_screening_stats_day_cinema", "day", "cinema_id"),
+        db.Index("ix_screening_stats_day_movie", "day", "movie_id"),
+    )
+
+    screening_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    movie_id = db.Column(db.Integer, db.ForeignKey("movie.id", ondelete="CASCADE"), nullable=False, index=True)
+    cinema_id = db.Column(db.Integer, db.ForeignKey("cinema.id", ondelete="CASCADE"), nullable=False, index=True)
+    day = db.Column(db.Date, nullable=False)
+    capacity = db.Column(db.Integer, nullable=False)  # Hall.size
+    seats_sold = db.Column(db.Integer, default=0, nullable=False)
+    revenue = db.Column(db.Float, default=0, nullable=False)
+
+
+class TrendingBucket(db.Model):
+    """各電影在每個時間區間內的訂位、評論、收藏數，由各 process 的計數器定期累加寫入"""
+    bucket_start = db.Column(db.DateTime, primary_key=True)
+    movie_id = db.Column(
+        db.Integer, db.ForeignKey("movie.id", ondelete="CASCADE"), primary_key=True, index=True
+    )
+    kind = db.Column(db.String(10), primary_key=True)  # booking / review / favorite
+    count = db.Column(db.Integer, default=0, nullable=False)
+
+
 class Seat(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     screening_id = db.Column(
-        db.Integer, db.ForeignKey("screening_time.id"), nullable=False
+        db.Integer, db.ForeignKey("screening_time.id", ondelete="CASCADE"), nullable=False, index=True
     )
     seat_number = db.Column(db.String(10), nullable=False)
     is_available = db.Column(db.Boolean, default=True, nullable=False)
 
 
 class Friend(db.Model):
+    # 查詢反向好友列（一致性檢查）與判斷是否已是好友
+    __table_args__ = (db.Index("ix_friend_user_friend", "user_id", "friend_id"),)
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     friend_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -180,14 +462,119 @@ class FriendRequest(db.Model):
     sender = db.relationship('User', foreign_keys=[sender_id])
     receiver = db.relationship('User', foreign_keys=[receiver_id])
 
+
+
+# ---- 封存表：超過保留期限的場次（連同訂單、訂位）與已處理的好友邀請，由 archival 批次搬入 ----
+
+class ArchivedScreening(db.Model):
+    __table_args__ = (
+        db.Index("ix_archived_screening_movie", "movie_id"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    movie_id = db.Column(db.Integer, db.ForeignKey("movie.id", ondelete="CASCADE"), nullable=False)
+    cinema_id = db.Column(db.Integer, db.ForeignKey("cinema.id", ondelete="CASCADE"), nullable=False, index=True)
+    hall_id = db.Column(db.Integer, db.ForeignKey("hall.id", ondelete="CASCADE"), nullable=False, index=True)
+    date = db.Column(db.DateTime, nullable=False)
+    price = db.Column(db.Float, nullable=False)
+    archived_at = db.Column(db.DateTime, default=datetime.now, nullable=False)
+    movie = db.relationship("Movie")
+    cinema = db.relationship("Cinema")
+    hall = db.relationship("Hall")
+
+
+class ArchivedOrder(db.Model):
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False, index=True)
+    screening_id = db.Column(
+        db.Integer, db.ForeignKey("archived_screening.id", ondelete="CASCADE"), nullable=False, index=True
+    )
+    unit_price = db.Column(db.Float, nullable=False)
+    seat_count = db.Column(db.Integer, nullable=False)
+    total = db.Column(db.Float, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+    bookings = db.relationship("ArchivedBooking", backref="order", lazy=True, passive_deletes=True)
+    screening = db.relationship("ArchivedScreening")
+
+
+class ArchivedBooking(db.Model):
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False, index=True)
+    screening_id = db.Column(
+        db.Integer, db.ForeignKey("archived_screening.id", ondelete="CASCADE"), nullable=False, index=True
+    )
+    order_id = db.Column(
+        db.Integer, db.ForeignKey("archived_order.id", ondelete="CASCADE"), nullable=True, index=True
+    )
+    seat_number = db.Column(db.String(10), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+    screening = db.relationship("ArchivedScreening")
+
+
+class ArchivedFriendRequest(db.Model):
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    sender_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    receiver_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    status = db.Column(db.String(20), nullable=False)  # accepted / rejected
+    archived_at = db.Column(db.DateTime, default=datetime.now, nullable=False)
+
+
+class PendingFilePurge(db.Model):
+    """交易提交後才要刪除的檔案（例如已刪除電影的海報），由背景 worker 處理"""
+    id = db.Column(db.Integer, primary_key=True)
+    path = db.Column(db.String(300), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.now, nullable=False)
+
+class StoredSession(db.Model):
+    """SESSION_BACKEND = "sqlite" 時的伺服器端 session"""
+    sid = db.Column(db.String(64), primary_key=True)
+    data = db.Column(db.Text, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
 class CinemaMovie(db.Model):
     __tablename__ = 'cinema_movies'
     id = db.Column(db.Integer, primary_key=True)
-    cinema_id = db.Column(db.Integer, db.ForeignKey('cinema.id'), nullable=False)
-    movie_id = db.Column(db.Integer, db.ForeignKey('movie.id'), nullable=False)
+    cinema_id = db.Column(db.Integer, db.ForeignKey('cinema.id', ondelete='CASCADE'), nullable=False, index=True)
+    movie_id = db.Column(db.Integer, db.ForeignKey('movie.id', ondelete='CASCADE'), nullable=False, index=True)
+
+    cinema = db.relationship('Cinema', backref=db.backref('cinema_movies', passive_deletes=True))
+    movie = db.relationship('Movie', backref=db.backref('cinema_movies', passive_deletes=True))
 
-    cinema = db.relationship('Cinema', backref='cinema_movies')
-    movie = db.relationship('Movie', backref='cinema_movies')
+
+class TableVersion(db.Model):
+    """
+    各資料表的版本號，由 SQLite trigger 在每次 INSERT / UPDATE / DELETE 時加一
+    快取快照用來判斷資料是否變過（包含不經過 ORM 的批次 SQL）
+    """
+    __tablename__ = "table_version"
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, default=0, nullable=False)
+
+    @classmethod
+    def current(cls, names):
+        """{資料表: 版本號}；不在表中的資料表視為 0"""
+        versions = dict.fromkeys(names, 0)
+        versions.update(
+            db.session.query(cls.name, cls.version).filter(cls.name.in_(list(names))).all()
+        )
+        return versions
+
+
+VERSIONED_TABLES = ("movie", "cinema", "hall", "screening_time", "booking")
+
+
+@event.listens_for(db.metadata, "after_create")
+def _create_version_triggers(target, connection, **kw):
+    for table in VERSIONED_TABLES:
+        connection.exec_driver_sql(
+            "INSERT OR IGNORE INTO table_version (name, version) VALUES (?, 0)", (table,)
+        )
+        for operation in ("INSERT", "UPDATE", "DELETE"):
+            connection.exec_driver_sql(
+                f"CREATE TRIGGER IF NOT EXISTS {table}_{operation.lower()}_version "
+                f"AFTER {operation} ON {table} BEGIN "
+                f"UPDATE table_version SET version = version + 1 WHERE name = '{table}'; END"
+            )
 
 
 @login_manager.user_loader
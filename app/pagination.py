@@ -0,0 +1,114 @@
+# pagination.py
+import base64
+import json
+
+from sqlalchemy import tuple_
+
+from app import db
+from app.cache import cache
+
+TOTAL_CACHE_TTL = 60
+# cursor 內排序鍵允許的型別（JSON 的字串、數字、null）；bool 是 int 的子類別，另外排除
+CURSOR_VALUE_TYPES = (str, int, float, type(None))
+
+
+def encode_cursor(values, direction):
+    """將排序鍵值與方向編碼為不透明的 cursor 字串"""
+    payload = json.dumps({"k": list(values), "d": direction}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token, size):
+    """解析 cursor，格式錯誤或鍵值型別不符時回傳 (None, None) 代表第一頁"""
+    if not token:
+        return None, None
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        values, direction = payload["k"], payload["d"]
+    except (ValueError, KeyError, TypeError):
+        return None, None
+    if direction not in ("next", "prev") or not isinstance(values, list) or len(values) != size:
+        return None, None
+    if any(isinstance(v, bool) or not isinstance(v, CURSOR_VALUE_TYPES) for v in values):
+        return None, None
+    return values, direction
+
+
+def approximate_total(key, model, criteria=()):
+    """
+    回傳快取的總筆數，過期才重新 COUNT(*)
+    只傳入 model 與條件：重新計算可能在背景執行緒中進行，查詢要在當下以該執行緒的 db.session 建立
+    """
+
+    def count():
+        return db.session.scalar(
+            db.select(db.func.count()).select_from(model).where(*criteria)
+        )
+
+    return cache.get_or_compute(f"total:{cache.version('totals')}:{key}", count, TOTAL_CACHE_TTL)
+
+
+def invalidate_totals():
+    cache.bump_version("totals")
+
+
+class KeysetPage:
+    """與 Flask-SQLAlchemy Pagination 相容的欄位：items / has_next / has_prev"""
+
+    def __init__(self, items, next_cursor, prev_cursor, total):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def keyset_paginate(query, columns, cursor=None, per_page=12, total=None):
+    """
+    以 (排序鍵, id) 做 keyset 分頁，全部欄位以遞減排序
+    total 為呼叫端提供的總筆數（通常來自 approximate_total），只用於顯示
+    columns 最後一個必須是唯一欄位（通常是 id），確保順序穩定
+    不使用 OFFSET，任何頁數都只掃描 per_page + 1 筆索引
+    """
+    values, direction = decode_cursor(cursor, len(columns))
+    key = tuple_(*columns)
+
+    page_query = query
+    if values is None:
+        page_query = page_query.order_by(*[c.desc() for c in columns])
+    elif direction == "next":
+        page_query = page_query.filter(key < tuple_(*values)).order_by(
+            *[c.desc() for c in columns]
+        )
+    else:
+        page_query = page_query.filter(key > tuple_(*values)).order_by(
+            *[c.asc() for c in columns]
+        )
+
+    rows = page_query.limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if direction == "prev":
+        rows.reverse()
+
+    def row_key(row):
+        return [getattr(row, c.key) for c in columns]
+
+    next_cursor = prev_cursor = None
+    if rows:
+        # 往後翻：有多抓到一筆，或是從後一頁往回翻
+        if (direction != "prev" and has_more) or direction == "prev":
+            next_cursor = encode_cursor(row_key(rows[-1]), "next")
+        # 往前翻：不是第一頁
+        if (direction == "prev" and has_more) or direction == "next":
+            prev_cursor = encode_cursor(row_key(rows[0]), "prev")
+
+    return KeysetPage(rows, next_cursor, prev_cursor, total)
@@ -0,0 +1,201 @@
+# ratelimit.py
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask import Response, jsonify, request, session
+
+RATELIMIT_SWEEP_WORKER = "ratelimit-sweep"
+
+
+class MemoryBucketStore:
+    """單一 process 的 token bucket，超過 max_entries 時淘汰最久沒用到的桶"""
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self._buckets = OrderedDict()  # {key: (tokens, updated_at)}
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate, now=None):
+        """
+        取一個 token，回傳 (是否允許, 需等待的秒數)
+        桶以 rate（每秒）補充，最多 capacity 個
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated_at) * rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                self._buckets.move_to_end(key)
+                while len(self._buckets) > self.max_entries:
+                    self._buckets.popitem(last=False)
+                return True, 0
+            return False, (1 - tokens) / rate
+
+    def sweep(self, idle_seconds):
+        now = time.time()
+        with self._lock:
+            idle = [
+                key
+                for key, (_, updated_at) in self._buckets.items()
+                if updated_at <= now - idle_seconds
+            ]
+            for key in idle:
+                del self._buckets[key]
+
+
+class SqliteBucketStore:
+    """
+    多個 worker process 共用的 token bucket（instance/ 下的 SQLite 檔案，與資料庫分開）
+    補充與扣除在同一個 UPSERT 中完成，不需要額外的鎖
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        # fork 之後子 process 不能沿用父 process 的連線
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset_connections)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS bucket ("
+                "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+
+    def _reset_connections(self):
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")  # 計數遺失只會讓桶變滿，不需要落盤
+            self._local.conn = conn
+        return conn
+
+    def take(self, key, capacity, rate, now=None):
+        now = time.time() if now is None else now
+        conn = self._connect()
+        # 新的桶從滿的開始；既有的桶先補充再扣一個，不夠時 WHERE 不成立、不回傳任何列
+        row = conn.execute(
+            "INSERT INTO bucket (key, tokens, updated_at) VALUES (?1, ?2 - 1, ?4) "
+            "ON CONFLICT (key) DO UPDATE SET "
+            "tokens = min(?2, tokens + (?4 - updated_at) * ?3) - 1, updated_at = ?4 "
+            "WHERE min(?2, tokens + (?4 - updated_at) * ?3) >= 1 "
+            "RETURNING tokens",
+            (key, capacity, rate, now),
+        ).fetchone()
+        if row is not None:
+            return True, 0
+        current = conn.execute(
+            "SELECT min(?2, tokens + (?3 - updated_at) * ?4) FROM bucket WHERE key = ?1",
+            (key, capacity, now, rate),
+        ).fetchone()
+        tokens = current[0] if current else 0
+        return False, max(1 - tokens, 0) / rate
+
+    def sweep(self, idle_seconds, batch_size=1000):
+        """刪除閒置夠久（早已補滿）的桶，分批進行"""
+        conn = self._connect()
+        while True:
+            count = conn.execute(
+                "DELETE FROM bucket WHERE key IN ("
+                "SELECT key FROM bucket WHERE updated_at <= ? LIMIT ?)",
+                (time.time() - idle_seconds, batch_size),
+            ).rowcount
+            if count < batch_size:
+                return
+
+
+def rate_limit(endpoint_class, methods=None):
+    """
+    標記 view 所屬的端點類別（config 的 RATE_LIMITS），由 before_request 統一檢查
+    methods 指定時只限制這些 HTTP 方法（例如頁面 GET 不限、表單 POST 限制）
+    """
+
+    def decorator(view):
+        view.rate_limit_class = endpoint_class
+        view.rate_limit_methods = methods
+        return view
+
+    return decorator
+
+
+def _too_many_requests(retry_after):
+    retry_after = max(int(math.ceil(retry_after)), 1)
+    # fetch / JSON 請求回傳 JSON，一般表單送出回傳純文字
+    if request.is_json or (
+        request.accept_mimetypes.accept_json and not request.accept_mimetypes.accept_html
+    ):
+        response = jsonify({"error": "rate_limited", "retry_after": retry_after})
+    else:
+        response = Response("Too many requests, please try again later.", mimetype="text/plain")
+    response.status_code = 429
+    response.headers["Retry-After"] = str(retry_after)
+    return response
+
+
+def init_ratelimit(app):
+    """
+    依 RATELIMIT_BACKEND 建立 token bucket：memory（單一 process）/ sqlite（多 worker 共用）
+    以 app 層級的 before_request 檢查，比 blueprint 的 before_request 與登入使用者的載入更早，
+    超過限制的請求不會碰到資料庫
+    """
+    if not app.config.get("RATELIMIT_ENABLED", True):
+        return None
+    backend = app.config.get("RATELIMIT_BACKEND", "memory")
+    if backend == "memory":
+        store = MemoryBucketStore(app.config.get("RATELIMIT_MEMORY_MAX_ENTRIES", 100000))
+    elif backend == "sqlite":
+        path = app.config.get("RATELIMIT_SQLITE_PATH") or os.path.join(app.instance_path, "ratelimit.db")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        store = SqliteBucketStore(path)
+    else:
+        raise ValueError(f"Unknown RATELIMIT_BACKEND: {backend}")
+    limits = app.config["RATE_LIMITS"]
+
+    @app.before_request
+    def check_rate_limit():
+        view = app.view_functions.get(request.endpoint)
+        endpoint_class = getattr(view, "rate_limit_class", None)
+        if endpoint_class is None:
+            return None
+        methods = view.rate_limit_methods
+        if methods is not None and request.method not in methods:
+            return None
+        # 使用者 id 直接從 session 讀取（Flask-Login 存放的 _user_id），不必載入 User
+        scopes = [("ip", request.remote_addr or "-")]
+        user_id = session.get("_user_id")
+        if user_id is not None:
+            scopes.append(("user", user_id))
+        for scope, identity in scopes:
+            limit = limits[endpoint_class].get(scope)
+            if limit is None:
+                continue
+            capacity, per_minute = limit
+            allowed, retry_after = store.take(
+                f"{endpoint_class}:{scope}:{identity}", capacity, per_minute / 60
+            )
+            if not allowed:
+                app.logger.info(
+                    "Rate limited",
+                    extra={"endpoint_class": endpoint_class, "scope": scope, "identity": identity},
+                )
+                return _too_many_requests(retry_after)
+        return None
+
+    from .workers import register_worker
+
+    idle_seconds = app.config.get("RATELIMIT_IDLE_SECONDS", 3600)
+    register_worker(
+        app,
+        RATELIMIT_SWEEP_WORKER,
+        app.config.get("RATELIMIT_SWEEP_INTERVAL", 300),
+        lambda: store.sweep(idle_seconds),
+    )
+    return store
@@ -0,0 +1,203 @@
+# recommendations.py
+import heapq
+import math
+import os
+import pickle
+import subprocess
+import sys
+from collections import defaultdict
+from datetime import datetime
+
+from flask import current_app
+
+from app import db
+from app.models import Movie, MovieSimilarity, RecommendationDirty, Review, user_favorites
+
+RECOMMENDATION_WORKER = "recommendations"
+TOP_K = 10
+HIGH_RATING = 4.0  # 評分達到此分數才視為「喜歡」
+FAVORITE_WEIGHT = 1.0
+WRITE_CHUNK = 500
+
+# ---- 計算（在獨立的 process 中執行，只處理純資料） ----
+
+def compute_similarities(vectors, targets, top_k=TOP_K):
+    """
+    vectors: {movie_id: {user_id: weight}}，稀疏的 電影 × 使用者 矩陣
+    回傳 {movie_id: [(similar_movie_id, score), ...]}，只計算 targets 中的電影
+    cosine(i, j) = Σ_u w_ui·w_uj / (‖i‖·‖j‖)，只走過有共同使用者的電影
+    """
+    norms = {
+        movie_id: math.sqrt(sum(weight * weight for weight in users.values()))
+        for movie_id, users in vectors.items()
+    }
+    by_user = defaultdict(list)
+    for movie_id, users in vectors.items():
+        for user_id, weight in users.items():
+            by_user[user_id].append((movie_id, weight))
+
+    result = {}
+    for movie_id in targets:
+        users = vectors.get(movie_id)
+        if not users or not norms[movie_id]:
+            result[movie_id] = []
+            continue
+        dots = defaultdict(float)
+        for user_id, weight in users.items():
+            for other_id, other_weight in by_user[user_id]:
+                if other_id != movie_id:
+                    dots[other_id] += weight * other_weight
+        scores = (
+            (dot / (norms[movie_id] * norms[other_id]), other_id)
+            for other_id, dot in dots.items()
+        )
+        # 分數相同時以電影 id 小者優先，結果固定
+        best = heapq.nsmallest(top_k, scores, key=lambda item: (-item[0], item[1]))
+        result[movie_id] = [(other_id, round(score, 6)) for score, other_id in best]
+    return result
+
+
+def compute_in_subprocess(vectors, targets, top_k):
+    """
+    在新的 python process 中計算（python -m app.recommendations），資料以 pickle 經 stdin/stdout 傳遞
+    不會佔用 web process 的 GIL，也不會 fork 出帶著執行緒與資料庫連線的子 process
+    """
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    completed = subprocess.run(
+        [sys.executable, "-m", "app.recommendations"],
+        input=pickle.dumps((vectors, targets, top_k), pickle.HIGHEST_PROTOCOL),
+        capture_output=True,
+        cwd=project_root,
+        check=True,
+    )
+    return pickle.loads(completed.stdout)
+
+
+# ---- 資料載入與寫入 ----
+
+def load_vectors():
+    """收藏與高分評論合併成每部電影的使用者權重；同一人兩者皆有時取較大者"""
+    vectors = defaultdict(dict)
+    for user_id, movie_id in db.session.execute(
+        db.select(user_favorites.c.user_id, user_favorites.c.movie_id)
+    ):
+        vectors[movie_id][user_id] = FAVORITE_WEIGHT
+    for user_id, movie_id, rate in db.session.execute(
+        db.select(Review.user_id, Review.movie_id, Review.rate).where(Review.rate >= HIGH_RATING)
+    ):
+        weight = rate / 5.0
+        if weight > vectors[movie_id].get(user_id, 0):
+            vectors[movie_id][user_id] = weight
+    return dict(vectors)
+
+
+def _affected_movies(vectors, dirty_ids):
+    """
+    需要重算的電影：變動的電影本身、與它們有共同使用者的電影，
+    以及目前把它們列為相似電影的電影（共同使用者消失時分數也要移除）
+    """
+    dirty_users = {user_id for movie_id in dirty_ids for user_id in vectors.get(movie_id, {})}
+    affected = set(dirty_ids)
+    affected.update(
+        movie_id
+        for movie_id, users in vectors.items()
+        if not dirty_users.isdisjoint(users)
+    )
+    if dirty_ids:
+        affected.update(
+            db.session.scalars(
+                db.select(MovieSimilarity.movie_id).where(
+                    MovieSimilarity.similar_movie_id.in_(dirty_ids)
+                )
+            )
+        )
+    return affected
+
+
+def _write_similarities(similarities):
+    movie_ids = list(similarities)
+    for start in range(0, len(movie_ids), WRITE_CHUNK):
+        chunk = movie_ids[start:start + WRITE_CHUNK]
+        db.session.execute(db.delete(MovieSimilarity).where(MovieSimilarity.movie_id.in_(chunk)))
+        rows = [
+            {"movie_id": movie_id, "rank": rank, "similar_movie_id": other_id, "score": score}
+            for movie_id in chunk
+            for rank, (other_id, score) in enumerate(similarities[movie_id], start=1)
+        ]
+        if rows:
+            db.session.execute(db.insert(MovieSimilarity), rows)
+
+
+def refresh_recommendations(full=False, top_k=None):
+    """
+    重算相似電影表
+    預設只重算 RecommendationDirty 影響到的電影；表為空或 full=True 時全部重算
+    回傳重算的電影數
+    """
+    top_k = top_k or current_app.config.get("RECOMMENDATION_TOP_K", TOP_K)
+    started_at = datetime.now()
+    if not full:
+        full = not db.session.query(db.select(MovieSimilarity.movie_id).exists()).scalar()
+    dirty_ids = [] if full else list(db.session.scalars(db.select(RecommendationDirty.movie_id)))
+    if not full and not dirty_ids:
+        return 0
+
+    vectors = load_vectors()
+    if full:
+        targets = set(db.session.scalars(db.select(Movie.id)))
+    else:
+        targets = _affected_movies(vectors, dirty_ids)
+    if current_app.config.get("RECOMMENDATION_PROCESS", True):
+        similarities = compute_in_subprocess(vectors, targets, top_k)
+    else:
+        similarities = compute_similarities(vectors, targets, top_k)
+
+    _write_similarities(similarities)
+    # 計算期間又有變動的電影保留在表中，下一輪再處理
+    db.session.execute(
+        db.delete(RecommendationDirty).where(RecommendationDirty.marked_at <= started_at)
+    )
+    db.session.commit()
+    return len(similarities)
+
+
+# ---- 查詢 ----
+
+def similar_movies(movie_id, limit=6):
+    """單一索引查詢：依 (movie_id, rank) 取出相似電影"""
+    return (
+        db.session.query(Movie.id, Movie.title, Movie.poster_url, Movie.rating, MovieSimilarity.score)
+        .join(MovieSimilarity, MovieSimilarity.similar_movie_id == Movie.id)
+        .filter(MovieSimilarity.movie_id == movie_id)
+        .order_by(MovieSimilarity.rank)
+        .limit(limit)
+        .all()
+    )
+
+
+def recommend_for_movies(movie_ids, limit=6):
+    """依多部電影（例如使用者的收藏）的相似電影加總分數，排除原本的電影"""
+    movie_ids = set(movie_ids)
+    if not movie_ids:
+        return []
+    rows = (
+        db.session.query(
+            Movie.id, Movie.title, Movie.poster_url, Movie.rating, MovieSimilarity.score
+        )
+        .join(MovieSimilarity, MovieSimilarity.similar_movie_id == Movie.id)
+        .filter(MovieSimilarity.movie_id.in_(movie_ids))
+        .all()
+    )
+    totals = {}
+    for row in rows:
+        if row.id in movie_ids:
+            continue
+        total = totals.get(row.id)
+        totals[row.id] = (row, row.score + (total[1] if total else 0))
+    best = sorted(totals.values(), key=lambda item: (-item[1], item[0].id))[:limit]
+    return [row for row, _ in best]
+
+
+if __name__ == "__main__":
+    _vectors, _targets, _top_k = pickle.load(sys.stdin.buffer)
+    pickle.dump(compute_similarities(_vectors, _targets, _top_k), sys.stdout.buffer)
@@ -0,0 +1,159 @@
+# rollups.py
+from app import db
+from app.models import (
+    ArchivedScreening,
+    Booking,
+    Cinema,
+    Hall,
+    Movie,
+    Order,
+    ScreeningStats,
+    ScreeningTime,
+)
+
+
+def _stats_select(screening_filter=None):
+    """以一個 GROUP BY 查詢彙總場次的售出座位與營收；營收以訂單當時的單價計算"""
+    query = (
+        db.select(
+            ScreeningTime.id,
+            ScreeningTime.movie_id,
+            ScreeningTime.cinema_id,
+            db.func.date(ScreeningTime.date),
+            Hall.size,
+            db.func.count(Booking.id),
+            db.func.coalesce(
+                db.func.sum(db.func.coalesce(Order.unit_price, ScreeningTime.price)).filter(
+                    Booking.id.isnot(None)
+                ),
+                0,
+            ),
+        )
+        .join(Hall, ScreeningTime.hall_id == Hall.id)
+        .outerjoin(Booking, Booking.screening_id == ScreeningTime.id)
+        .outerjoin(Order, Booking.order_id == Order.id)
+        .group_by(ScreeningTime.id)
+    )
+    if screening_filter is not None:
+        query = query.where(screening_filter)
+    return query
+
+
+_STATS_COLUMNS = ["screening_id", "movie_id", "cinema_id", "day", "capacity", "seats_sold", "revenue"]
+
+
+def rebuild_screening_stats(start=None, end=None):
+    """
+    批次重建彙總表（初次建立或手動修復用）；可指定場次日期範圍 [start, end)
+    刪除與重建在同一個交易中，回傳重建的場次數
+    已封存場次的彙總列保留不動（封存後訂位不再變動）
+    """
+    conditions = []
+    if start is not None:
+        conditions.append(ScreeningTime.date >= start)
+    if end is not None:
+        conditions.append(ScreeningTime.date < end)
+    screening_filter = db.and_(*conditions) if conditions else None
+
+    delete = db.delete(ScreeningStats)
+    if screening_filter is not None:
+        delete = delete.where(
+            ScreeningStats.screening_id.in_(db.select(ScreeningTime.id).where(screening_filter))
+        )
+    else:
+        delete = delete.where(ScreeningStats.screening_id.notin_(db.select(ArchivedScreening.id)))
+    db.session.execute(delete)
+    result = db.session.execute(
+        db.insert(ScreeningStats).from_select(_STATS_COLUMNS, _stats_select(screening_filter))
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def expected_screening_stats(first_id, last_id):
+    """由訂位重新計算 [first_id, last_id] 場次的彙總，回傳 {screening_id: (movie_id, cinema_id, day, capacity, seats_sold, revenue)}"""
+    rows = db.session.execute(_stats_select(ScreeningTime.id.between(first_id, last_id)))
+    return {row[0]: tuple(row[1:]) for row in rows}
+
+
+def refresh_screening_stats(screening_ids):
+    """在目前交易中重算指定場次的彙總列（一致性檢查修復用）"""
+    db.session.execute(db.delete(ScreeningStats).where(ScreeningStats.screening_id.in_(screening_ids)))
+    db.session.execute(
+        db.insert(ScreeningStats).from_select(
+            _STATS_COLUMNS, _stats_select(ScreeningTime.id.in_(screening_ids))
+        )
+    )
+
+
+def apply_booking_deltas(deltas):
+    """
+    訂位、取消後在目前交易中增減彙總（需在 flush 之後呼叫）
+    deltas: {screening_id: (座位增減, 營收增減)}
+    彙總列不存在時（新場次）直接由該場次目前的訂位計算
+    """
+    for screening_id, (seats, revenue) in deltas.items():
+        updated = db.session.execute(
+            db.update(ScreeningStats)
+            .where(ScreeningStats.screening_id == screening_id)
+            .values(
+                seats_sold=ScreeningStats.seats_sold + seats,
+                revenue=ScreeningStats.revenue + revenue,
+            )
+        ).rowcount
+        if not updated:
+            db.session.execute(
+                db.insert(ScreeningStats).from_select(
+                    _STATS_COLUMNS, _stats_select(ScreeningTime.id == screening_id)
+                )
+            )
+
+
+# ---- 報表查詢（只讀彙總表） ----
+
+def _totals(group_column, start, end):
+    return (
+        db.session.query(
+            group_column,
+            db.func.sum(ScreeningStats.seats_sold).label("seats_sold"),
+            db.func.sum(ScreeningStats.capacity).label("capacity"),
+            db.func.sum(ScreeningStats.revenue).label("revenue"),
+        )
+        .filter(ScreeningStats.day >= start, ScreeningStats.day <= end)
+    )
+
+
+def _row(label, seats_sold, capacity, revenue):
+    return {
+        "label": label,
+        "seats_sold": seats_sold or 0,
+        "capacity": capacity or 0,
+        "fill_rate": (seats_sold or 0) / capacity if capacity else 0,
+        "revenue": revenue or 0,
+    }
+
+
+def daily_stats(start, end):
+    rows = _totals(ScreeningStats.day, start, end).group_by(ScreeningStats.day).order_by(ScreeningStats.day)
+    return [_row(day, *values) for day, *values in rows]
+
+
+def cinema_stats(start, end):
+    rows = (
+        _totals(Cinema.name, start, end)
+        .join(Cinema, Cinema.id == ScreeningStats.cinema_id)
+        .group_by(ScreeningStats.cinema_id)
+        .order_by(db.desc("revenue"))
+    )
+    return [_row(name, *values) for name, *values in rows]
+
+
+def movie_stats(start, end, limit=10):
+    rows = (
+        _totals(Movie.title, start, end)
+        .join(Movie, Movie.id == ScreeningStats.movie_id)
+        .group_by(ScreeningStats.movie_id)
+        .order_by(db.desc("revenue"))
+        .limit(limit)
+    )
+    return [_row(title, *values) for title, *values in rows]
@@ -8,149 +8,194 @@ from flask import (
     request,
     session,
     jsonify,
+    Response,
+    abort,
 )
 from flask import current_app
 from flask_login import login_user, logout_user, login_required, current_user
-from app import db
+from app import db, favorites
 
 from flask import request, redirect, url_for
-from app.models import User, Movie, Cinema, ScreeningTime, Booking, Friend, Review, Booking, Hall, Seat, user_favorites
-from .models import User, FriendRequest, Review
+from app.models import User, Movie, Cinema, ScreeningTime, Booking, Friend, Review, Booking, Hall, Seat, SeatHold, user_favorites
+from .models import User, FriendRequest, Review, MovieRatingHistogram
 from app.forms import RegistrationForm, LoginForm, BookingForm
-from datetime import datetime
-from sqlalchemy import and_, exists
-from sqlalchemy.exc import IntegrityError
+from app.archival import get_order, user_booking_history
+from app.booking import (
+    BookingBusy,
+    BookingQueueFull,
+    BookingTimeout,
+    allocate_seats as allocate_seats_service,
+    booked_seats,
+    cancel_booking as cancel_booking_service,
+    reserve_seats,
+)
+from app.cache import cached
+from app.deletion import delete_movie as delete_movie_service
+from app.geo import nearby_cinemas as nearby_cinemas_service, next_screenings, parse_coordinates
+from app.exports import DATASETS, EXPORT_CHUNK_SIZE, FORMATS, build_export_query, stream_export
+from app.importer import IMPORT_BATCH_SIZE, KINDS as IMPORT_KINDS, import_file
+from app.pagination import approximate_total, keyset_paginate
+from app.ratelimit import rate_limit
+from app.recommendations import recommend_for_movies, similar_movies
+from app.rollups import cinema_stats, daily_stats, movie_stats
+from app.seating import hall_layout, parse_layout
+from app.showtimes import TIME_SLOTS, facet_counts, parse_filters, search_showtimes
+from app.trending import trending_movies
+from app.scheduling import (
+    CLEANING_GAP,
+    DEFAULT_DURATION,
+    DEFAULT_PRICE,
+    DEFAULT_SHOWTIMES,
+    SCHEDULE_WINDOW_DAYS,
+    ScheduleConflictError,
+    cinema_schedule,
+    find_hall_conflicts,
+    load_existing_screenings,
+    schedule_movies,
+    upcoming_movie_screenings,
+)
+from datetime import datetime, timedelta
 import os 
 from werkzeug.utils import secure_filename
 from flask import jsonify
 from flask import session
 from werkzeug.security import generate_password_hash
+import logging
 
 main = Blueprint("main", __name__)
 auth = Blueprint("auth", __name__)
-import app
+logger = logging.getLogger(__name__)
+
+def _movie_cards(movies):
+    return [
+        {
+            "id": movie.id,
+            "title": movie.title,
+            "poster_url": movie.poster_url,
+            "rating": movie.rating,
+            "comments_count": movie.comments_count,
+        }
+        for movie in movies
+    ]
 
-def update_movie_status():
-    """
-    更新電影的 is_current 狀態
-    根據是否有未來的放映場次來判斷電影是否為當前上映中
-    """
-    current_time = datetime.now()
-    
-    # 找出所有電影
-    movies = Movie.query.all()
-    
-    for movie in movies:
-        # 檢查該電影是否有未來的放映場次
-        has_future_screenings = db.session.query(exists().where(
-            and_(
-                ScreeningTime.movie_id == movie.id,
-                ScreeningTime.date >= current_time
-            )
-        )).scalar()
-        
-        # 更新電影狀態
-        if movie.is_current != has_future_screenings:
-            movie.is_current = has_future_screenings
-    
-    # 提交所有更改
-    try:
-        db.session.commit()
-        print(f"已更新所有電影狀態於 {current_time}")
-    except Exception as e:
-        db.session.rollback()
-        print(f"更新電影狀態時發生錯誤: {str(e)}")
 
-@main.before_request
-def before_request():
-    update_movie_status()
+@cached(timeout=30, key_prefix="home_lists")
+def home_movie_lists():
+    """首頁的三個列表，快取為純資料，過期時由單一請求重新計算"""
+    return {
+        "movies": _movie_cards(Movie.query.filter_by(is_current=True).limit(10).all()),
+        "top_rated_movies": _movie_cards(
+            Movie.query.order_by(Movie.rating.desc()).limit(5).all()
+        ),
+        "most_commented_movies": _movie_cards(
+            Movie.query.order_by(Movie.comments_count.desc()).limit(5).all()
+        ),
+    }
+
 
 @main.route("/")
 def home():
-    movies = Movie.query.filter_by(is_current=True).limit(10).all()
-    top_rated_movies = Movie.query.order_by(Movie.rating.desc()).limit(5).all()
-    most_commented_movies = (
-        Movie.query.order_by(Movie.comments_count.desc()).limit(5).all()
-    )
+    lists = home_movie_lists()
 
     return render_template(
         "home.html",
-        movies=movies,
-        top_rated_movies=top_rated_movies,
-        most_commented_movies=most_commented_movies,
+        trending_movies=trending_movies(),
+        movies=lists["movies"],
+        top_rated_movies=lists["top_rated_movies"],
+        most_commented_movies=lists["most_commented_movies"],
     )
 
 
+REVIEW_SORTS = {
+    "recent": [Review.id],
+    "rating": [Review.rate, Review.id],
+}
+
+
 @main.route("/movie/<int:movie_id>")
 def movie_detail(movie_id):
     movie = Movie.query.get_or_404(movie_id)
     current_time = datetime.now()
-    reviews = (
-        Review.query.filter_by(movie_id=movie_id)
+    sort = request.args.get("sort", "recent")
+    if sort not in REVIEW_SORTS:
+        sort = "recent"
+    # 評論與使用者名稱在同一個查詢中取得，以 keyset 分頁
+    reviews_query = (
+        db.session.query(
+            Review.id, Review.rate, Review.content, Review.user_id, User.username
+        )
         .join(User, Review.user_id == User.id)
-        .add_columns(User.username, Review.content, Review.rate)
-        .all()
-    )
-    average_rating = (
-        db.session.query(db.func.avg(Review.rate))
         .filter(Review.movie_id == movie_id)
-        .scalar()
     )
-    average_rating = round(average_rating, 1) if average_rating else 0
-    screenings = ScreeningTime.query.filter(
-        ScreeningTime.movie_id == movie_id,
-        ScreeningTime.date >= current_time  
-    ).all()
-    return render_template("movie_detail.html", movie=movie, reviews=reviews, screenings=screenings, average_rating=average_rating)
+    reviews = keyset_paginate(
+        reviews_query,
+        REVIEW_SORTS[sort],
+        cursor=request.args.get("cursor"),
+        per_page=10,
+    )
+    # 平均評分直接使用 Movie.rating（由評分分布維護），不再另外 AVG
+    average_rating = round(movie.rating, 1) if movie.rating else 0
+    histogram = MovieRatingHistogram.for_movie(movie_id)
+    screenings = upcoming_movie_screenings(movie_id, current_time)
+    return render_template(
+        "movie_detail.html",
+        similar=similar_movies(movie_id),
+        movie=movie,
+        reviews=reviews,
+        review_sort=sort,
+        histogram=histogram,
+        histogram_max=max([count for _, count in histogram] + [1]),
+        screenings=screenings,
+        average_rating=average_rating,
+    )
 
 
 @main.route("/favorite/<int:movie_id>", methods=["POST"])
+@rate_limit("favorite")
 @login_required
 def toggle_favorite(movie_id):
-    movie = Movie.query.get_or_404(movie_id)
-    if movie in current_user.favorite_movies:
-        current_user.favorite_movies.remove(movie)
-    else:
-        current_user.favorite_movies.append(movie)
-    db.session.commit()
+    Movie.query.get_or_404(movie_id)
+    favorites.toggle_favorite(current_user.id, movie_id)
     return redirect(url_for("main.movie_detail", movie_id=movie_id))
 
 
+@main.route("/favorites", methods=["POST"])
+@rate_limit("favorite")
+@login_required
+def update_favorites():
+    """批次加入、移除收藏：{"add": [movie_id, ...], "remove": [movie_id, ...]}"""
+    data = request.get_json(silent=True) or {}
+    try:
+        add = [int(movie_id) for movie_id in data.get("add", [])]
+        remove = [int(movie_id) for movie_id in data.get("remove", [])]
+    except (TypeError, ValueError):
+        return jsonify({"error": "invalid movie id"}), 400
+    added = favorites.add_favorites(current_user.id, add)
+    removed = favorites.remove_favorites(current_user.id, remove)
+    return jsonify({"added": added, "removed": removed})
+
+
 @main.route("/book/<int:screening_id>", methods=["GET", "POST"])
+@rate_limit("booking", methods=("POST",))
 @login_required
 def book_seat(screening_id):
 
     screening = ScreeningTime.query.get_or_404(screening_id)
     form = BookingForm()
 
-    bookings = Booking.query.filter_by(screening_id=screening_id).all()
-    screening.cinema_id
-    total_seats = (
-        Hall.query.with_entities(Hall.size).filter_by(id=screening.hall.id).one()[0]
-    )
-    # 定義座位表（假設一個固定座位結構）
-    seats_per_row = 10
-    total_rows = total_seats // seats_per_row
-
-    seating_chart = [  # 初始化座位表
-        [
-            {"seat_number": row * seats_per_row + seat + 1, "status": "available"}
-            for seat in range(seats_per_row)
-        ]
-        for row in range(total_rows)
-    ]
-    # app.logging.debug(seating_chart)
-    # 標記已預約的座位
-    for booking in bookings:
-        seat_number = int(booking.seat_number)
-        row = (seat_number - 1) // seats_per_row
-        seat = (seat_number - 1) % seats_per_row
-
-        # 標記該座位為已預約
-        if 0 <= row < total_rows and 0 <= seat < seats_per_row:
-            seating_chart[row][seat]["status"] = "booked"
-        else:
-            print(f"Invalid seat number: {seat_number}")
+    # 座位表由影廳配置預先產生，這裡只查詢已訂座位並填入狀態
+    layout = hall_layout(screening.hall)
+    booked = booked_seats(screening_id)
+    # 其他使用者保留中的座位也顯示為不可選
+    held = {
+        seat_number
+        for seat_number, in db.session.query(SeatHold.seat_number).filter(
+            SeatHold.screening_id == screening_id,
+            SeatHold.user_id != current_user.id,
+            SeatHold.expires_at > datetime.now(),
+        )
+    }
+    seat_chart = layout.render(booked | held)
 
     # 根據 screening_id 過濾相關資料並生成選項
     form.cinema.choices = [(screening.cinema.id, screening.cinema.name)]
@@ -160,77 +205,108 @@ def book_seat(screening_id):
     form.movie.choices = [(screening.movie.id, screening.movie.title)]
 
     form.screening_time.choices = [(screening.id, screening.date)]
-    bill_detail = {
-        "name": User.query.filter_by(id=current_user.id).first().username,
-        "cinema": screening.cinema.name,
-        "hall": screening.hall.name,
-        "movie": screening.movie.title,
-        "id": [],
-        "price": [],
-    }
     if request.method == "POST":
-        app.logging.debug(
-            f"Form data: {request.form}"
-        )  ## 還要設定 cinima 和 movie screening_time
+        logger.debug(
+            "Booking form submitted",
+            extra={"screening_id": screening_id, "seats": request.form.get("seat_number")},
+        )
         if form.validate_on_submit():
-            # app.logging.debug(form.seat_number.data.split(','))
-            for seat in form.seat_number.data.split(","):
-                # Check if seat is already booked
-                existing_booking = Booking.query.filter_by(
-                    screening_id=screening_id, seat_number=seat
-                ).first()
-
-                if existing_booking:
-                    flash("This seat is already booked", "danger")
-                    return render_template(
-                        "booking.html", form=form, screening=screening
-                    )
+            seats = [seat.strip() for seat in form.seat_number.data.split(",") if seat.strip()]
+            if not seats or not layout.seat_numbers.issuperset(seats):
+                flash("Invalid seat number", "danger")
+                return render_template(
+                    "booking.html", form=form, screening=screening, seat_chart=seat_chart
+                )
+            # Check if any seat is already booked
+            if booked.intersection(seats) or len(set(seats)) != len(seats):
+                flash("This seat is already booked", "danger")
+                return render_template(
+                    "booking.html", form=form, screening=screening, seat_chart=seat_chart
+                )
 
-                # Create new booking
-                booking = Booking(
-                    user_id=current_user.id,
-                    screening_id=screening_id,
-                    seat_number=seat,
+            # 交給該場次的寫入佇列，與同時送出的訂位一起提交
+            try:
+                result = reserve_seats(current_user.id, screening_id, seats)
+            except (BookingQueueFull, BookingTimeout, BookingBusy):
+                flash("目前訂位人數眾多，請稍後再試", "danger")
+                return render_template(
+                    "booking.html", form=form, screening=screening, seat_chart=seat_chart
+                ), 503
+
+            if not result.ok:
+                # 其他人同時訂走了其中一個座位，或場次已滿
+                flash(
+                    "Invalid seat number" if result.error == "invalid_seat" else "This seat is already booked",
+                    "danger",
                 )
-                db.session.add(booking)
-                db.session.commit()
-                flash("Booking successful!", "success")
-                bill_detail["id"].append(booking.id)
-                bill_detail["price"].append(
-                    ScreeningTime.query.with_entities(ScreeningTime.price)
-                    .filter_by(id=screening_id)
-                    .one()[0]
+                return render_template(
+                    "booking.html", form=form, screening=screening, seat_chart=seat_chart
                 )
 
-            # app.logging.debug(bill_detail)
-            session["bill_detail"] = bill_detail
-            return redirect(url_for("main.payment"))
+            flash("Booking successful!", "success")
+            return redirect(url_for("main.payment", order_id=result.order_id))
         else:
-            app.logging.debug(f"Form errors: {form.errors}")
+            logger.debug("Booking form invalid", extra={"errors": form.errors})
 
     return render_template(
-        "booking.html", form=form, screening=screening, seating_chart=seating_chart
+        "booking.html", form=form, screening=screening, seat_chart=seat_chart
     )
 
 
-@main.route("/book/bill/", methods=["GET", "POST"])
+@main.route("/screening/<int:screening_id>/allocate", methods=["POST"])
+@rate_limit("booking")
+@login_required
+def allocate_seats(screening_id):
+    """
+    自動選位：回傳 party_size 個最佳相鄰空位（離銀幕中心近、在偏好的排）
+    hold 為真時一併保留座位 SEAT_HOLD_SECONDS 秒，期間其他人不能訂
+    """
+    data = request.get_json(silent=True) or request.form
+    try:
+        party_size = int(data.get("party_size", 0))
+    except (TypeError, ValueError):
+        party_size = 0
+    if not 1 <= party_size <= current_app.config["SEAT_ALLOCATION_MAX_PARTY"]:
+        return jsonify({"error": "invalid_party_size"}), 400
+    hold = str(data.get("hold", "")).lower() in ("1", "true", "yes", "on")
+
+    try:
+        result = allocate_seats_service(
+            current_user.id,
+            screening_id,
+            party_size,
+            current_app.config["SEAT_HOLD_SECONDS"] if hold else 0,
+        )
+    except (BookingQueueFull, BookingTimeout, BookingBusy):
+        return jsonify({"error": "busy"}), 503
+    if not result.ok:
+        return jsonify({"error": result.error}), 404 if result.error == "not_found" else 409
+    return jsonify({
+        "seats": result.seats,
+        "hold_expires_at": result.expires_at.isoformat() if result.expires_at else None,
+    })
+
+
+@main.route("/book/bill/<int:order_id>", methods=["GET", "POST"])
 @login_required
-def payment():
-    bill_detail = session.get("bill_detail", [])
-    app.logging.debug(bill_detail)
-    name = bill_detail["name"]
-    ids = bill_detail["id"]
-    price = bill_detail["price"]
-    price_sum = sum(price)
+def payment(order_id):
+    order = get_order(order_id)
+    if order is None:
+        abort(404)
+    if order.user_id != current_user.id:
+        flash("無權查看此訂單", "danger")
+        return redirect(url_for("main.home"))
+    screening = order.screening
+    bookings = sorted(order.bookings, key=lambda booking: booking.id)
     return render_template(
         "bill.html",
-        name=name,
-        book_id=ids,
-        price=price,
-        price_sum=price_sum,
-        cinema=bill_detail["cinema"],
-        hall=bill_detail["hall"],
-        movie=bill_detail["movie"],
+        name=current_user.username,
+        order=order,
+        bookings=bookings,
+        price_sum=order.total,
+        cinema=screening.cinema.name,
+        hall=screening.hall.name,
+        movie=screening.movie.title,
     )
 
 
@@ -279,6 +355,68 @@ def search():
         movies = []
     return render_template("search_results.html", movies=movies, query=query)
 
+@main.route("/showtimes")
+def showtimes():
+    """
+    場次搜尋：日期區間、時段、影城、類型、價格、地區，附上各 facet 的場次數
+    format=json 時回傳 JSON，給篩選介面局部更新
+    """
+    config = current_app.config
+    now = datetime.now()
+    want_json = request.args.get("format") == "json"
+    try:
+        filters = parse_filters(
+            request.args,
+            now.date(),
+            config["SHOWTIME_SEARCH_DAYS"],
+            config["SHOWTIME_SEARCH_MAX_DAYS"],
+        )
+    except ValueError as e:
+        if want_json:
+            return jsonify({"error": str(e)}), 400
+        flash(str(e), "error")
+        return redirect(url_for("main.showtimes"))
+
+    rows, next_cursor = search_showtimes(
+        filters, request.args.get("cursor"), config["SHOWTIME_PAGE_SIZE"], now=now
+    )
+    facets = facet_counts(filters, now=now)
+    if want_json:
+        return jsonify({
+            "showtimes": [
+                {
+                    "id": row.id,
+                    "time": row.date.strftime("%Y-%m-%d %H:%M"),
+                    "price": row.price,
+                    "movie_id": row.movie_id,
+                    "title": row.title,
+                    "genre": row.genre,
+                    "cinema_id": row.cinema_id,
+                    "cinema": row.cinema_name,
+                    "hall": row.hall_name,
+                }
+                for row in rows
+            ],
+            "next_cursor": next_cursor,
+            "facets": {
+                "cinema": [
+                    {"id": cinema_id, "name": name, "count": count}
+                    for cinema_id, name, count in facets["cinema"]
+                ],
+                "genre": [{"name": genre, "count": count} for genre, count in facets["genre"]],
+                "day": [{"date": day, "count": count} for day, count in facets["day"]],
+                "total": facets["total"],
+            },
+        })
+    return render_template(
+        "showtimes.html",
+        filters=filters,
+        showtimes=rows,
+        next_cursor=next_cursor,
+        facets=facets,
+        time_slots=TIME_SLOTS,
+    )
+
 @main.route("/admin", endpoint="admin_dashboard")
 @login_required
 def admin_dashboard():
@@ -301,8 +439,103 @@ def admin_dashboard():
     return render_template("admin.html", cinema_movies=cinema_movies)
 
 
+@main.route("/admin/stats")
+@login_required
+def admin_stats():
+    if current_user.username != "admin":
+        flash("Access denied. Admins only.", "danger")
+        return redirect(url_for("main.home"))
+
+    today = datetime.now().date()
+    try:
+        start = datetime.strptime(request.args["start"], "%Y-%m-%d").date()
+        end = datetime.strptime(request.args["end"], "%Y-%m-%d").date()
+    except (KeyError, ValueError):
+        start, end = today - timedelta(days=7), today + timedelta(days=7)
+    if end < start:
+        start, end = end, start
+
+    # 只讀 screening_stats 彙總表
+    daily = daily_stats(start, end)
+    cinemas = cinema_stats(start, end)
+    movies = movie_stats(start, end)
+    return render_template(
+        "admin_stats.html",
+        start=start,
+        end=end,
+        daily=daily,
+        cinemas=cinemas,
+        movies=movies,
+        max_revenue=max([row["revenue"] for row in daily + cinemas + movies] + [1]),
+        datasets=list(DATASETS),
+    )
+
+
+@main.route("/admin/import", methods=["GET", "POST"])
+@login_required
+def admin_import():
+    if current_user.username != "admin":
+        flash("Access denied. Admins only.", "danger")
+        return redirect(url_for("main.home"))
+
+    report = None
+    if request.method == "POST":
+        kind = request.form.get("kind")
+        file = request.files.get("file")
+        if kind not in IMPORT_KINDS or not file or not file.filename:
+            flash("Please choose what to import and a CSV or JSON file.", "danger")
+            return redirect(url_for("main.admin_import"))
+        fmt = "csv" if file.filename.lower().endswith(".csv") else "json"
+        try:
+            report = import_file(
+                kind, file, fmt, current_app.config.get("IMPORT_BATCH_SIZE", IMPORT_BATCH_SIZE)
+            )
+        except (ValueError, UnicodeDecodeError) as e:
+            # 檔案格式錯誤；已提交的批次保留，錯誤之後的資料未匯入
+            flash(f"Import stopped: {e}", "danger")
+            return redirect(url_for("main.admin_import"))
+        logger.info(
+            "Catalog import finished",
+            extra={"kind": kind, "imported": report.imported, "failed": report.failed},
+        )
+    return render_template("admin_import.html", kinds=IMPORT_KINDS, report=report)
+
+
+@main.route("/admin/export/<dataset>")
+@login_required
+def admin_export(dataset):
+    if current_user.username != "admin":
+        flash("Access denied. Admins only.", "danger")
+        return redirect(url_for("main.home"))
+    if dataset not in DATASETS:
+        flash("Unknown export.", "danger")
+        return redirect(url_for("main.admin_stats"))
+
+    fmt = request.args.get("format", "csv")
+    if fmt not in FORMATS:
+        fmt = "csv"
+    try:
+        start = request.args.get("start") or None
+        end = request.args.get("end") or None
+        start = start and datetime.strptime(start, "%Y-%m-%d").date()
+        end = end and datetime.strptime(end, "%Y-%m-%d").date()
+    except ValueError:
+        flash("Invalid date.", "danger")
+        return redirect(url_for("main.admin_stats"))
+
+    query, columns = build_export_query(dataset, start, end)
+    chunk_size = current_app.config.get("EXPORT_CHUNK_SIZE", EXPORT_CHUNK_SIZE)
+    # 產生器直接寫入回應，不先在記憶體中組出整個檔案
+    return Response(
+        stream_export(db.engine, query, columns, fmt, chunk_size),
+        mimetype=FORMATS[fmt],
+        headers={"Content-Disposition": f"attachment; filename={dataset}.{fmt}"},
+    )
+
+
 
 @main.route('/submit_review/<int:movie_id>', methods=['POST'])
+@rate_limit("review")
 @login_required
 def submit_review(movie_id):
     try:
@@ -312,6 +545,9 @@ def submit_review(movie_id):
         if not (0.5 <= rate <= 5.0):
             flash("Rate must be between 0.5 and 5.0.", "error")
             return redirect(url_for('main.movie_detail', movie_id=movie_id))
+        if not (rate * 2).is_integer():
+            flash("Rate must be in steps of 0.5.", "error")
+            return redirect(url_for('main.movie_detail', movie_id=movie_id))
 
         if not review_content.strip():
             flash("Review content cannot be empty.", "error")
@@ -334,53 +570,156 @@ def submit_review(movie_id):
 
 @main.route("/movies/showing")
 def movies_showing():
-    page = request.args.get("page", 1, type=int)
+    cursor = request.args.get("cursor")
     per_page = 12
-    movies_query = Movie.query.filter(Movie.is_current == True).order_by(
-        Movie.release_date.desc()
+    criteria = [Movie.is_current == True]
+    movies = keyset_paginate(
+        Movie.query.filter(*criteria),
+        [Movie.release_sort, Movie.id],
+        cursor=cursor,
+        per_page=per_page,
+        total=approximate_total("movies_showing", Movie, criteria),
     )
-    movies = movies_query.paginate(page=page, per_page=per_page, error_out=False)
     return render_template("movies_showing.html", movies=movies)
 
 
 @main.route("/movies/top-rated")
 def top_rated_movies():
-    page = request.args.get("page", 1, type=int)
+    cursor = request.args.get("cursor")
     per_page = 12
-    movies_query = Movie.query.order_by(Movie.rating.desc())
-    movies = movies_query.paginate(page=page, per_page=per_page, error_out=False)
+    movies = keyset_paginate(
+        Movie.query,
+        [Movie.rating, Movie.id],
+        cursor=cursor,
+        per_page=per_page,
+        total=approximate_total("movies_all", Movie),
+    )
     return render_template("top_rated_movies.html", movies=movies)
 
 
 @main.route("/movies/most-commented")
 def most_commented_movies():
-    page = request.args.get("page", 1, type=int)
+    cursor = request.args.get("cursor")
     per_page = 12
-    movies_query = Movie.query.order_by(Movie.comments_count.desc())
-    movies = movies_query.paginate(page=page, per_page=per_page, error_out=False)
+    movies = keyset_paginate(
+        Movie.query,
+        [Movie.comments_count, Movie.id],
+        cursor=cursor,
+        per_page=per_page,
+        total=approximate_total("movies_all", Movie),
+    )
     return render_template("most_commented_movies.html", movies=movies)
 
 
+@cached(timeout=300, key_prefix="cinema_list")
+def cinema_list():
+    """影城列表（含影廳），快取為純資料；新增、刪除影城時清除"""
+    return [
+        {
+            "id": cinema.id,
+            "name": cinema.name,
+            "location": cinema.location,
+            "halls": [{"name": hall.name, "size": hall.size} for hall in cinema.halls],
+        }
+        for cinema in Cinema.query.options(db.selectinload(Cinema.halls)).order_by(Cinema.id)
+    ]
+
+
 @main.route("/cinemas")
 def cinemas():
-    cinemas = Cinema.query.all()
-    return render_template("cinemas.html", cinemas=cinemas)
+    return render_template("cinemas.html", cinemas=cinema_list())
+
+
+@main.route("/cinemas/nearby")
+def nearby_cinemas():
+    """
+    離 (lat, lng) 最近的影城，依距離排序
+    可選參數：radius（公里，只在該半徑內找）、limit、movie_id（只列有該電影後續場次的影城，並附上最近幾場）
+    """
+    coordinates = parse_coordinates(request.args.get("lat"), request.args.get("lng"))
+    if coordinates is None:
+        return jsonify({"error": "invalid_coordinates"}), 400
+    config = current_app.config
+    radius = request.args.get("radius", type=float)
+    if radius is not None and not 0 < radius <= config["NEARBY_MAX_RADIUS_KM"]:
+        return jsonify({"error": "invalid_radius"}), 400
+    limit = min(max(request.args.get("limit", 10, type=int), 1), config["NEARBY_MAX_RESULTS"])
+    movie_id = request.args.get("movie_id", type=int)
+
+    now = datetime.now()
+    nearby = nearby_cinemas_service(
+        coordinates[0],
+        coordinates[1],
+        limit,
+        config["NEARBY_MAX_RADIUS_KM"],
+        radius_km=radius,
+        movie_id=movie_id,
+        now=now,
+    )
+    screenings = {}
+    if movie_id is not None:
+        screenings = next_screenings(
+            [item.cinema.id for item in nearby],
+            movie_id,
+            config["NEARBY_SCREENINGS_PER_CINEMA"],
+            now=now,
+        )
+
+    results = []
+    for item in nearby:
+        entry = {
+            "id": item.cinema.id,
+            "name": item.cinema.name,
+            "location": item.cinema.location,
+            "latitude": item.cinema.latitude,
+            "longitude": item.cinema.longitude,
+            "distance_km": round(item.distance_km, 2),
+            "url": url_for("main.cinema_screenings", cinema_id=item.cinema.id),
+        }
+        if movie_id is not None:
+            entry["screenings"] = [
+                {
+                    "id": screening["id"],
+                    "time": screening["date"].strftime("%Y-%m-%d %H:%M"),
+                    "hall": screening["hall_name"],
+                    "price": screening["price"],
+                }
+                for screening in screenings[item.cinema.id]
+            ]
+        results.append(entry)
+    return jsonify({"cinemas": results})
 
 
 @main.route("/cinema/<int:cinema_id>/screenings")
 def cinema_screenings(cinema_id):
     cinema = Cinema.query.get_or_404(cinema_id)
-    screenings = ScreeningTime.query.filter_by(cinema_id=cinema_id).all()
+    today = datetime.now().date()
+    try:
+        start_date = datetime.strptime(request.args.get("start", ""), "%Y-%m-%d").date()
+    except ValueError:
+        start_date = today
+    days = min(max(request.args.get("days", SCHEDULE_WINDOW_DAYS, type=int), 1), 31)
+    schedule = cinema_schedule(cinema_id, start_date, days)
     return render_template(
-        "cinema_screenings.html", cinema=cinema, screenings=screenings
+        "cinema_screenings.html",
+        cinema=cinema,
+        schedule=schedule,
+        start_date=start_date,
+        end_date=start_date + timedelta(days=days - 1),
+        days=days,
+        prev_start=start_date - timedelta(days=days),
+        next_start=start_date + timedelta(days=days),
     )
 
 
 @main.route("/my-list")
 @login_required
 def my_list():
-    favorite_movies = current_user.favorite_movies
-    return render_template("my_list.html", favorite_movies=favorite_movies)
+    favorite_movies = favorites.favorite_movies(current_user.id)
+    recommended = recommend_for_movies([movie.id for movie in favorite_movies])
+    return render_template(
+        "my_list.html", favorite_movies=favorite_movies, recommended=recommended
+    )
 
 @main.route('/update-profile', methods=['POST'])
 @login_required
@@ -397,7 +736,7 @@ def update_profile():
     except Exception as e:
         db.session.rollback()
         flash('更新失敗，請稍後再試。', 'danger')
-        print(f"更新錯誤: {e}")
+        logger.exception("更新使用者資料失敗", extra={"user_id": current_user.id})
 
     return redirect(url_for('main.profile'))
 
@@ -439,12 +778,8 @@ def user_friends():
     # 转换为列表
     friends_list = list(friends_set)
     
-    # 获取好友们收藏的电影
-    friends_favorites = {}
-    for friend in friends_list:
-        # 获取该好友的收藏电影
-        favorite_movies = friend.favorite_movies.all()
-        friends_favorites[friend.id] = favorite_movies
+    # 获取好友们收藏的电影（一次查詢）
+    friends_favorites = favorites.favorites_by_user([friend.id for friend in friends_list])
 
     return render_template('user_friends.html', friends=friends_list, favorites=friends_favorites)
 
@@ -495,6 +830,7 @@ def delete_review(review_id):
     return redirect(url_for('main.my_reviews'))
 
 @main.route('/send-friend-request', methods=['POST'])
+@rate_limit("social")
 @login_required
 def send_friend_request():
     sender_id = current_user.id
@@ -547,6 +883,7 @@ def send_friend_request():
     return jsonify({'message': '好友邀請已發送'}), 200
 
 @main.route('/get-friend-requests', methods=['GET'])
+@rate_limit("polling")
 @login_required
 def get_friend_requests():
     # 使用 current_user 获取当前登录用户的 ID
@@ -571,6 +908,7 @@ def get_friend_requests():
     return jsonify({'requests': data}), 200
 
 @main.route('/respond-friend-request', methods=['POST'])
+@rate_limit("social")
 def respond_friend_request():
     data = request.json
     request_id = data.get('request_id')
@@ -627,6 +965,7 @@ def profile_edit():
     return render_template('profile_edit.html')
 
 @main.route('/edit_review/<int:review_id>', methods=['GET', 'POST'])
+@rate_limit("review", methods=("POST",))
 @login_required
 def edit_review(review_id):
     review = Review.query.get_or_404(review_id)
@@ -639,7 +978,17 @@ def edit_review(review_id):
     if request.method == 'POST':
         # 獲取更新的內容
         new_content = request.form['content']
-        new_rating = request.form['rating']
+        try:
+            new_rating = float(request.form['rating'])
+        except ValueError:
+            flash('Invalid rating value.', 'error')
+            return redirect(url_for('main.edit_review', review_id=review_id))
+        if not (0.5 <= new_rating <= 5.0):
+            flash('Rate must be between 0.5 and 5.0.', 'error')
+            return redirect(url_for('main.edit_review', review_id=review_id))
+        if not (new_rating * 2).is_integer():
+            flash('Rate must be in steps of 0.5.', 'error')
+            return redirect(url_for('main.edit_review', review_id=review_id))
         
         # 更新評論
         review.content = new_content
@@ -652,17 +1001,19 @@ def edit_review(review_id):
     return render_template('edit_review.html', review=review)
 
 @main.route('/get-booked-seats', methods=['GET'])
+@rate_limit("polling")
 @login_required
 def get_booked_seats():
-    current_user_id = current_user.id
-    bookings = Booking.query.filter_by(user_id=current_user_id).all()
+    # 包含已封存（過期場次）的訂位，封存的訂位不能取消
+    bookings = user_booking_history(current_user.id)
 
     data = [
         {
             'id': booking.id,  # 添加 booking id
-            'movie_title': Movie.query.get(booking.screening.movie_id).title,
+            'movie_title': booking.movie_title,
             'seat_number': booking.seat_number,
-            'screening_time': booking.screening.date.strftime('%Y-%m-%d %H:%M')
+            'screening_time': booking.screening_date.strftime('%Y-%m-%d %H:%M'),
+            'archived': bool(booking.archived),
         }
         for booking in bookings
     ]
@@ -671,6 +1022,7 @@ def get_booked_seats():
 
 # 取消訂位的視圖
 @main.route('/cancel-booking/<int:booking_id>', methods=['POST'])
+@rate_limit("booking")
 @login_required
 def cancel_booking(booking_id):
     # Check if this is an AJAX request
@@ -693,11 +1045,22 @@ def cancel_booking(booking_id):
             flash('無權取消此訂位!', 'danger')
             return redirect(url_for('main.profile'))
 
-        # 刪除訂位
+        # 刪除訂位（經由該場次的寫入佇列）
         try:
-            db.session.delete(booking)
-            db.session.commit()
-            
+            try:
+                result = cancel_booking_service(current_user.id, booking)
+            except (BookingQueueFull, BookingTimeout, BookingBusy):
+                if is_ajax:
+                    return jsonify({'success': False, 'error': '系統忙碌中，請稍後再試'}), 503
+                flash('系統忙碌中，請稍後再試', 'danger')
+                return redirect(url_for('main.profile'))
+
+            if not result.ok:
+                if is_ajax:
+                    return jsonify({'success': False, 'error': '找不到此訂位'}), 404
+                flash('找不到此訂位!', 'danger')
+                return redirect(url_for('main.profile'))
+
             if is_ajax:
                 return jsonify({
                     'success': True,
@@ -735,29 +1098,6 @@ def cancel_booking(booking_id):
 
 from datetime import datetime, timedelta
 
-def insert_create_fixed_screening_times(movies, cinemas):
-    """Create fixed screening times for insert movie in choosen cinemas."""
-    screenings = []
-    fixed_times = [
-        datetime.now().replace(hour=10, minute=0),
-        datetime.now().replace(hour=14, minute=0),
-        datetime.now().replace(hour=18, minute=0),
-    ]
-    for i, movie in enumerate(movies):
-        for cinema in cinemas:
-            for hall in cinema.halls:  # Assuming each cinema has `halls` as an attribute
-                for time in fixed_times:
-                    screenings.append(
-                        ScreeningTime(
-                            movie_id=movie.id,
-                            cinema_id=cinema.id,
-                            hall_id=hall.id,
-                            date=time + timedelta(days=i % 7),
-                            price=300 + (i % 5) * 10,  # Adjust pricing logic as needed
-                        )
-                    )
-    return screenings
-
 
 # Add these at the top of your routes.py file
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
@@ -781,16 +1121,25 @@ def insert_movie():
 
     if request.method == 'POST':
 
-        print("Form submitted")  # Debug print
-        print(request.form)      # Debug print
-        print(request.files)     # Debug print
+        # 只記錄欄位名稱，不輸出表單內容與檔案
+        logger.debug(
+            "insert_movie form submitted",
+            extra={"fields": sorted(request.form), "files": sorted(request.files)},
+        )
 
         title = request.form.get('title')
         description = request.form.get('description')
         genre = request.form.get('genre')
         release_date = request.form.get('release_date')
+        duration = request.form.get('duration', type=int) or DEFAULT_DURATION
         selected_cinema = request.form.get('cinema')
 
+        try:
+            release_date = Movie.normalize_release_date(release_date or "")
+        except ValueError:
+            flash('Invalid release date, please use YYYY-MM-DD', 'error')
+            return redirect(request.url)
+
         # Handle file upload
         if 'poster_file' not in request.files:
             flash('No file part', 'error')
@@ -832,12 +1181,13 @@ def insert_movie():
                 genre=genre,
                 release_date=release_date,
                 poster_url=poster_url,
+                duration=duration,
                 rating=0,
                 is_current=False
             )
 
             db.session.add(new_movie)
-            db.session.commit()
+            db.session.flush()
 
             # Handle cinema and screening times
             selected_cinemas = (
@@ -845,34 +1195,30 @@ def insert_movie():
                 else [cinema for cinema in cinemas if cinema.name == selected_cinema]
             )
 
-            screenings = []
-            fixed_times = [
-                datetime.now().replace(hour=10, minute=0, second=0, microsecond=0),
-                datetime.now().replace(hour=14, minute=0, second=0, microsecond=0),
-                datetime.now().replace(hour=18, minute=0, second=0, microsecond=0),
-            ]
-            
-            for cinema in selected_cinemas:
-                for hall in cinema.halls:
-                    for time in fixed_times:
-                        screenings.append(
-                            ScreeningTime(
-                                movie_id=new_movie.id,
-                                cinema_id=cinema.id,
-                                hall_id=hall.id,
-                                date=time,
-                                price=300
-                            )
-                        )
-
-            db.session.add_all(screenings)
+            # 電影與場次在同一個交易中寫入
+            today = datetime.now().date()
+            created = schedule_movies(
+                [new_movie], selected_cinemas, today, today,
+                showtimes=DEFAULT_SHOWTIMES, price=DEFAULT_PRICE, commit=False,
+            )
             db.session.commit()
-            
-            flash('Movie added successfully!', 'success')
+
+            # 與既有場次重疊的時段會被略過，告知實際建立的場次數
+            expected = len(DEFAULT_SHOWTIMES) * sum(len(cinema.halls) for cinema in selected_cinemas)
+            if created == 0:
+                flash('Movie added, but no screenings were created: no free showtimes in the selected cinema(s).', 'warning')
+            elif created < expected:
+                flash(f'Movie added with {created} of {expected} screenings; {expected - created} showtime(s) were skipped because the hall was busy.', 'warning')
+            else:
+                flash(f'Movie added successfully with {created} screenings!', 'success')
             return redirect(url_for('main.admin_dashboard'))
             
+        except ScheduleConflictError as e:
+            db.session.rollback()
+            flash(f'Error adding movie: {len(e.conflicts)} screening(s) overlap existing ones.', 'error')
+            return redirect(request.url)
         except Exception as e:
-            print(f"Error details: {str(e)}")  # Debug print
+            logger.exception("新增電影失敗")
             db.session.rollback()
             flash(f'Error adding movie: {str(e)}', 'error')
             return redirect(request.url)
@@ -930,28 +1276,24 @@ def delete_movie():
             flash("Movie not found.", "error")
             return redirect(url_for('main.delete_movie', cinema=selected_cinema))
 
-        cinema = Cinema.query.filter_by(name=selected_cinema).first()
-        if not cinema:
-            flash("Cinema not found.", "error")
-            return redirect(url_for('main.delete_movie', cinema=selected_cinema))
-
-        # 刪除與 Movie 相關的評論和最愛
-        Review.query.filter_by(movie_id=movie_to_delete.id).delete()  # 刪除所有評論
-        db.session.commit()
-
-        # 刪除所有將該 Movie 設為最愛的紀錄
-        db.session.query(user_favorites).filter_by(movie_id=movie_to_delete.id).delete()
-        db.session.commit()
-
-        # 刪除相關的 ScreeningTime
-        ScreeningTime.query.filter_by(movie_id=movie_to_delete.id, cinema_id=cinema.id).delete()
-        remaining_screenings = ScreeningTime.query.filter_by(movie_id=movie_to_delete.id).count()
+        # 選擇 all 時直接刪除整部電影
+        cinema = None
+        if selected_cinema != 'all':
+            cinema = Cinema.query.filter_by(name=selected_cinema).first()
+            if not cinema:
+                flash("Cinema not found.", "error")
+                return redirect(url_for('main.delete_movie', cinema=selected_cinema))
 
-        if remaining_screenings == 0:
-            db.session.delete(movie_to_delete)
+        # 單一交易刪除：場次、訂位、座位、評論、收藏由 ON DELETE CASCADE 處理
+        title = movie_to_delete.title
+        try:
+            delete_movie_service(movie_to_delete, cinema)
+        except Exception as e:
+            current_app.logger.error(f"刪除電影時發生錯誤: {str(e)}")
+            flash("Error deleting movie.", "error")
+            return redirect(url_for('main.delete_movie', cinema=selected_cinema))
 
-        db.session.commit()
-        flash(f"Movie '{movie_to_delete.title}' has been deleted from '{selected_cinema}'.", "success")
+        flash(f"Movie '{title}' has been deleted from '{selected_cinema}'.", "success")
         return redirect(url_for('main.admin_dashboard'))
 
     return render_template('delete.html', cinemas=cinemas, movies=movies, selected_cinema=selected_cinema)
@@ -970,6 +1312,14 @@ def add_cinema():
             flash("Cinema name, location and at least one hall are required.", "danger")
             return redirect(url_for('main.add_cinema'))
 
+        # 經緯度可不填；填了就要兩個都填且在合理範圍
+        latitude = request.form.get('latitude', '').strip()
+        longitude = request.form.get('longitude', '').strip()
+        coordinates = parse_coordinates(latitude, longitude) if latitude or longitude else (None, None)
+        if coordinates is None:
+            flash("Latitude and longitude must both be valid numbers.", "danger")
+            return redirect(url_for('main.add_cinema'))
+
         # Check if the cinema already exists
         existing_cinema = Cinema.query.filter_by(name=cinema_name).first()
         if existing_cinema:
@@ -978,7 +1328,12 @@ def add_cinema():
 
         try:
             # Create a new cinema
-            new_cinema = Cinema(name=cinema_name, location=location)
+            new_cinema = Cinema(
+                name=cinema_name,
+                location=location,
+                latitude=coordinates[0],
+                longitude=coordinates[1],
+            )
             
             # Add halls to the cinema
             for hall_data in halls_data:
@@ -986,15 +1341,24 @@ def add_cinema():
                     continue
                     
                 try:
-                    hall_name, hall_size = hall_data.split(',')
+                    # hall_name,seat_number 或 hall_name,seat_number,layout（配置格式見 seating.py）
+                    hall_name, hall_size, *hall_layout_text = hall_data.split(',')
+                    hall_size = int(hall_size.strip())
+                    layout = None
+                    if hall_layout_text and hall_layout_text[0].strip():
+                        layout, seat_count = parse_layout(hall_layout_text[0])
+                        if seat_count != hall_size:
+                            flash(f"Hall {hall_name.strip()}: layout has {seat_count} seats, not {hall_size}.", "danger")
+                            return redirect(url_for('main.add_cinema'))
                     new_cinema.halls.append(
                         Hall(
                             name=hall_name.strip(),
-                            size=int(hall_size.strip())
+                            size=hall_size,
+                            layout=layout,
                         )
                     )
                 except ValueError:
-                    flash("Invalid hall format. Please use 'hall_name,seat_number' format.", "danger")
+                    flash("Invalid hall format. Please use 'hall_name,seat_number' or 'hall_name,seat_number,layout' format.", "danger")
                     return redirect(url_for('main.add_cinema'))
                 except Exception as e:
                     flash(f"Error processing hall data: {str(e)}", "danger")
@@ -1003,6 +1367,7 @@ def add_cinema():
             # Add the new cinema to the database
             db.session.add(new_cinema)
             db.session.commit()
+            cinema_list.invalidate()
 
             flash(f"Cinema '{cinema_name}' has been added successfully.", "success")
             return redirect(url_for('main.admin_dashboard'))
@@ -1034,6 +1399,7 @@ def delete_cinema():
         # Delete the cinema
         db.session.delete(cinema_to_delete)
         db.session.commit()
+        cinema_list.invalidate()
 
         flash(f"Cinema '{cinema_to_delete.name}' has been deleted successfully.", "success")
         return redirect(url_for('main.admin_dashboard'))
@@ -1063,26 +1429,55 @@ def add_screeningtime():
         # Validate and process the date
         try:
             screening_date = datetime.strptime(date, "%Y-%m-%d %H:%M:%S")
-        except ValueError:
+        except (TypeError, ValueError):
             flash("Invalid date format. Use 'YYYY-MM-DD HH:MM:SS'.", "danger")
             return redirect(url_for('main.add_screeningtime', cinema=cinema_id))
 
-        # Check if the screening already exists
-        existing_screening = ScreeningTime.query.filter_by(
-            movie_id=movie_id,
-            cinema_id=cinema_id,
-            hall_id=hall_id,
-            date=screening_date
-        ).first()
+        try:
+            price = float(price)
+        except (TypeError, ValueError):
+            flash("Invalid price.", "danger")
+            return redirect(url_for('main.add_screeningtime'))
+
+        movie = Movie.query.get(movie_id)
+        if not movie:
+            flash("Movie not found.", "danger")
+            return redirect(url_for('main.add_screeningtime'))
+
+        hall = Hall.query.get(hall_id) if hall_id and hall_id.isdigit() else None
+        if hall is None:
+            flash("Please select a hall.", "danger")
+            return redirect(url_for('main.add_screeningtime'))
+
+        # 檢查同一影廳是否有時間重疊的場次（不只是完全相同的時間）
+        new_screening = {
+            "movie_id": movie.id,
+            "hall_id": hall.id,
+            "date": screening_date,
+        }
+        existing = load_existing_screenings(
+            [new_screening["hall_id"]],
+            screening_date,
+            screening_date + timedelta(minutes=movie.duration + CLEANING_GAP),
+        )
+        durations = dict(
+            db.session.query(Movie.id, Movie.duration)
+            .filter(Movie.id.in_({s["movie_id"] for s in existing} | {movie.id}))
+            .all()
+        )
+        conflicts = [
+            pair for pair in find_hall_conflicts(existing + [new_screening], durations)
+            if new_screening in pair
+        ]
 
-        if existing_screening:
-            flash("This screening time already exists.", "danger")
+        if conflicts:
+            flash("This screening time overlaps another screening in the same hall.", "danger")
         else:
             # Create and add the new screening
             new_screening = ScreeningTime(
                 movie_id=movie_id,
-                cinema_id=cinema_id,
-                hall_id=hall_id,
+                cinema_id=hall.cinema_id,
+                hall_id=hall.id,
                 date=screening_date,
                 price=price
             )
@@ -1098,3 +1493,50 @@ def add_screeningtime():
         movies=movies,
         selected_cinema=selected_cinema
     )
+
+
+@main.route('/plan_schedule', methods=['GET', 'POST'])
+@login_required
+def plan_schedule():
+    if current_user.username != "admin":
+        flash("Access denied. Admins only.", "danger")
+        return redirect(url_for("main.home"))
+
+    cinemas = Cinema.query.all()
+    movies = Movie.query.order_by(Movie.title).all()
+
+    if request.method == 'POST':
+        movie_ids = request.form.getlist('movies', type=int)
+        cinema_ids = request.form.getlist('cinemas', type=int)
+        try:
+            start_date = datetime.strptime(request.form.get('start_date', ''), "%Y-%m-%d").date()
+            end_date = datetime.strptime(request.form.get('end_date', ''), "%Y-%m-%d").date()
+            price = float(request.form.get('price') or DEFAULT_PRICE)
+        except ValueError:
+            flash("Invalid date or price. Use 'YYYY-MM-DD' for dates.", "danger")
+            return redirect(url_for('main.plan_schedule'))
+
+        selected_movies = [movie for movie in movies if movie.id in movie_ids]
+        selected_cinemas = [cinema for cinema in cinemas if cinema.id in cinema_ids]
+        if not selected_movies or not selected_cinemas or end_date < start_date:
+            flash("Select at least one movie, one cinema and a valid date range.", "danger")
+            return redirect(url_for('main.plan_schedule'))
+
+        # 表單上填的片長會寫回電影，之後的重疊檢查也會用到
+        for movie in selected_movies:
+            duration = request.form.get(f'duration_{movie.id}', type=int)
+            if duration and duration > 0:
+                movie.duration = duration
+
+        try:
+            count = schedule_movies(
+                selected_movies, selected_cinemas, start_date, end_date, price=price
+            )
+        except ScheduleConflictError as e:
+            flash(f"Schedule not saved: {len(e.conflicts)} hall conflict(s).", "danger")
+            return redirect(url_for('main.plan_schedule'))
+
+        flash(f"{count} screening(s) scheduled.", "success")
+        return redirect(url_for('main.admin_dashboard'))
+
+    return render_template('plan_schedule.html', cinemas=cinemas, movies=movies)
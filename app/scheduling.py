@@ -0,0 +1,512 @@
+# scheduling.py
+from bisect import bisect_left, insort
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from sqlalchemy import event, insert
+from sqlalchemy.orm import Session, object_session
+
+from app import db
+from app.cache import cache
+from app.models import Cinema, Hall, Movie, ScreeningTime
+from app.showtimes import invalidate_showtime_facets
+
+DEFAULT_DURATION = 120  # 分鐘
+CLEANING_GAP = 20  # 兩場之間的清場時間（分鐘）
+DEFAULT_OPENING = time(10, 0)
+DEFAULT_CLOSING = time(23, 59)
+DEFAULT_SHOWTIMES = [time(10, 0), time(14, 0), time(18, 0)]
+DEFAULT_PRICE = 300
+
+
+class ScheduleConflictError(Exception):
+    """排程中有影廳重疊時拋出，conflicts 為衝突的場次配對"""
+
+    def __init__(self, conflicts):
+        super().__init__(f"{len(conflicts)} hall conflict(s) in schedule")
+        self.conflicts = conflicts
+
+
+def _occupied_until(start, duration):
+    return start + timedelta(minutes=duration + CLEANING_GAP)
+
+
+def find_hall_conflicts(screenings, durations):
+    """
+    以每個影廳排序後的區間掃描找出重疊的場次
+    screenings: dict 列表，需要 hall_id / movie_id / date
+    durations: {movie_id: 分鐘}
+    回傳 [(先開始的場次, 重疊的場次), ...]
+    """
+    by_hall = defaultdict(list)
+    for screening in screenings:
+        by_hall[screening["hall_id"]].append(screening)
+
+    conflicts = []
+    for hall_screenings in by_hall.values():
+        hall_screenings.sort(key=lambda s: s["date"])
+        latest = None
+        latest_end = None
+        for screening in hall_screenings:
+            duration = durations.get(screening["movie_id"], DEFAULT_DURATION)
+            end = _occupied_until(screening["date"], duration)
+            if latest is not None and screening["date"] < latest_end:
+                conflicts.append((latest, screening))
+            if latest_end is None or end > latest_end:
+                latest, latest_end = screening, end
+    return conflicts
+
+
+def split_conflicting(existing, candidates, durations):
+    """
+    依開始時間逐一接受新場次，與既有場次或已接受的場次重疊者退回
+    回傳 (接受的場次, [(退回的場次, 與之重疊的場次), ...])
+    """
+    occupied = defaultdict(list)  # hall_id -> 依開始時間排序的 (start, end, screening)
+    for screening in existing:
+        end = _occupied_until(screening["date"], durations.get(screening["movie_id"], DEFAULT_DURATION))
+        insort(occupied[screening["hall_id"]], (screening["date"], end, id(screening), screening))
+
+    accepted, rejected = [], []
+    for screening in sorted(candidates, key=lambda s: s["date"]):
+        start = screening["date"]
+        end = _occupied_until(start, durations.get(screening["movie_id"], DEFAULT_DURATION))
+        intervals = occupied[screening["hall_id"]]
+        index = bisect_left(intervals, (start,))
+        # 較早開始但還沒結束的場次，或在本場結束前開始的下一場
+        blocking = next((item[3] for item in intervals[:index] if item[1] > start), None)
+        if blocking is None and index < len(intervals) and intervals[index][0] < end:
+            blocking = intervals[index][3]
+        if blocking is not None:
+            rejected.append((screening, blocking))
+            continue
+        intervals.insert(index, (start, end, id(screening), screening))
+        accepted.append(screening)
+    return accepted, rejected
+
+
+def load_existing_screenings(hall_ids, start, end):
+    """讀取指定影廳在時間範圍內已存在的場次（單一查詢）"""
+    if not hall_ids:
+        return []
+    # 往前多看一部最長電影的長度，才抓得到跨越 start 的場次
+    longest = db.session.query(db.func.max(Movie.duration)).scalar() or DEFAULT_DURATION
+    lookback = timedelta(minutes=longest + CLEANING_GAP)
+    rows = (
+        db.session.query(
+            ScreeningTime.id,
+            ScreeningTime.movie_id,
+            ScreeningTime.cinema_id,
+            ScreeningTime.hall_id,
+            ScreeningTime.date,
+            ScreeningTime.price,
+        )
+        .filter(
+            ScreeningTime.hall_id.in_(hall_ids),
+            ScreeningTime.date >= start - lookback,
+            ScreeningTime.date < end,
+        )
+        .all()
+    )
+    return [row._asdict() for row in rows]
+
+
+def _movie_durations(movies, overrides=None):
+    durations = {movie.id: movie.duration or DEFAULT_DURATION for movie in movies}
+    if overrides:
+        durations.update(overrides)
+    return durations
+
+
+def plan_schedule(movies, cinemas, start_date, end_date, durations=None,
+                  showtimes=None, price=DEFAULT_PRICE, existing=None):
+    """
+    產生 start_date ~ end_date（含）之間每個影廳的排程
+    - showtimes 為 None 時，從開門到打烊依序排滿，電影輪流上映
+    - 有指定 showtimes 時，只在這些時間開場
+    已存在的場次視為佔用區段，新場次會避開它們
+    回傳可直接 bulk insert 的 dict 列表
+    """
+    if not movies:
+        return []
+    durations = _movie_durations(movies, durations)
+    existing = existing or []
+
+    busy = defaultdict(list)
+    for screening in existing:
+        duration = durations.get(screening["movie_id"], DEFAULT_DURATION)
+        busy[screening["hall_id"]].append(
+            (screening["date"], _occupied_until(screening["date"], duration))
+        )
+    for intervals in busy.values():
+        intervals.sort()
+
+    def is_free(hall_id, start, end):
+        for busy_start, busy_end in busy[hall_id]:
+            if busy_start >= end:
+                break
+            if busy_end > start:
+                return False
+        return True
+
+    planned = []
+    day = start_date
+    hall_index = 0
+    while day <= end_date:
+        for cinema in cinemas:
+            for hall in cinema.halls:
+                # 每個影廳從不同的電影開始輪播，避免整間影城同時段都放同一部
+                turn = hall_index
+                hall_index += 1
+                if showtimes:
+                    slots = [datetime.combine(day, t) for t in showtimes]
+                else:
+                    slots = None
+                cursor = datetime.combine(day, DEFAULT_OPENING)
+                closing = datetime.combine(day, DEFAULT_CLOSING)
+                while True:
+                    movie = movies[turn % len(movies)]
+                    duration = durations[movie.id]
+                    if slots is not None:
+                        if not slots:
+                            break
+                        start = slots.pop(0)
+                    else:
+                        start = cursor
+                    end = _occupied_until(start, duration)
+                    if slots is None and start + timedelta(minutes=duration) > closing:
+                        break
+                    if is_free(hall.id, start, end):
+                        planned.append(
+                            {
+                                "movie_id": movie.id,
+                                "cinema_id": cinema.id,
+                                "hall_id": hall.id,
+                                "date": start,
+                                "price": price,
+                            }
+                        )
+                        busy[hall.id].append((start, end))
+                        busy[hall.id].sort()
+                        turn += 1
+                        cursor = end
+                    else:
+                        # 與既有場次重疊：往後挪到該場次結束
+                        cursor = max(
+                            busy_end
+                            for busy_start, busy_end in busy[hall.id]
+                            if busy_start < end and busy_end > start
+                        )
+                    # 對齊到 5 分鐘
+                    cursor += timedelta(minutes=-cursor.minute % 5)
+        day += timedelta(days=1)
+    return planned
+
+
+def bulk_insert_screenings(rows):
+    """在目前的交易中一次 executemany 寫入場次，由呼叫端決定何時 commit"""
+    if rows:
+        db.session.execute(insert(ScreeningTime), rows)
+        # executemany 不會觸發 mapper 事件，手動登記受影響日期的快取，提交後清除
+        invalidate_after_commit(
+            db.session,
+            *{("day", row["cinema_id"], row["date"].date()) for row in rows},
+            *{("movie", row["movie_id"]) for row in rows},
+        )
+        now = datetime.now()
+        _mark_showing(db.session, {row["movie_id"] for row in rows if row["date"] >= now})
+    return len(rows)
+
+
+def schedule_movies(movies, cinemas, start_date, end_date, durations=None,
+                    showtimes=None, price=DEFAULT_PRICE, commit=True):
+    """
+    規劃並寫入排程：讀取既有場次 → 產生排程 → 區間掃描驗證 → 單一交易寫入
+    有衝突時不寫入任何資料並拋出 ScheduleConflictError
+    """
+    hall_ids = [hall.id for cinema in cinemas for hall in cinema.halls]
+    window_start = datetime.combine(start_date, time.min)
+    window_end = datetime.combine(end_date + timedelta(days=1), time.min)
+    existing = load_existing_screenings(hall_ids, window_start, window_end)
+
+    all_durations = _movie_durations(movies, durations)
+    missing = {s["movie_id"] for s in existing} - set(all_durations)
+    if missing:
+        all_durations.update(
+            db.session.query(Movie.id, Movie.duration).filter(Movie.id.in_(missing)).all()
+        )
+    planned = plan_schedule(
+        movies, cinemas, start_date, end_date,
+        durations=all_durations, showtimes=showtimes, price=price, existing=existing,
+    )
+
+    conflicts = [
+        pair for pair in find_hall_conflicts(existing + planned, all_durations)
+        if "id" not in pair[0] or "id" not in pair[1]
+    ]
+    if conflicts:
+        raise ScheduleConflictError(conflicts)
+
+    try:
+        count = bulk_insert_screenings(planned)
+        if commit:
+            db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return count
+
+
+# ---- 影城排程查詢（依日期快取） ----
+
+SCHEDULE_WINDOW_DAYS = 7
+
+SCHEDULE_CACHE_TIMEOUT = 24 * 60 * 60  # 場次異動時會主動清除，這只是讓舊資料最終被回收
+
+
+def _cinema_day_key(cinema_id, day):
+    # 版本號：全部影城 / 單一影城，bump 後舊 key 全部失效
+    return (
+        f"cinema_day:{cache.version('cinema_days')}:"
+        f"{cache.version(f'cinema_days:{cinema_id}')}:{cinema_id}:{day.isoformat()}"
+    )
+
+
+def invalidate_cinema_day(cinema_id, day=None):
+    """場次異動時清除快取；day 為 None 時清除整間影城"""
+    invalidate_showtime_facets()
+    if day is None:
+        cache.bump_version(f"cinema_days:{cinema_id}")
+    else:
+        cache.delete(_cinema_day_key(cinema_id, day))
+
+
+def invalidate_all_cinema_days():
+    cache.bump_version("cinema_days")
+    invalidate_showtime_facets()
+
+
+_PENDING_KEY = "schedule_invalidations"
+
+
+def invalidate_after_commit(session, *entries):
+    """
+    登記交易提交後才清除的快取；在 flush 時就清除的話，同時讀取的請求可能以提交前的資料寫回快取
+    entries：("day", cinema_id, day) / ("movie", movie_id) / ("all",) / ("facets",)
+    """
+    session.info.setdefault(_PENDING_KEY, set()).update(entries)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed(session):
+    for entry in session.info.pop(_PENDING_KEY, ()):
+        kind = entry[0]
+        if kind == "day":
+            invalidate_cinema_day(entry[1], entry[2])
+        elif kind == "movie":
+            cache.delete(_movie_screenings_key(entry[1]))
+        elif kind == "all":
+            invalidate_all_cinema_days()
+        else:
+            invalidate_showtime_facets()
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_rolled_back(session, previous_transaction):
+    # savepoint 的 rollback 不影響外層交易已登記的項目
+    if not previous_transaction.nested:
+        session.info.pop(_PENDING_KEY, None)
+
+
+def _group_cinema_days(keys, cinema_id=None):
+    """
+    以一次 JOIN 查詢讀取多天的場次（含電影與影廳），依 (影城, 日期)、電影分組
+    keys 為要讀取的 (cinema_id, day)；cinema_id 為 None 時查詢全部影城
+    """
+    days = [day for _, day in keys]
+    first, last = min(days), max(days)
+    query = (
+        db.session.query(
+            ScreeningTime.id,
+            ScreeningTime.cinema_id,
+            ScreeningTime.date,
+            ScreeningTime.price,
+            ScreeningTime.movie_id,
+            Movie.title,
+            Movie.poster_url,
+            Hall.name.label("hall_name"),
+        )
+        .join(Movie, ScreeningTime.movie_id == Movie.id)
+        .join(Hall, ScreeningTime.hall_id == Hall.id)
+        .filter(
+            ScreeningTime.date >= datetime.combine(first, time.min),
+            ScreeningTime.date < datetime.combine(last + timedelta(days=1), time.min),
+        )
+    )
+    if cinema_id is not None:
+        query = query.filter(ScreeningTime.cinema_id == cinema_id)
+    rows = query.order_by(ScreeningTime.date, ScreeningTime.id).all()
+
+    grouped = {key: {} for key in keys}
+    for row in rows:
+        key = (row.cinema_id, row.date.date())
+        if key not in grouped:
+            continue
+        movie = grouped[key].setdefault(
+            row.movie_id,
+            {
+                "movie_id": row.movie_id,
+                "title": row.title,
+                "poster_url": row.poster_url,
+                "screenings": [],
+            },
+        )
+        movie["screenings"].append(
+            {
+                "id": row.id,
+                "date": row.date,
+                "hall_name": row.hall_name,
+                "price": row.price,
+            }
+        )
+    return {key: list(movies.values()) for key, movies in grouped.items()}
+
+
+def _load_cinema_days(cinema_id, days):
+    grouped = _group_cinema_days([(cinema_id, day) for day in days], cinema_id)
+    return {day: movies for (_, day), movies in grouped.items()}
+
+
+def load_all_cinema_days(cinema_ids, start_date, days):
+    """全部影城 start_date 起 days 天的排程，一次查詢：{(cinema_id, day): movies}（暖機用）"""
+    window = [start_date + timedelta(days=i) for i in range(days)]
+    keys = [(cinema_id, day) for cinema_id in cinema_ids for day in window]
+    return _group_cinema_days(keys) if keys else {}
+
+
+def prime_cinema_days(schedules):
+    for (cinema_id, day), movies in schedules.items():
+        cache.set(_cinema_day_key(cinema_id, day), movies, timeout=SCHEDULE_CACHE_TIMEOUT)
+
+
+def cinema_schedule(cinema_id, start_date, days=SCHEDULE_WINDOW_DAYS, now=None):
+    """
+    回傳 [(date, movies), ...]，只查詢快取中沒有的日期
+    今天已經開演的場次在輸出時濾掉，快取內容本身不隨時間改變
+    """
+    window = [start_date + timedelta(days=i) for i in range(days)]
+    cached_days = {}
+    for day in window:
+        movies = cache.get(_cinema_day_key(cinema_id, day))
+        if movies is not None:
+            cached_days[day] = movies
+    missing = [day for day in window if day not in cached_days]
+    if missing:
+        for day, movies in _load_cinema_days(cinema_id, missing).items():
+            cache.set(_cinema_day_key(cinema_id, day), movies, timeout=SCHEDULE_CACHE_TIMEOUT)
+            cached_days[day] = movies
+
+    now = now or datetime.now()
+    schedule = []
+    for day in window:
+        movies = cached_days.get(day, [])
+        if day == now.date():
+            movies = [
+                dict(movie, screenings=[s for s in movie["screenings"] if s["date"] >= now])
+                for movie in movies
+            ]
+            movies = [movie for movie in movies if movie["screenings"]]
+        if movies:
+            schedule.append((day, movies))
+    return schedule
+
+
+MOVIE_SCREENINGS_TIMEOUT = 60
+
+
+def _movie_screenings_key(movie_id):
+    return f"movie_screenings:{cache.version('cinema_days')}:{movie_id}"
+
+
+def upcoming_movie_screenings(movie_id, now=None):
+    """電影詳細頁的場次列表（含影城、影廳名稱），快取後於輸出時濾掉已開演的場次"""
+
+    def load():
+        today = datetime.combine(datetime.now().date(), time.min)
+        rows = (
+            db.session.query(
+                ScreeningTime.id,
+                ScreeningTime.date,
+                ScreeningTime.price,
+                Cinema.name.label("cinema_name"),
+                Hall.name.label("hall_name"),
+            )
+            .join(Cinema, ScreeningTime.cinema_id == Cinema.id)
+            .join(Hall, ScreeningTime.hall_id == Hall.id)
+            .filter(ScreeningTime.movie_id == movie_id, ScreeningTime.date >= today)
+            .order_by(ScreeningTime.date)
+            .all()
+        )
+        return [row._asdict() for row in rows]
+
+    now = now or datetime.now()
+    screenings = cache.get_or_compute(
+        _movie_screenings_key(movie_id), load, MOVIE_SCREENINGS_TIMEOUT
+    )
+    return [screening for screening in screenings if screening["date"] >= now]
+
+
+def _mark_showing(connection, movie_ids):
+    """
+    新增或改到未來的場次時立即把電影標為上映中
+    場次過期後改回未上映由一致性檢查（consistency.py）定期處理
+    """
+    if movie_ids:
+        connection.execute(
+            db.update(Movie)
+            .where(Movie.id.in_(movie_ids), Movie.is_current.is_(False))
+            .values(is_current=True)
+        )
+
+
+def _screening_showing(mapper, connection, target):
+    if target.date is not None and target.date >= datetime.now():
+        _mark_showing(connection, [target.movie_id])
+
+
+def _screening_changed(mapper, connection, target):
+    session = object_session(target)
+    if session is None:
+        return
+    keys = {(target.cinema_id, target.date.date() if target.date else None)}
+    state = db.inspect(target)
+    for attr in ("cinema_id", "date"):
+        history = state.attrs[attr].history
+        if history.deleted:
+            old_cinema = history.deleted[0] if attr == "cinema_id" else target.cinema_id
+            old_date = history.deleted[0] if attr == "date" else target.date
+            keys.add((old_cinema, old_date.date() if old_date else None))
+    invalidate_after_commit(
+        session,
+        *{("day", cinema_id, day) for cinema_id, day in keys if day is not None},
+        ("movie", target.movie_id),
+    )
+
+
+def _movie_changed(mapper, connection, target):
+    session = object_session(target)
+    if session is None:
+        return
+    state = db.inspect(target)
+    if state.attrs.title.history.has_changes() or state.attrs.poster_url.history.has_changes():
+        invalidate_after_commit(session, ("all",))
+    elif state.attrs.genre.history.has_changes():
+        invalidate_after_commit(session, ("facets",))
+
+
+event.listen(ScreeningTime, "after_insert", _screening_changed)
+event.listen(ScreeningTime, "after_update", _screening_changed)
+event.listen(ScreeningTime, "after_delete", _screening_changed)
+event.listen(ScreeningTime, "after_insert", _screening_showing)
+event.listen(ScreeningTime, "after_update", _screening_showing)
+event.listen(Movie, "after_update", _movie_changed)
@@ -0,0 +1,210 @@
+# seating.py
+import re
+from functools import lru_cache
+from itertools import chain
+
+from markupsafe import Markup
+
+DEFAULT_SEATS_PER_ROW = 10
+
+# 影廳座位配置編碼：每排以 "/" 分隔，每格一個字元，前面可加數字表示連續重複
+#   s 一般座位  v VIP  w 無障礙座位  . 走道（空格）
+# 例："2s.6s.2s/2s.6s.2s/10v" 為三排，前兩排中間有走道
+# 座位號碼依排、由左到右從 1 開始連續編號（與既有訂位的 seat_number 相同）
+SEAT_KINDS = {"s": "standard", "v": "vip", "w": "wheelchair"}
+_KIND_CODES = {kind: code for code, kind in SEAT_KINDS.items()}
+AISLE = "."
+_CELL = re.compile(r"(\d*)([svw.])")
+
+# 自動選位：偏好的排（從銀幕算起的比例）與排距相對於水平偏移的權重
+PREFERRED_ROW = 0.6
+ROW_WEIGHT = 1.0
+
+
+class HallLayout:
+    """
+    解析後的影廳配置；同一個編碼只解析一次，所有使用該配置的場次共用
+    座位表的 HTML 預先切成片段，每次請求只需填入各座位的狀態
+    """
+
+    def __init__(self, encoded):
+        self.encoded = encoded
+        self.rows = []  # [(排名, [(座位號碼或 None, 種類), ...]), ...]
+        number = 0
+        for index, row in enumerate(encoded.split("/")):
+            cells = []
+            position = 0
+            for match in _CELL.finditer(row):
+                if match.start() != position:
+                    break
+                position = match.end()
+                count = int(match.group(1) or 1)
+                kind = match.group(2)
+                for _ in range(count):
+                    if kind == AISLE:
+                        cells.append((None, None))
+                    else:
+                        number += 1
+                        cells.append((str(number), SEAT_KINDS[kind]))
+            if position != len(row) or not row:
+                raise ValueError(f"Invalid layout row {index + 1}: {row!r}")
+            self.rows.append((row_label(index), cells))
+        if not number:
+            raise ValueError("Layout has no seats")
+        self.seat_count = number
+        self.seat_numbers = frozenset(str(n) for n in range(1, number + 1))
+        self._fragments = self._compile()
+        # 自動選位用：每排以位元遮罩表示座位位置（第 i 格為座位則第 i 位元為 1），走道為 0
+        self.positions = {}  # {座位號碼: (排, 格)}
+        self.row_masks = []
+        self.row_seats = []  # 每排 {格: 座位號碼}
+        for row_index, (_, cells) in enumerate(self.rows):
+            mask = 0
+            seats = {}
+            for column, (seat_number, _) in enumerate(cells):
+                if seat_number is not None:
+                    mask |= 1 << column
+                    seats[column] = seat_number
+                    self.positions[seat_number] = (row_index, column)
+            self.row_masks.append(mask)
+            self.row_seats.append(seats)
+
+    def _compile(self):
+        """產生座位表 HTML 片段：fragments[i] 與 fragments[i + 1] 之間填入第 i + 1 個座位的狀態"""
+        fragments = []
+        current = []
+        for label, cells in self.rows:
+            current.append(f'<div class="row"><span class="row-label">Row {label}</span>')
+            for seat_number, kind in cells:
+                if seat_number is None:
+                    current.append('<span class="seat-gap"></span>')
+                    continue
+                current.append(f'<button type="button" class="seat seat-{kind} ')
+                fragments.append("".join(current))
+                current = [
+                    f'" title="Seat {seat_number}" data-seat="{seat_number}" '
+                    f'onclick="toggleSeat(this)">{int(seat_number):03d}</button>'
+                ]
+            current.append("</div>")
+        fragments.append("".join(current))
+        return fragments
+
+    def render(self, booked):
+        """依已訂座位（seat_number 字串的集合）輸出座位表"""
+        statuses = (
+            "booked" if str(n) in booked else "available" for n in range(1, self.seat_count + 1)
+        )
+        return Markup(
+            "".join(chain.from_iterable(zip(self._fragments, statuses))) + self._fragments[-1]
+        )
+
+    def free_masks(self, occupied):
+        """occupied 為已訂或保留的座位號碼，回傳每排空位的位元遮罩"""
+        masks = list(self.row_masks)
+        for seat_number in occupied:
+            position = self.positions.get(seat_number)
+            if position is not None:
+                row_index, column = position
+                masks[row_index] &= ~(1 << column)
+        return masks
+
+    def best_block(self, occupied, party_size, preferred_row=PREFERRED_ROW, row_weight=ROW_WEIGHT):
+        """
+        找出 party_size 個相鄰（中間沒有走道）的空位，回傳座位號碼列表，找不到時回傳 None
+        分數 = 區塊中心與該排中心的距離（以半排寬正規化）+ row_weight * 與偏好排的距離（以排數正規化）
+        每排先以位元運算算出所有可行的起點，再直接取最接近中心的起點，不逐一列舉
+        """
+        if party_size < 1:
+            return None
+        row_count = len(self.rows)
+        target_row = preferred_row * (row_count - 1)
+        best = None
+        for row_index, free in enumerate(self.free_masks(occupied)):
+            # starts 的第 i 位元為 1 表示第 i ~ i + party_size - 1 格都是空位
+            starts = free
+            for shift in range(1, party_size):
+                starts &= free >> shift
+                if not starts:
+                    break
+            if not starts:
+                continue
+            width = len(self.rows[row_index][1])
+            ideal = (width - party_size) / 2  # 區塊置中時的起點
+            pivot = int(ideal)
+            candidates = []
+            above = starts >> pivot
+            if above:
+                candidates.append(pivot + ((above & -above).bit_length() - 1))
+            below = starts & ((1 << pivot) - 1)
+            if below:
+                candidates.append(below.bit_length() - 1)
+            start = min(candidates, key=lambda column: abs(column - ideal))
+            score = abs(start - ideal) / max(width / 2, 1) + row_weight * abs(
+                row_index - target_row
+            ) / max(row_count, 1)
+            if best is None or score < best[0]:
+                best = (score, row_index, start)
+        if best is None:
+            return None
+        _, row_index, start = best
+        seats = self.row_seats[row_index]
+        return [seats[column] for column in range(start, start + party_size)]
+
+
+def row_label(index):
+    """0 -> A, 25 -> Z, 26 -> AA"""
+    label = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        label = chr(ord("A") + remainder) + label
+    return label
+
+
+def encode_rows(rows):
+    """把每排的格子字串（例如 "ss..ssss"）壓縮成配置編碼"""
+    encoded = []
+    for row in rows:
+        parts = []
+        for match in re.finditer(r"(.)\1*", row):
+            count = len(match.group(0))
+            parts.append(f"{count if count > 1 else ''}{match.group(1)}")
+        encoded.append("".join(parts))
+    return "/".join(encoded)
+
+
+def default_layout(size, seats_per_row=DEFAULT_SEATS_PER_ROW):
+    """沒有設定配置的影廳：每排 seats_per_row 個座位，最後一排放剩下的座位"""
+    full_rows, remainder = divmod(size, seats_per_row)
+    rows = ["s" * seats_per_row] * full_rows
+    if remainder:
+        rows.append("s" * remainder)
+    return encode_rows(rows)
+
+
+@lru_cache(maxsize=256)
+def compile_layout(encoded):
+    return HallLayout(encoded)
+
+
+def hall_layout(hall):
+    return compile_layout(hall.layout or default_layout(hall.size))
+
+
+def parse_layout(text):
+    """
+    管理者輸入的配置：可以是編碼，也可以每行一排的格子字串，回傳 (正規化後的編碼, 座位數)
+    格式錯誤時拋出 ValueError
+    """
+    rows = [row.strip() for row in re.split(r"[/\n]", text.strip()) if row.strip()]
+    if not rows:
+        raise ValueError("Layout is empty")
+    layout = compile_layout("/".join(rows))
+    # 重新壓縮，讓相同配置的編碼一致，共用同一份預先產生的座位表
+    expanded = [
+        "".join(AISLE if seat_number is None else _KIND_CODES[kind] for seat_number, kind in cells)
+        for _, cells in layout.rows
+    ]
+    encoded = encode_rows(expanded)
+    return encoded, layout.seat_count
+
@@ -3,6 +3,9 @@ from app import db
 from app.models import User, Movie, Cinema, Hall, ScreeningTime, Review
 import random
 from werkzeug.security import generate_password_hash
+import logging
+
+logger = logging.getLogger(__name__)
 
 # 資料庫初始化
 def seed_movies():
@@ -53,7 +56,7 @@ def seed_movies():
             title="毒王女人夢",
             description="留意佐伊·索尔达娜和卡拉·索菲亚·加斯孔在鏡頭前的合作以及各自的表現，因為導演雅克·奧迪亞爾（Jacques Audiard）在這部電影中巧妙地跨越了多個類型——從歌舞劇、肥皂劇到高強度動作片，並將這一切融為一體，成為一部讓人熱議的作品，預計在11月登陸Netflix。這是索尔达娜的一次體操般的、職業生涯巔峰的表現，而加斯孔則以一位變性女演員的身份，為卡特爾老大這一角色帶來了顛覆性的詮釋，這位老大在上演消失後，再次以真實的自我重新出現。索尔达娜飾演一位墨西哥城的律師，幫助她的新客戶；隨著時間的推移，他們的關係發展為一場致力於國家社會改革的夥伴關係。加斯孔有可能在最佳女演員獎項上創造歷史，我們也不會對當信封打開時聽到她的名字感到驚訝。",
             genre="歌舞/驚悚",
-            release_date="2024-5-18",
+            release_date="2024-05-18",
             poster_url="/static/images/Emilia_Pérez_film_poster.png",
         ),
         Movie(
@@ -74,7 +77,7 @@ def seed_movies():
             title="荒野機器人",
             description="彼得·布朗的暢銷兒童書籍系列進軍大銀幕，由導演克里斯·桑德斯執導，他曾是迪士尼《莉羅與史迪奇》的編劇兼導演。盧皮塔·尼永’o飾演羅茲，一個在孤島上遇難的機器人，她必須適應這個野性且陌生的環境。電影還有一個全明星配音陣容，包括佩德羅·帕斯卡、凱瑟琳·奧哈拉、馬克·哈米爾等人，他們為島上的生物配音，這些生物最終成為羅茲的收養家庭。",
             genre="動畫/冒險",
-            release_date="2024-9-8",
+            release_date="2024-09-08",
             poster_url="/static/images/The_Wild_Robot_poster.jpg",
         ),
     ]
@@ -83,9 +86,9 @@ def seed_movies():
 
 def seed_cinemas():
     cinemas = [
-        Cinema(name="大都會影城", location="台北市信義區"),
-        Cinema(name="新光影城", location="台北市西門町"),
-        Cinema(name="威秀影城", location="台北市信義區"),
+        Cinema(name="大都會影城", location="台北市信義區", latitude=25.0330, longitude=121.5654),
+        Cinema(name="新光影城", location="台北市西門町", latitude=25.0424, longitude=121.5079),
+        Cinema(name="威秀影城", location="台北市信義區", latitude=25.0360, longitude=121.5670),
     ]
 
     # 為每個影院加上影廳
@@ -210,4 +213,4 @@ def init_db():
     db.session.add_all(reviews)
     db.session.commit()
 
-    print("資料庫初始化完成！")
+    logger.info("資料庫初始化完成！")
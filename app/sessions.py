@@ -0,0 +1,240 @@
+# sessions.py
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from flask import session as current_session
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from flask_login import user_logged_in, user_logged_out, user_loaded_from_cookie
+from werkzeug.datastructures import CallbackDict
+
+from app import db
+
+SESSION_SWEEP_WORKER = "session-sweep"
+
+# 與 Flask 預設 cookie session 相同的序列化格式（支援 tuple、bytes、datetime 等）
+serializer = TaggedJSONSerializer()
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """內容存放在伺服器端的 session，cookie 只帶 sid"""
+
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.previous_sid = None
+
+    def regenerate(self):
+        """換發新的 sid（登入、登出時），舊的 sid 在 save_session 時從 store 刪除"""
+        if not self.new and self.previous_sid is None:
+            self.previous_sid = self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.modified = True
+
+
+class MemorySessionStore:
+    """單一 process 使用的 LRU，超過 max_entries 時淘汰最久沒用到的 session"""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, sid):
+        with self._lock:
+            item = self._data.get(sid)
+            if item is None:
+                return None
+            payload, expires_at = item
+            if expires_at <= time.time():
+                del self._data[sid]
+                return None
+            self._data.move_to_end(sid)
+            return payload
+
+    def set(self, sid, payload, expires_at):
+        with self._lock:
+            self._data[sid] = (payload, expires_at.timestamp())
+            self._data.move_to_end(sid)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, sid):
+        with self._lock:
+            self._data.pop(sid, None)
+
+    def sweep(self, batch_size=500):
+        """移除過期的 session，每次最多處理 batch_size 筆，回傳刪除數"""
+        now = time.time()
+        removed = 0
+        while True:
+            with self._lock:
+                expired = [
+                    sid for sid, (_, expires_at) in self._data.items() if expires_at <= now
+                ][:batch_size]
+                for sid in expired:
+                    del self._data[sid]
+            removed += len(expired)
+            if len(expired) < batch_size:
+                return removed
+
+
+class SqliteSessionStore:
+    """
+    存放在 stored_session 資料表，多個 worker process 共用
+    直接使用 engine 連線，不和 request 中的 db.session 交易混在一起
+    """
+
+    def __init__(self, engine_getter):
+        self._engine = engine_getter
+
+    @property
+    def table(self):
+        from app.models import StoredSession
+
+        return StoredSession.__table__
+
+    def get(self, sid):
+        table = self.table
+        with self._engine().connect() as conn:
+            row = conn.execute(
+                db.select(table.c.data).where(
+                    table.c.sid == sid, table.c.expires_at > datetime.now()
+                )
+            ).first()
+        return row.data if row else None
+
+    def set(self, sid, payload, expires_at):
+        table = self.table
+        with self._engine().begin() as conn:
+            conn.execute(
+                db.insert(table)
+                .values(sid=sid, data=payload, expires_at=expires_at)
+                .prefix_with("OR REPLACE")
+            )
+
+    def delete(self, sid):
+        table = self.table
+        with self._engine().begin() as conn:
+            conn.execute(db.delete(table).where(table.c.sid == sid))
+
+    def sweep(self, batch_size=500):
+        """分批刪除過期 session，每批一個短交易，避免長時間佔用寫入鎖"""
+        table = self.table
+        removed = 0
+        while True:
+            with self._engine().begin() as conn:
+                expired = (
+                    db.select(table.c.sid)
+                    .where(table.c.expires_at <= datetime.now())
+                    .limit(batch_size)
+                    .scalar_subquery()
+                )
+                count = conn.execute(
+                    db.delete(table).where(table.c.sid.in_(expired))
+                ).rowcount
+            removed += count
+            if count < batch_size:
+                return removed
+
+
+class ServerSessionInterface(SessionInterface):
+    """cookie 中只存 sid，session 內容由 store 保存；內容沒變動時不重寫"""
+
+    def __init__(self, store):
+        self.store = store
+
+    def _lifetime(self, app):
+        return app.permanent_session_lifetime
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            payload = self.store.get(sid)
+            if payload is not None:
+                try:
+                    return ServerSession(serializer.loads(payload), sid=sid)
+                except ValueError:
+                    pass
+        return ServerSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        # 權限改變時換發了 sid：舊 sid 即使被他人預先植入或竊取也不再有效
+        if session.previous_sid is not None:
+            self.store.delete(session.previous_sid)
+            session.previous_sid = None
+
+        if not session:
+            if session.modified and not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        if session.accessed:
+            response.vary.add("Cookie")
+
+        # 沒修改且不需要延長有效期限時，不寫 store 也不重發 cookie
+        if not session.modified and not session.new and not self.should_set_cookie(app, session):
+            return
+
+        lifetime = self._lifetime(app)
+        self.store.set(session.sid, serializer.dumps(dict(session)), datetime.now() + lifetime)
+        response.set_cookie(
+            name,
+            session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+
+
+def _regenerate_sid(sender, **extra):
+    # 防止 session fixation；cookie session 沒有 sid，不需要處理
+    regenerate = getattr(current_session, "regenerate", None)
+    if regenerate is not None:
+        regenerate()
+
+
+user_logged_in.connect(_regenerate_sid)
+user_logged_out.connect(_regenerate_sid)
+user_loaded_from_cookie.connect(_regenerate_sid)
+
+
+def init_sessions(app):
+    """依 SESSION_BACKEND 設定 session 儲存方式：cookie / memory / sqlite"""
+    backend = app.config.get("SESSION_BACKEND", "memory")
+    if backend == "cookie":
+        return None
+    if backend == "memory":
+        store = MemorySessionStore(app.config.get("SESSION_MEMORY_MAX_ENTRIES", 10000))
+    elif backend == "sqlite":
+        store = SqliteSessionStore(lambda: db.engine)
+    else:
+        raise ValueError(f"Unknown SESSION_BACKEND: {backend}")
+    app.session_interface = ServerSessionInterface(store)
+
+    from .workers import register_worker
+
+    batch_size = app.config.get("SESSION_SWEEP_BATCH", 500)
+    register_worker(
+        app,
+        SESSION_SWEEP_WORKER,
+        app.config.get("SESSION_SWEEP_INTERVAL", 300),
+        lambda: store.sweep(batch_size),
+    )
+    return store
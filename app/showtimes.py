@@ -0,0 +1,269 @@
+# showtimes.py
+from collections import Counter, namedtuple
+from datetime import datetime, time, timedelta
+
+from sqlalchemy import tuple_
+
+from app import db
+from app.cache import cache
+from app.models import Cinema, Hall, Movie, ScreeningTime
+from app.pagination import decode_cursor, encode_cursor
+
+# 時段：(開始, 結束) 為距離當天 0 點的小時數；深夜場跨到隔天清晨
+TIME_SLOTS = {
+    "morning": (6, 12),
+    "afternoon": (12, 17),
+    "evening": (17, 22),
+    "night": (22, 30),
+}
+GENRE_SEPARATOR = "/"
+
+FACET_CACHE_TIMEOUT = 300
+FACET_NOW_BUCKET = 5  # 分鐘；facet 的「現在」取整，讓短時間內相同條件共用快取
+
+ShowtimeFilters = namedtuple(
+    "ShowtimeFilters",
+    ["date_from", "date_to", "time_slots", "cinema_ids", "genres", "price_min", "price_max", "area"],
+)
+
+
+def _parse_date(value, default):
+    if not value:
+        return default
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except ValueError:
+        raise ValueError(f"Invalid date: {value}")
+
+
+def _parse_price(value):
+    if value in (None, ""):
+        return None
+    try:
+        price = float(value)
+    except ValueError:
+        raise ValueError(f"Invalid price: {value}")
+    if price < 0:
+        raise ValueError(f"Invalid price: {value}")
+    return price
+
+
+def parse_filters(args, today, default_days, max_days):
+    """
+    從查詢參數建立 ShowtimeFilters，格式錯誤時拋出 ValueError
+    cinema、genre、time 可重複出現（多選）
+    """
+    date_from = _parse_date(args.get("date_from"), today)
+    date_to = _parse_date(args.get("date_to"), date_from + timedelta(days=default_days - 1))
+    if date_to < date_from:
+        raise ValueError("date_to is before date_from")
+    if (date_to - date_from).days >= max_days:
+        raise ValueError(f"Date range is longer than {max_days} days")
+    time_slots = sorted(set(args.getlist("time")))
+    unknown = [slot for slot in time_slots if slot not in TIME_SLOTS]
+    if unknown:
+        raise ValueError(f"Unknown time of day: {', '.join(unknown)}")
+    try:
+        cinema_ids = sorted({int(value) for value in args.getlist("cinema") if value})
+    except ValueError:
+        raise ValueError("Invalid cinema id")
+    price_min = _parse_price(args.get("price_min"))
+    price_max = _parse_price(args.get("price_max"))
+    if price_min is not None and price_max is not None and price_max < price_min:
+        raise ValueError("price_max is below price_min")
+    return ShowtimeFilters(
+        date_from=date_from,
+        date_to=date_to,
+        time_slots=tuple(time_slots),
+        cinema_ids=tuple(cinema_ids),
+        genres=tuple(sorted({genre.strip() for genre in args.getlist("genre") if genre.strip()})),
+        price_min=price_min,
+        price_max=price_max,
+        area=(args.get("area") or "").strip(),
+    )
+
+
+def split_genres(genre):
+    """"動作/科幻" -> ["動作", "科幻"]"""
+    return [part.strip() for part in (genre or "").split(GENRE_SEPARATOR) if part.strip()]
+
+
+def _time_ranges(filters, now):
+    """
+    日期與時段條件轉成若干段 [start, end) 的時間區間，讓 date 欄位可以走索引
+    相鄰的區間合併，已開演的部分從 now 截斷
+    """
+    if filters.time_slots:
+        slots = sorted(TIME_SLOTS[slot] for slot in filters.time_slots)
+    else:
+        slots = [(0, 24)]
+    ranges = []
+    day = filters.date_from
+    while day <= filters.date_to:
+        midnight = datetime.combine(day, time.min)
+        for start_hour, end_hour in slots:
+            start = midnight + timedelta(hours=start_hour)
+            end = midnight + timedelta(hours=end_hour)
+            if ranges and start <= ranges[-1][1]:
+                ranges[-1] = (ranges[-1][0], max(ranges[-1][1], end))
+            else:
+                ranges.append((start, end))
+        day += timedelta(days=1)
+    return [(max(start, now), end) for start, end in ranges if end > now]
+
+
+def _genre_clause(genres):
+    # 以分隔符號包住整個 genre 字串，比對完整的類型名稱（"動作" 不會比對到 "動作片"）
+    wrapped = GENRE_SEPARATOR + db.func.coalesce(Movie.genre, "") + GENRE_SEPARATOR
+    return db.or_(*[wrapped.like(f"%{GENRE_SEPARATOR}{genre}{GENRE_SEPARATOR}%") for genre in genres])
+
+
+def _base_conditions(filters, now):
+    """不屬於 facet 的條件（日期時段、價格、地區）；回傳 None 代表沒有任何場次符合"""
+    ranges = _time_ranges(filters, now)
+    if not ranges:
+        return None
+    conditions = [
+        db.or_(*[db.and_(ScreeningTime.date >= start, ScreeningTime.date < end) for start, end in ranges])
+    ]
+    if filters.price_min is not None:
+        conditions.append(ScreeningTime.price >= filters.price_min)
+    if filters.price_max is not None:
+        conditions.append(ScreeningTime.price <= filters.price_max)
+    if filters.area:
+        conditions.append(Cinema.location.contains(filters.area, autoescape=True))
+    return conditions
+
+
+def search_showtimes(filters, cursor=None, per_page=20, now=None):
+    """
+    依條件搜尋場次，依 (開演時間, id) 排序，以 keyset cursor 往後翻頁
+    回傳 (rows, next_cursor)
+    """
+    now = now or datetime.now()
+    conditions = _base_conditions(filters, now)
+    if conditions is None:
+        return [], None
+    if filters.cinema_ids:
+        conditions.append(ScreeningTime.cinema_id.in_(filters.cinema_ids))
+    if filters.genres:
+        conditions.append(_genre_clause(filters.genres))
+    values, direction = decode_cursor(cursor, 2)
+    if values is not None and direction == "next":
+        try:
+            after = (datetime.fromisoformat(values[0]), int(values[1]))
+        except (TypeError, ValueError):
+            after = None
+        if after is not None:
+            conditions.append(tuple_(ScreeningTime.date, ScreeningTime.id) > tuple_(*after))
+
+    rows = (
+        db.session.query(
+            ScreeningTime.id,
+            ScreeningTime.date,
+            ScreeningTime.price,
+            ScreeningTime.movie_id,
+            Movie.title,
+            Movie.genre,
+            Movie.poster_url,
+            ScreeningTime.cinema_id,
+            Cinema.name.label("cinema_name"),
+            Cinema.location.label("cinema_location"),
+            Hall.name.label("hall_name"),
+        )
+        .join(Movie, ScreeningTime.movie_id == Movie.id)
+        .join(Cinema, ScreeningTime.cinema_id == Cinema.id)
+        .join(Hall, ScreeningTime.hall_id == Hall.id)
+        .filter(*conditions)
+        .order_by(ScreeningTime.date, ScreeningTime.id)
+        .limit(per_page + 1)
+        .all()
+    )
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor([rows[-1].date.isoformat(), rows[-1].id], "next")
+    return rows, next_cursor
+
+
+def _facet_key(filters, now):
+    # facet 本身的條件（影城、類型）不放進 key：同一組基本條件的各種勾選共用一份分組結果
+    signature = (
+        filters.date_from.isoformat(),
+        filters.date_to.isoformat(),
+        ",".join(filters.time_slots),
+        filters.price_min,
+        filters.price_max,
+        filters.area,
+        now.isoformat(timespec="minutes"),
+    )
+    return f"showtime_facets:{cache.version('showtimes')}:{signature!r}"
+
+
+def _facet_rows(filters, now):
+    """一次 GROUP BY (影城, 電影類型, 日期) 的場次數"""
+    conditions = _base_conditions(filters, now)
+    if conditions is None:
+        return []
+    day = db.func.date(ScreeningTime.date)
+    rows = (
+        db.session.query(
+            ScreeningTime.cinema_id,
+            Cinema.name,
+            Movie.genre,
+            day.label("day"),
+            db.func.count(ScreeningTime.id),
+        )
+        .join(Movie, ScreeningTime.movie_id == Movie.id)
+        .join(Cinema, ScreeningTime.cinema_id == Cinema.id)
+        .filter(*conditions)
+        .group_by(ScreeningTime.cinema_id, Cinema.name, Movie.genre, day)
+        .all()
+    )
+    return [tuple(row) for row in rows]
+
+
+def facet_counts(filters, now=None):
+    """
+    各 facet 的場次數：{"cinema": [(id, 名稱, 數量)], "genre": [(類型, 數量)], "day": [(日期, 數量)], "total": 數量}
+    分組結果依基本條件快取；每個 facet 套用其他 facet 的勾選、不套用自己的，
+    讓使用者看到改選該項目後會有幾場
+    """
+    now = now or datetime.now()
+    bucket = now.replace(second=0, microsecond=0)
+    bucket -= timedelta(minutes=bucket.minute % FACET_NOW_BUCKET)
+    rows = cache.get_or_compute(
+        _facet_key(filters, bucket), lambda: _facet_rows(filters, bucket), FACET_CACHE_TIMEOUT
+    )
+
+    selected_cinemas = set(filters.cinema_ids)
+    selected_genres = set(filters.genres)
+    cinemas, cinema_names, genres, days = Counter(), {}, Counter(), Counter()
+    total = 0
+    for cinema_id, cinema_name, genre, day, count in rows:
+        genre_parts = split_genres(genre)
+        cinema_match = not selected_cinemas or cinema_id in selected_cinemas
+        genre_match = not selected_genres or not selected_genres.isdisjoint(genre_parts)
+        if genre_match:
+            cinemas[cinema_id] += count
+            cinema_names[cinema_id] = cinema_name
+        if cinema_match:
+            for part in genre_parts:
+                genres[part] += count
+        if cinema_match and genre_match:
+            days[day] += count
+            total += count
+    return {
+        "cinema": sorted(
+            ((cinema_id, cinema_names[cinema_id], count) for cinema_id, count in cinemas.items()),
+            key=lambda item: (-item[2], item[1]),
+        ),
+        "genre": sorted(genres.items(), key=lambda item: (-item[1], item[0])),
+        "day": sorted(days.items()),
+        "total": total,
+    }
+
+
+def invalidate_showtime_facets():
+    """場次或電影類型異動時呼叫，舊的 facet 快取全部失效"""
+    cache.bump_version("showtimes")
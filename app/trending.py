@@ -0,0 +1,172 @@
+# trending.py
+import math
+import os
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from app import db
+from app.cache import cached
+from app.models import Movie, Review, TrendingBucket, User
+
+TRENDING_FLUSH_WORKER = "trending-flush"
+BUCKET_SECONDS = 300
+WINDOW_HOURS = 48
+HALF_LIFE_HOURS = 6
+WEIGHTS = {"booking": 3.0, "review": 2.0, "favorite": 1.0}
+
+_PENDING_KEY = "trending_events"
+
+
+def bucket_start(when, bucket_seconds=BUCKET_SECONDS):
+    """時間對齊到所屬區間的起點"""
+    epoch = int(when.timestamp())
+    return datetime.fromtimestamp(epoch - epoch % bucket_seconds)
+
+
+class TrendingCounters:
+    """
+    process 內的分桶計數器：{(區間起點, movie_id, kind): 次數}
+    只累積尚未寫入資料表的增量，flush 時整批以 upsert 加到 TrendingBucket
+    """
+
+    def __init__(self, bucket_seconds=BUCKET_SECONDS):
+        self.bucket_seconds = bucket_seconds
+        self._counts = Counter()
+        self._lock = threading.Lock()
+        # fork 出來的子 process 不沿用父 process 尚未寫入的計數
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, movie_id, kind, count=1, when=None):
+        key = (bucket_start(when or datetime.now(), self.bucket_seconds), movie_id, kind)
+        with self._lock:
+            self._counts[key] += count
+
+    def drain(self):
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+        return counts
+
+    def restore(self, counts):
+        """寫入失敗時把增量放回去，下一輪再寫"""
+        with self._lock:
+            self._counts.update(counts)
+
+
+counters = TrendingCounters()
+
+
+# ---- 事件：交易提交後才計數，rollback 的不算 ----
+
+def record_after_commit(session, movie_id, kind, count=1):
+    session.info.setdefault(_PENDING_KEY, []).append((movie_id, kind, count, datetime.now()))
+
+
+@event.listens_for(Session, "after_commit")
+def _count_committed(session):
+    for movie_id, kind, count, when in session.info.pop(_PENDING_KEY, ()):
+        counters.record(movie_id, kind, count, when)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_rolled_back(session, previous_transaction):
+    session.info.pop(_PENDING_KEY, None)
+
+
+@event.listens_for(Review, "after_insert")
+def _review_added(mapper, connection, target):
+    session = db.object_session(target)
+    if session is not None:
+        record_after_commit(session, target.movie_id, "review")
+
+
+@event.listens_for(User.favorite_movies, "append")
+def _favorite_added(target, value, initiator):
+    session = db.object_session(target)
+    if session is not None and value.id is not None:
+        record_after_commit(session, value.id, "favorite")
+
+
+# ---- 寫入與查詢 ----
+
+def flush_counters():
+    """背景 worker：把各區間的增量累加到 TrendingBucket，並刪除超出時間窗的區間"""
+    counts = counters.drain()
+    window = timedelta(hours=current_app.config.get("TRENDING_WINDOW_HOURS", WINDOW_HOURS))
+    try:
+        if counts:
+            stmt = sqlite_insert(TrendingBucket)
+            db.session.execute(
+                stmt.on_conflict_do_update(
+                    index_elements=[TrendingBucket.bucket_start, TrendingBucket.movie_id, TrendingBucket.kind],
+                    set_={"count": TrendingBucket.count + stmt.excluded.count},
+                ),
+                [
+                    {"bucket_start": start, "movie_id": movie_id, "kind": kind, "count": count}
+                    for (start, movie_id, kind), count in counts.items()
+                ],
+            )
+        db.session.execute(
+            db.delete(TrendingBucket).where(TrendingBucket.bucket_start < datetime.now() - window)
+        )
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        counters.restore(counts)
+        raise
+    return len(counts)
+
+
+def trending_scores(now=None):
+    """
+    讀取時間窗內的區間（只讀 TrendingBucket，不掃描 Booking）
+    score = Σ 權重 × 次數 × 0.5^(經過小時 / 半衰期)
+    """
+    now = now or datetime.now()
+    config = current_app.config
+    window = timedelta(hours=config.get("TRENDING_WINDOW_HOURS", WINDOW_HOURS))
+    half_life = config.get("TRENDING_HALF_LIFE_HOURS", HALF_LIFE_HOURS)
+    weights = config.get("TRENDING_WEIGHTS", WEIGHTS)
+    scores = Counter()
+    rows = db.session.execute(
+        db.select(
+            TrendingBucket.bucket_start, TrendingBucket.movie_id, TrendingBucket.kind, TrendingBucket.count
+        ).where(TrendingBucket.bucket_start >= now - window)
+    )
+    for start, movie_id, kind, count in rows:
+        age_hours = max((now - start).total_seconds(), 0) / 3600
+        scores[movie_id] += weights.get(kind, 0) * count * math.pow(0.5, age_hours / half_life)
+    return scores
+
+
+@cached(timeout=60, key_prefix="trending")
+def trending_movies(limit=5):
+    """首頁「熱門」列表，快取為純資料"""
+    scores = trending_scores()
+    best = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limit]
+    if not best:
+        return []
+    movie_ids = [movie_id for movie_id, _ in best]
+    movies = {movie.id: movie for movie in Movie.query.filter(Movie.id.in_(movie_ids))}
+    return [
+        {
+            "id": movie.id,
+            "title": movie.title,
+            "poster_url": movie.poster_url,
+            "rating": movie.rating,
+            "comments_count": movie.comments_count,
+            "score": round(score, 2),
+        }
+        for movie_id, score in best
+        if (movie := movies.get(movie_id)) is not None
+    ]
@@ -0,0 +1,182 @@
+# warmup.py
+import os
+import pickle
+import time as time_module
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from app import db
+from app.booking import booked_seats, booked_seats_for
+from app.models import Cinema, Hall, ScreeningTime, TableVersion
+from app.routes import cinema_list, home_movie_lists
+from app.scheduling import load_all_cinema_days, prime_cinema_days
+from app.seating import compile_layout, default_layout
+
+WARMUP_WORKER = "cache_warmup"
+SNAPSHOT_FORMAT = 1  # 快照內容的格式改變時加一，舊快照直接忽略
+
+# 快照中的一個區塊：tables 為內容依賴的資料表，載入時版本號不同就丟棄該區塊
+Section = namedtuple("Section", ["name", "tables", "compute", "prime"])
+
+
+def _compute_schedules(now, config):
+    cinema_ids = [cinema_id for cinema_id, in db.session.query(Cinema.id)]
+    return load_all_cinema_days(cinema_ids, now.date(), config["CACHE_WARMUP_SCHEDULE_DAYS"])
+
+
+def _compute_seats(now, config):
+    """接下來幾小時內開演的場次：已訂座位與影廳配置"""
+    rows = (
+        db.session.query(ScreeningTime.id, Hall.layout, Hall.size)
+        .join(Hall, ScreeningTime.hall_id == Hall.id)
+        .filter(
+            ScreeningTime.date >= now,
+            ScreeningTime.date < now + timedelta(hours=config["CACHE_WARMUP_SEAT_HOURS"]),
+        )
+        .all()
+    )
+    return {
+        "booked": booked_seats_for([row.id for row in rows]),
+        "layouts": sorted({row.layout or default_layout(row.size) for row in rows}),
+    }
+
+
+def _prime_seats(entries):
+    for screening_id, seats in entries["booked"].items():
+        booked_seats.prime(seats, screening_id)
+    # 座位表片段是 process 內的 lru_cache，不進快取後端，直接預先編譯
+    for encoded in entries["layouts"]:
+        compile_layout(encoded)
+
+
+SECTIONS = [
+    Section(
+        "home",
+        ("movie",),
+        lambda now, config: home_movie_lists.uncached(),
+        home_movie_lists.prime,
+    ),
+    Section(
+        "cinemas",
+        ("cinema", "hall"),
+        lambda now, config: cinema_list.uncached(),
+        cinema_list.prime,
+    ),
+    Section(
+        "schedules",
+        ("movie", "cinema", "hall", "screening_time"),
+        _compute_schedules,
+        prime_cinema_days,
+    ),
+    Section("seats", ("hall", "screening_time", "booking"), _compute_seats, _prime_seats),
+]
+
+
+def _all_tables():
+    return sorted({table for section in SECTIONS for table in section.tables})
+
+
+def snapshot_path(app):
+    return app.config.get("CACHE_SNAPSHOT_PATH") or os.path.join(
+        app.instance_path, "cache_snapshot.pickle"
+    )
+
+
+def build_snapshot(now=None):
+    """
+    重新計算各區塊，回傳快照 dict
+    版本號在計算前讀取：計算期間有寫入時，快照記錄的是較舊的版本，下次載入會被丟棄
+    """
+    now = now or datetime.now()
+    versions = TableVersion.current(_all_tables())
+    config = current_app.config
+    sections = {}
+    for section in SECTIONS:
+        sections[section.name] = {
+            "versions": {table: versions[table] for table in section.tables},
+            "value": section.compute(now, config),
+        }
+    return {
+        "format": SNAPSHOT_FORMAT,
+        "database": config["SQLALCHEMY_DATABASE_URI"],
+        "created_at": time_module.time(),
+        "sections": sections,
+    }
+
+
+def prime_snapshot(snapshot, versions=None):
+    """把快照中版本號仍相符的區塊寫入快取，回傳載入的區塊名稱"""
+    versions = versions or TableVersion.current(_all_tables())
+    loaded = []
+    for section in SECTIONS:
+        stored = snapshot["sections"].get(section.name)
+        if stored is None:
+            continue
+        if any(stored["versions"].get(table) != versions[table] for table in section.tables):
+            continue
+        section.prime(stored["value"])
+        loaded.append(section.name)
+    return loaded
+
+
+def save_snapshot(snapshot, path):
+    """先寫入暫存檔再 rename，其他 process 不會讀到寫一半的檔案"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        pickle.dump(snapshot, f, pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, path)
+
+
+def load_snapshot(app):
+    """啟動時從快照載入快取，檔案不存在、格式不符、過期或讀取失敗時略過，回傳載入的區塊名稱"""
+    path = snapshot_path(app)
+    if not os.path.exists(path):
+        return []
+    started = time_module.perf_counter()
+    try:
+        with open(path, "rb") as f:
+            snapshot = pickle.load(f)
+        # 版本號只在同一個資料庫內有意義
+        if snapshot.get("format") != SNAPSHOT_FORMAT or snapshot.get("database") != app.config["SQLALCHEMY_DATABASE_URI"]:
+            return []
+        if time_module.time() - snapshot["created_at"] > app.config["CACHE_SNAPSHOT_MAX_AGE"]:
+            return []
+        with app.app_context():
+            loaded = prime_snapshot(snapshot)
+            db.session.remove()
+    except Exception:
+        # 資料表還沒建立（第一次啟動）或快照損毀，交給背景暖機重新計算
+        app.logger.warning("Cache snapshot could not be loaded", exc_info=True)
+        return []
+    app.logger.info(
+        "Cache snapshot loaded",
+        extra={"sections": loaded, "ms": round((time_module.perf_counter() - started) * 1000, 1)},
+    )
+    return loaded
+
+
+def warm_up():
+    """重新計算熱門資料、寫入快取並更新快照"""
+    started = time_module.perf_counter()
+    snapshot = build_snapshot()
+    for section in SECTIONS:
+        section.prime(snapshot["sections"][section.name]["value"])
+    save_snapshot(snapshot, snapshot_path(current_app))
+    current_app.logger.info(
+        "Cache warmed up",
+        extra={"ms": round((time_module.perf_counter() - started) * 1000, 1)},
+    )
+
+
+def init_warmup(app):
+    """
+    啟動時先從快照載入（毫秒級）
+    完整暖機由 WARMUP_WORKER 在啟動後 CACHE_WARMUP_DELAY 秒執行第一輪，之後定期更新快照；
+    prefork（serve.py）時跟著其他背景 worker 在第 0 號 worker process 執行
+    """
+    if not app.config["CACHE_WARMUP"]:
+        return
+    load_snapshot(app)
@@ -0,0 +1,117 @@
+# workers.py
+import threading
+from collections import namedtuple
+
+from app import db
+
+# 已啟動的背景 worker：{name: PeriodicWorker}
+_workers = {}
+
+# register_worker 登記的內容，存在 app.extensions["background_workers"][name]
+WorkerSpec = namedtuple("WorkerSpec", ["interval", "func", "per_process", "initial_delay"])
+
+
+class PeriodicWorker(threading.Thread):
+    """
+    在 app context 中週期性執行 func 的背景執行緒
+    wake() 可以讓 worker 不等 interval 立即執行下一輪
+    initial_delay 為第一輪前的等待秒數，預設與 interval 相同
+    """
+
+    def __init__(self, app, name, interval, func, initial_delay=None):
+        super().__init__(name=name, daemon=True)
+        self.app = app
+        self.interval = interval
+        self.initial_delay = interval if initial_delay is None else initial_delay
+        self.func = func
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+
+    def run(self):
+        delay = self.initial_delay
+        while not self._stopped.is_set():
+            # 先等待再執行，啟動時不和 create_all / 初始化資料搶資料庫
+            self._wake.wait(delay)
+            delay = self.interval
+            self._wake.clear()
+            if self._stopped.is_set():
+                return
+            with self.app.app_context():
+                try:
+                    self.func()
+                except Exception:
+                    db.session.rollback()
+                    self.app.logger.exception(f"Background worker {self.name} failed")
+                finally:
+                    db.session.remove()
+
+
+def register_worker(app, name, interval, func, per_process=False, initial_delay=None):
+    """
+    登記背景 worker，由 start_background_workers 統一啟動
+    per_process：處理的是 process 內的狀態（例如記憶體中的計數），prefork 時每個 worker process 都要執行
+    initial_delay：啟動後多久執行第一輪，預設等一個 interval
+    """
+    app.extensions.setdefault("background_workers", {})[name] = WorkerSpec(
+        interval, func, per_process, initial_delay
+    )
+
+
+def start_worker(app, name, interval, func, initial_delay=None):
+    """啟動具名 worker；已啟動時不重複啟動"""
+    worker = _workers.get(name)
+    if worker is not None and worker.is_alive():
+        return worker
+    worker = PeriodicWorker(app, name, interval, func, initial_delay)
+    _workers[name] = worker
+    worker.start()
+    return worker
+
+
+def start_background_workers(app, force=False, per_process_only=False):
+    """
+    啟動所有登記的 worker
+    BACKGROUND_WORKERS 關閉時不啟動（例如 prefork 的 master，改由指定的子 process 以 force 啟動）
+    per_process_only 時只啟動 per_process 的 worker（prefork 中第 0 號以外的 worker process）
+    """
+    if not force and not app.config.get("BACKGROUND_WORKERS", True):
+        return []
+    return [
+        start_worker(app, name, spec.interval, spec.func, spec.initial_delay)
+        for name, spec in app.extensions.get("background_workers", {}).items()
+        if spec.per_process or not per_process_only
+    ]
+
+
+def run_per_process_workers(app):
+    """process 結束前把 per_process worker 各執行一次，送出尚未寫入的狀態"""
+    for name, spec in app.extensions.get("background_workers", {}).items():
+        if not spec.per_process:
+            continue
+        with app.app_context():
+            try:
+                spec.func()
+            except Exception:
+                db.session.rollback()
+                app.logger.exception(f"Background worker {name} failed")
+            finally:
+                db.session.remove()
+
+
+def wake_worker(name):
+    worker = _workers.get(name)
+    if worker is not None:
+        worker.wake()
+
+
+def stop_workers():
+    for worker in _workers.values():
+        worker.stop()
+    _workers.clear()
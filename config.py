@@ -5,3 +5,105 @@ class Config:
     SECRET_KEY = os.environ.get("SECRET_KEY") or "your-secret-key-here"
     SQLALCHEMY_DATABASE_URI = "sqlite:///movie_database.db"
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # 背景 worker（檔案清除等）；測試或一次性指令可關閉
+    BACKGROUND_WORKERS = True
+    FILE_PURGE_INTERVAL = 60  # 秒
+
+    # Session 儲存方式：cookie（Flask 預設）/ memory（單機 LRU）/ sqlite（多 worker 共用）
+    SESSION_BACKEND = os.environ.get("SESSION_BACKEND", "memory")
+    SESSION_MEMORY_MAX_ENTRIES = 10000
+    SESSION_SWEEP_INTERVAL = 300  # 秒
+    SESSION_SWEEP_BATCH = 500
+
+    # 快取：memory（單一 process）/ sqlite（多 worker 共用，預設放在 instance/cache.db）
+    CACHE_BACKEND = os.environ.get("CACHE_BACKEND", "memory")
+    CACHE_SQLITE_PATH = os.environ.get("CACHE_SQLITE_PATH")
+    CACHE_DEFAULT_TIMEOUT = 60  # 秒
+    CACHE_STALE_TTL = 30  # 過期後仍可回傳舊資料的秒數
+    CACHE_LOCK_TIMEOUT = 10
+    CACHE_MEMORY_MAX_ENTRIES = 5000
+    CACHE_SWEEP_INTERVAL = 300
+
+    # 啟動暖機：先從 instance/ 的快照載入，再於背景重新計算首頁、影城列表、近幾天排程與即將開演場次的座位
+    CACHE_WARMUP = True
+    CACHE_WARMUP_DELAY = 2  # 秒，啟動後等待多久開始背景暖機
+    CACHE_WARMUP_SCHEDULE_DAYS = 3
+    CACHE_WARMUP_SEAT_HOURS = 6
+    CACHE_SNAPSHOT_PATH = os.environ.get("CACHE_SNAPSHOT_PATH")  # 預設 instance/cache_snapshot.pickle
+    CACHE_SNAPSHOT_INTERVAL = 600  # 秒，定期更新快照
+    CACHE_SNAPSHOT_MAX_AGE = 24 * 60 * 60  # 秒，超過就不載入
+
+    # 流量限制：每個 IP、每位使用者各一個 token bucket，依端點類別分開計算
+    # (桶容量, 每分鐘補充的 token 數)；超過時回傳 429 與 Retry-After
+    RATELIMIT_ENABLED = True
+    RATELIMIT_BACKEND = os.environ.get("RATELIMIT_BACKEND", "memory")  # memory / sqlite（多 worker 共用）
+    RATELIMIT_SQLITE_PATH = os.environ.get("RATELIMIT_SQLITE_PATH")  # 預設 instance/ratelimit.db
+    RATELIMIT_MEMORY_MAX_ENTRIES = 100000
+    RATELIMIT_SWEEP_INTERVAL = 300  # 秒
+    RATELIMIT_IDLE_SECONDS = 3600  # 閒置超過這麼久的桶已補滿，可以刪除
+    RATE_LIMITS = {
+        "booking": {"user": (10, 10), "ip": (30, 30)},
+        "review": {"user": (5, 2), "ip": (20, 10)},
+        "social": {"user": (10, 5), "ip": (30, 15)},
+        "favorite": {"user": (30, 30), "ip": (60, 60)},
+        "polling": {"user": (30, 60), "ip": (120, 240)},
+    }
+
+    # 訂位寫入佇列：依場次分片，每個分片一個寫入執行緒，整批一次提交
+    BOOKING_EXECUTOR = True
+    BOOKING_SHARDS = 4
+    BOOKING_QUEUE_SIZE = 100  # 每個分片的佇列上限，滿了直接拒絕
+    BOOKING_BATCH_SIZE = 50
+    BOOKING_BATCH_WAIT = 0.005  # 秒，湊批次時等待後續請求的時間
+    BOOKING_TIMEOUT = 5  # 秒，request 等待結果的上限
+    BOOKING_LOCK_RETRIES = 3  # database is locked 時整批重試的次數
+
+    # 自動選位：一次最多幾人、選位後保留座位的秒數
+    SEAT_ALLOCATION_MAX_PARTY = 10
+    SEAT_HOLD_SECONDS = 300
+
+    # 附近影城：未指定半徑時逐步擴大搜尋的上限、一次最多回傳幾間、每間列出幾個場次
+    NEARBY_MAX_RADIUS_KM = 200
+    NEARBY_MAX_RESULTS = 50
+    NEARBY_SCREENINGS_PER_CINEMA = 3
+
+    # 場次搜尋：預設查詢天數、最長區間、每頁筆數
+    SHOWTIME_SEARCH_DAYS = 7
+    SHOWTIME_SEARCH_MAX_DAYS = 31
+    SHOWTIME_PAGE_SIZE = 20
+
+    # 相似電影推薦：背景定期重算有變動的部分，矩陣計算在獨立 process 中執行
+    RECOMMENDATION_INTERVAL = 600  # 秒
+    RECOMMENDATION_TOP_K = 10
+    RECOMMENDATION_PROCESS = True
+
+    # 熱門電影：各 process 在記憶體中分桶計數，定期累加到 trending_bucket
+    TRENDING_FLUSH_INTERVAL = 30  # 秒
+    TRENDING_WINDOW_HOURS = 48
+    TRENDING_HALF_LIFE_HOURS = 6
+    TRENDING_WEIGHTS = {"booking": 3.0, "review": 2.0, "favorite": 1.0}
+
+    # 封存：超過保留天數的場次（連同訂單、訂位）與已處理的好友邀請，分批搬到封存表
+    ARCHIVE_INTERVAL = 3600  # 秒
+    ARCHIVE_RETENTION_DAYS = 30
+    ARCHIVE_BATCH_SIZE = 200  # 每批場次數（一個交易）
+
+    # 一致性檢查：背景依主鍵分段比對反正規化欄位（評分、評論數、收藏數、上映中、好友雙向、
+    # 營運彙總、訂單金額），有偏差就修復；超賣的場次只記錄，不自動取消訂位
+    CONSISTENCY_INTERVAL = 300  # 秒；也決定場次過期後電影改為未上映的延遲
+    CONSISTENCY_CHUNK_SIZE = 500  # 每段的列數（一個短交易）
+    CONSISTENCY_CHUNK_PAUSE = 0.05  # 段與段之間暫停的秒數，讓出資料庫寫入鎖
+
+    # 管理者匯出：每次從游標讀取並送出的列數
+    EXPORT_CHUNK_SIZE = 1000
+
+    # 目錄匯入：每批驗證、寫入的列數（每批一個交易）
+    IMPORT_BATCH_SIZE = 1000
+
+    # 紀錄：寫入 queue 後由背景執行緒輸出，不阻塞 request
+    LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+    LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")  # json / text
+    LOG_FILE = os.environ.get("LOG_FILE")
+    LOG_LEVELS = {"werkzeug": "INFO", "sqlalchemy": "WARNING"}  # 個別模組的層級
+    LOG_SAMPLE_RATES = {"app.routes": 0.01}  # 高流量 DEBUG 紀錄的保留比例
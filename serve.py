@@ -0,0 +1,229 @@
+# serve.py
+"""
+正式環境啟動程式（prefork）
+
+    python serve.py --host 0.0.0.0 --port 5000 --workers 4
+
+- master 先在檔案鎖內執行一次 db.create_all() 與 init_db()
+- master 預先載入 create_app()，再 fork 出 N 個 worker（copy-on-write 共用記憶體）
+- 所有 worker 共用同一個 listening socket
+- SIGHUP：逐一替換 worker（rolling reload），服務不中斷
+- SIGTERM / SIGINT：等待處理中的請求完成後結束
+- worker 異常結束時自動補上
+"""
+import argparse
+import fcntl
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from werkzeug.serving import make_server
+
+GRACEFUL_TIMEOUT = 30  # 秒，worker 結束前等待處理中請求的時間
+SPAWN_GRACE = 1.0  # rolling reload 時新 worker 啟動後多久才停掉舊的
+
+
+@contextmanager
+def file_lock(path):
+    """跨 process 的檔案鎖，確保多個啟動程式不會同時建表或寫入種子資料"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def bootstrap(app):
+    """建表與初始化資料，只在 master 中於 fork 前執行一次"""
+    from app import db
+    from app.seed import init_db
+
+    with file_lock(os.path.join(app.instance_path, "bootstrap.lock")):
+        with app.app_context():
+            db.create_all()
+            init_db()
+            # fork 前關閉連線池，子 process 各自建立連線
+            db.engine.dispose()
+
+
+class InFlightCounter:
+    """WSGI middleware：記錄處理中的請求數，讓 worker 可以優雅地結束"""
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+        self.active = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        with self._lock:
+            self.active += 1
+        try:
+            return self.wsgi_app(environ, start_response)
+        finally:
+            with self._lock:
+                self.active -= 1
+
+    def wait_idle(self, timeout):
+        deadline = time.monotonic() + timeout
+        while self.active and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+
+def run_worker(app, listen_fd, index, threads):
+    """子 process：在共用的 socket 上提供服務，收到 SIGTERM 後停止接受新連線"""
+    from app.logs import shutdown_logging
+    from app.workers import run_per_process_workers, start_background_workers
+
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    # 背景 worker（檔案清除、session 清理等）只在第 0 號 worker 執行；
+    # 處理 process 內狀態的 worker（熱門計數寫入）每個 worker 都執行
+    start_background_workers(app, force=True, per_process_only=index != 0)
+
+    counter = InFlightCounter(app.wsgi_app)
+    app.wsgi_app = counter
+    server = make_server("0.0.0.0", 0, app, threaded=threads, fd=listen_fd)
+
+    def shutdown(signum, frame):
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    try:
+        server.serve_forever()
+    finally:
+        counter.wait_idle(GRACEFUL_TIMEOUT)
+        server.server_close()
+    run_per_process_workers(app)
+    # os._exit 不會執行 atexit，先送出剩餘的紀錄
+    shutdown_logging()
+    os._exit(0)
+
+
+class Master:
+    def __init__(self, app, sock, workers, threads):
+        self.app = app
+        self.sock = sock
+        self.size = workers
+        self.threads = threads
+        self.workers = {}  # pid -> index
+        self.stopping = False
+        self.reload_requested = False
+
+    def spawn(self, index):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(self.app, self.sock.fileno(), index, self.threads)
+            finally:
+                os._exit(1)
+        self.workers[pid] = index
+        self.app.logger.info(f"worker {index} started (pid {pid})")
+        return pid
+
+    def stop_worker(self, pid):
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    def reap(self):
+        """回收結束的子 process，非預期結束的 worker 立即補上"""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            index = self.workers.pop(pid, None)
+            if index is None:
+                continue
+            if not self.stopping and index not in self.workers.values():
+                self.app.logger.warning(f"worker {index} (pid {pid}) exited with {status}, respawning")
+                self.spawn(index)
+
+    def rolling_reload(self):
+        """逐一以新 worker 取代舊 worker，任何時間都有 worker 在接受連線"""
+        self.app.logger.info("rolling reload")
+        for old_pid, index in list(self.workers.items()):
+            # 先把舊 worker 移出對應表，避免 reap 時又補一個
+            self.workers.pop(old_pid, None)
+            self.spawn(index)
+            time.sleep(SPAWN_GRACE)
+            self.stop_worker(old_pid)
+            self.reap()
+
+    def run(self):
+        def on_stop(signum, frame):
+            self.stopping = True
+
+        def on_reload(signum, frame):
+            self.reload_requested = True
+
+        signal.signal(signal.SIGTERM, on_stop)
+        signal.signal(signal.SIGINT, on_stop)
+        signal.signal(signal.SIGHUP, on_reload)
+
+        for index in range(self.size):
+            self.spawn(index)
+
+        while not self.stopping:
+            if self.reload_requested:
+                self.reload_requested = False
+                self.rolling_reload()
+            self.reap()
+            time.sleep(0.5)
+
+        self.app.logger.info("shutting down workers")
+        for pid in list(self.workers):
+            self.stop_worker(pid)
+        deadline = time.monotonic() + GRACEFUL_TIMEOUT + 5
+        while self.workers and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        for pid in list(self.workers):
+            os.kill(pid, signal.SIGKILL)
+        self.sock.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prefork WSGI launcher for MovieBooker")
+    parser.add_argument("--host", default=os.environ.get("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 5000)))
+    parser.add_argument(
+        "--workers", type=int, default=int(os.environ.get("WEB_WORKERS", os.cpu_count() or 1))
+    )
+    parser.add_argument("--threads", action="store_true", help="每個 worker 以多執行緒處理請求")
+    args = parser.parse_args(argv)
+
+    from app import create_app
+
+    overrides = {"BACKGROUND_WORKERS": False, "DEBUG": False}
+    if args.workers > 1:
+        # 多個 process 時 session、快取與流量限制的 token bucket 必須放在共用的 SQLite
+        overrides.update(
+            {"SESSION_BACKEND": "sqlite", "CACHE_BACKEND": "sqlite", "RATELIMIT_BACKEND": "sqlite"}
+        )
+    app = create_app(overrides)
+    bootstrap(app)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(1024)
+    sock.set_inheritable(True)
+
+    app.logger.info(f"listening on {args.host}:{args.port} with {args.workers} worker(s)")
+    Master(app, sock, args.workers, args.threads).run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())